@@ -18,4 +18,15 @@ RETURN c1,int,inc,c2,ch1,ch2,r1,r2,r3,r4,r5
 MATCH (ci_sc:CI_SC {sysId:"WBS000098_APP000003"})<-[:CORR]-(e:Event) -[df:DF]-> (e2:Event)-[:CORR]->(ci_sc)
 RETURN e,df,e2
 
-WBS000253_ADB000028
\ No newline at end of file
+WBS000253_ADB000028
+
+// get the event that follows every Open incident event in its incident, using the sequence index (:SEQ edges of build_df_edges)
+MATCH (e1:Event {eventType: 'IncidentEvent', activity: 'Open'}) - [s1:SEQ {sequence: 'Incident'}] -> (:Incident)
+MATCH (e2) - [s2:SEQ] -> () WHERE s2.id = s1.id AND s2.sequence = 'Incident' AND s2.position = s1.position + 1
+RETURN e1.eventType + ':' + e1.activity as first_event, e2.eventType + ':' + e2.activity as second_event, count(e1) as count order by count DESC
+
+// get the timeline of a CI_SC in a time window, using the sequence index
+MATCH (e:Event) - [seq:SEQ] -> ()
+WHERE seq.id = "WBS000098_APP000003" AND seq.sequence = 'CI_SC'
+  AND datetime("2014-01-01T00:00:00+01:00") <= seq.timestamp < datetime("2014-02-01T00:00:00+01:00")
+RETURN seq.position, e ORDER BY seq.position
@@ -0,0 +1,187 @@
+"""
+End-to-end benchmark of the EKG build on synthetic BPIC14-shaped data.
+
+For every scale factor, the synthetic data is generated, prepared and loaded into the database of the configuration
+file, after which all steps of the notebooks are executed up to the inference of the high-level events.
+Per stage, the duration, the number of created nodes and relationships, the throughput and the peak memory of the
+client (Python) and of the database (heap usage) are recorded.
+
+!!! The database in the configuration file is cleared before every run !!!
+
+Usage: python benchmark.py --scales 0.1 1 10 [--conf bpic14/config.yaml] [--work-dir benchmark_data]
+                           [--output benchmark_results.csv] [--format csv|parquet]
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+import yaml
+
+from bpic14 import bpic14_configs as configs
+from bpic14.bpic14_prepare import prepare
+from bpic14.generate_synthetic_data import generate
+from util.assign_types_functions import add_object_type_node, add_event_type_node
+from util.db_helper_functions import get_db_connection, clear_database, load_data
+from util.enrichment_methods import materialize_objects, extend_relationships, build_df_edges, infer_start_event, \
+    infer_end_event, infer_high_level_events_based_on_start_and_end_events
+from util.transformer_functions import build_entities, build_relationships
+
+raw_files = ["Detail_Change.csv", "Detail_Incident_Activity.csv"]
+
+
+def create_benchmark_config(_conf_path, _work_dir):
+    """
+    Create a copy of the configuration and the dataset description that point to the synthetic data in _work_dir.
+    """
+    with open(_conf_path) as f:
+        config = yaml.safe_load(f)
+    with open(config["dataset_description_path"]) as f:
+        dataset_descriptions = json.load(f)
+
+    for dataset_description in dataset_descriptions:
+        directory = _work_dir if dataset_description["file_name"] in raw_files else os.path.join(_work_dir,
+                                                                                                  "prepared")
+        # promg joins the directory to the working directory using "\\" as separator
+        dataset_description["file_directory"] = os.path.relpath(directory).replace(os.sep, "\\") + "\\"
+
+    dataset_description_path = os.path.join(_work_dir, "BPIC14_DS.json")
+    with open(dataset_description_path, "w") as f:
+        json.dump(dataset_descriptions, f, indent=2)
+
+    config["dataset_description_path"] = dataset_description_path
+    config["use_sample"] = False
+    config["use_preprocessed_files"] = False
+    benchmark_conf_path = os.path.join(_work_dir, "config.yaml")
+    with open(benchmark_conf_path, "w") as f:
+        yaml.safe_dump(config, f)
+    return benchmark_conf_path
+
+
+def get_heap_usage_mb(_db_connection):
+    query = '''
+        CALL dbms.queryJmx("java.lang:type=Memory") YIELD attributes
+        RETURN attributes.HeapMemoryUsage.value.properties.used as used
+    '''
+    result = _db_connection.exec_query(query)
+    if not result:
+        return None
+    return round(result[0]["used"] / 2 ** 20, 1)
+
+
+def get_record_count(_db_connection):
+    result = _db_connection.exec_query("MATCH (r:Record) RETURN count(r) as count")
+    return result[0]["count"] if result else None
+
+
+def get_stages(_db_connection, _conf_path, _work_dir, _format="csv"):
+    """
+    The stages of the EKG build in order, with a function that executes the stage and returns the number of processed
+    rows if these are not counted by the instrumented connection.
+    """
+
+    def assign_types():
+        for label in configs.objects.keys():
+            add_object_type_node(_db_connection=_db_connection, _object_type=label)
+        for label in configs.EVENTS.keys():
+            add_event_type_node(_db_connection=_db_connection, event_type=label)
+
+    def extend():
+        extend_relationships(_db_connection, configs.o2o_relationships_to_extend)
+        extend_relationships(_db_connection, configs.e2o_relationships_to_extend)
+
+    def df_edges():
+        for object_type, event_types in configs.df_object_types_with_event_types.items():
+            build_df_edges(_db_connection, object_type, event_types)
+
+    def start_end_events():
+        for object_type, event_types in configs.start_end_object_types_with_event_types.items():
+            infer_start_event(_db_connection=_db_connection, _object_type=object_type, _event_types=event_types)
+            infer_end_event(_db_connection=_db_connection, _object_type=object_type, _event_types=event_types)
+
+    def high_level_events():
+        for object_type in configs.start_end_object_types_with_event_types.keys():
+            infer_high_level_events_based_on_start_and_end_events(_db_connection=_db_connection,
+                                                                  _object_type=object_type,
+                                                                  _hle_event_type='HighLevelEvent')
+
+    return [
+        ("prepare", lambda: sum(result["rows"] for result in prepare(
+            _output_format=_format, _input_path=_work_dir, _output_path=os.path.join(_work_dir, "prepared")))),
+        ("load_data", lambda: load_data(_db_connection, conf_path=_conf_path,
+                                        parquet_path=os.path.join(_work_dir, "prepared") if _format == "parquet"
+                                        else None) or get_record_count(_db_connection)),
+        ("build_entities (objects)", lambda: build_entities(_db_connection, entities=configs.objects)),
+        ("build_relationships (o2o)", lambda: build_relationships(_db_connection, configs.o2o_relationships)),
+        ("build_entities (events)", lambda: build_entities(_db_connection, entities=configs.EVENTS)),
+        ("build_relationships (e2o)", lambda: build_relationships(_db_connection, configs.e2o_relationships)),
+        ("assign_types", assign_types),
+        ("materialize_objects", lambda: materialize_objects(_db_connection, configs.objects_to_materialize)),
+        ("extend_relationships", extend),
+        ("build_df_edges", df_edges),
+        ("infer_start_end_events", start_end_events),
+        ("infer_high_level_events", high_level_events)
+    ]
+
+
+def run_benchmark(_scale, _conf_path, _work_dir, _format="csv"):
+    work_dir = os.path.abspath(os.path.join(_work_dir, f"scale_{_scale}"))
+    print(f"\n=== BENCHMARK scale {_scale} ===")
+    generated_rows = generate(_scale=_scale, _output_path=work_dir)
+    benchmark_conf_path = create_benchmark_config(_conf_path, work_dir)
+
+    db_connection = get_db_connection(benchmark_conf_path, instrumented=True)
+    clear_database(db_connection)
+
+    results = []
+    for stage, execute in get_stages(db_connection, benchmark_conf_path, work_dir, _format):
+        num_steps = len(db_connection.rows)
+        tracemalloc.start()
+        start = time.perf_counter()
+        processed_rows = execute()
+        duration = time.perf_counter() - start
+        _, client_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        steps = pd.DataFrame(db_connection.rows[num_steps:])
+        nodes = int(steps["nodes_created"].sum()) if len(steps) else 0
+        relationships = int(steps["relationships_created"].sum()) if len(steps) else 0
+        if processed_rows is None:
+            processed_rows = nodes + relationships
+
+        results.append({
+            "scale": _scale,
+            "input_rows": sum(generated_rows.values()),
+            "stage": stage,
+            "seconds": round(duration, 2),
+            "nodes_created": nodes,
+            "relationships_created": relationships,
+            "rows/s": round(processed_rows / duration) if duration > 0 else None,
+            "client_peak_mb": round(client_peak / 2 ** 20, 1),
+            "db_heap_used_mb": get_heap_usage_mb(db_connection)
+        })
+        print(f"→ {stage}: {results[-1]['seconds']}s, {results[-1]['rows/s']} rows/s")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the EKG build on synthetic BPIC14-shaped data")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.1, 1.0])
+    parser.add_argument("--conf", default=str(Path('bpic14', 'config.yaml')))
+    parser.add_argument("--work-dir", default="benchmark_data")
+    parser.add_argument("--output", default="benchmark_results.csv")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="format of the prepared files that are loaded")
+    args = parser.parse_args()
+
+    all_results = []
+    for scale in args.scales:
+        all_results.extend(run_benchmark(scale, args.conf, args.work_dir, args.format))
+        pd.DataFrame(all_results).to_csv(args.output, index=False)
+
+    print(pd.DataFrame(all_results).to_string(index=False))
@@ -0,0 +1,645 @@
+"""
+Configurations of the EKG build as defined in the notebooks, so they can also be used outside of Jupyter.
+"""
+
+# Log names
+bpic14_incident = "BPIC14Incident.csv"
+bpic14_interaction = "BPIC14Interaction.csv"
+bpic14_change = "Detail_Change.csv"
+bpic14_incident_activity = "Detail_Incident_Activity.csv"
+
+# 1. Map entities into objects and events (1_map_entities_into_pm_concepts+2_assign_types.ipynb)
+objects = {
+    "Incident": [
+        {
+            "log": bpic14_incident,
+            "sysId": "incidentId",
+            "attributes": {
+                "incidentId": "incidentId",
+                "status": "status",
+                "impact": "impact",
+                "priority": "priority",
+                "category": "category",
+                "handleTimeHours": "handleTimeHours",
+                "closureCode": "closureCode",
+                "alertStatus": "alertStatus"
+            },
+        },
+        {
+            "log": bpic14_interaction,
+            "sysId": "relatedIncident",
+            "attributes": {
+                "incidentId": "relatedIncident"
+            },
+            "constants": {
+                "derivedFromInteraction": True
+            }
+        },
+
+        {
+            "log": bpic14_incident_activity,
+            "sysId": "incidentId",
+            "attributes": {
+                "incidentId": "incidentId"
+            }
+        }
+    ],
+    "Interaction": [
+        {
+            "log": bpic14_interaction,
+            "sysId": "interactionId",
+            "attributes": {
+                "interactionId": "interactionId",
+                "status": "status",
+                "impact": "impact",
+                "priority": "priority",
+                "category": "category",
+                "closureCode": "closureCode",
+                "firstCallResolution": "firstCallResolution"
+            },
+        },
+        {
+            "log": bpic14_incident,
+            "sysId": "relatedInteraction",
+            "attributes": {
+                "interactionId": "relatedInteraction"
+            },
+        }
+    ],
+    "Change": [
+        {
+            "log": bpic14_change,
+            "sysId": "changeId",
+            "attributes": {
+                "changeId": "changeId",
+                "type": "changeType",
+                "riskAssessment": "riskAssessment",
+                "cabApprovalNeeded": "cabApprovalNeeded",
+                "plannedStart": "plannedStart",
+                "plannedEnd": "plannedEnd",
+                "scheduledDowntimeStart": "scheduledDowntimeStart",
+                "scheduledDowntimeEnd": "scheduledDowntimeEnd",
+                "requestedEndDate": "requestedEndDate",
+                "originatedFrom": "originatedFrom"
+            },
+        }, {
+            "log": bpic14_incident,
+            "sysId": "relatedChange",
+            "attributes": {
+                "changeId": "relatedChange"
+            },
+            "constants": {
+                "derivedFromIncident": True
+            }
+        }
+    ],
+    "KnowledgeDocument": [
+        {
+            "log": None,
+            "sysId": "kmNumber",
+            "attributes": {"kmNumber": "kmNumber"}
+        }
+    ],
+    "ConfigurationItem": [
+        {  # affected CIs
+            "log": None,
+            "sysId": "ciNameAff",
+            "attributes": {
+                "ciName": "ciNameAff",
+                "ciType": "ciTypeAff",
+                "ciSubtype": "ciSubtypeAff"
+            },
+            "constants": {
+                "affected": True
+            }
+        },
+        {  # caused by CIs
+            "log": bpic14_incident,
+            "sysId": "ciNameCby",
+            "attributes": {
+                "ciName": "ciNameCby",
+                "ciType": "ciTypeCby",
+                "ciSubtype": "ciSubtypeCby"
+            },
+            "constants": {
+                "caused": True
+            }
+
+        }
+
+    ],
+    "ServiceComponent": [
+        {  # affected SCs
+            "log": None,
+            "sysId": "serviceComponentAff",
+            "attributes": {
+                "scName": "serviceComponentAff"
+            },
+            "constants": {
+                "affected": True
+            }
+        },
+        {  # caused by SCs
+            "log": bpic14_incident,
+            "sysId": "serviceComponentCBy",
+            "attributes": {
+                "scName": "serviceComponentCBy"
+            },
+            "constants": {
+                "caused": True
+            }
+        },
+    ]
+}
+
+o2o_relationships = {
+    "USED_KM": [{
+        "from_object": {
+            "label": "Incident|Interaction"
+        },
+        "to_object": {
+            "label": "KnowledgeDocument",
+            "foreign_key": "kmNumber"
+        }
+    }],
+    "RELATED_CHANGE": [{
+        "from_object": {
+            "label": "Incident"
+        },
+        "to_object": {
+            "label": "Change",
+            "foreign_key": "relatedChange"
+        }
+    }],
+    "RELATED_INCIDENT": [
+        {
+            "from_object": {
+                "label": "Interaction"
+            },
+            "to_object": {
+                "label": "Incident",
+                "foreign_key": "relatedIncident"
+            }
+        },
+        {
+            "from_object": {
+                "label": "Interaction",
+                "foreign_key": "relatedInteraction"
+            },
+            "to_object": {
+                "label": "Incident"
+            },
+            "constants": {
+                "primary": True
+            }
+        }],
+    "AFFECTED_CI": [{
+        "from_object": {
+            "label": "Incident"
+        },
+        "to_object": {
+            "label": "ConfigurationItem",
+            "foreign_key": "ciNameAff",
+        },
+        "log": bpic14_incident
+    },
+        {
+            "from_object": {
+                "label": "Interaction"
+            },
+            "to_object": {
+                "label": "ConfigurationItem",
+                "foreign_key": "ciNameAff",
+            },
+            "log": bpic14_interaction
+        },
+        {
+            "from_object": {
+                "label": "Change"
+            },
+            "to_object": {
+                "label": "ConfigurationItem",
+                "foreign_key": "ciNameAff",
+            },
+            "log": bpic14_change
+        }],
+    "AFFECTED_SC": [{
+        "from_object": {
+            "label": "Incident"
+        },
+        "to_object": {
+            "label": "ServiceComponent",
+            "foreign_key": "serviceComponentAff",
+        },
+        "log": bpic14_incident
+    },
+        {
+            "from_object": {
+                "label": "Interaction"
+            },
+            "to_object": {
+                "label": "ServiceComponent",
+                "foreign_key": "serviceComponentAff",
+            },
+            "log": bpic14_interaction
+        },
+        {
+            "from_object": {
+                "label": "Change"
+            },
+            "to_object": {
+                "label": "ServiceComponent",
+                "foreign_key": "serviceComponentAff"
+            },
+            "log": bpic14_change
+        }],
+    "CAUSED_BY_CI": [{
+        "from_object": {
+            "label": "Incident"
+        },
+        "to_object": {
+            "label": "ConfigurationItem",
+            "foreign_key": "ciNameCby"
+        },
+    }],
+    "CAUSED_BY_SC": [{
+        "from_object": {
+            "label": "Incident"
+        },
+        "to_object": {
+            "label": "ServiceComponent",
+            "foreign_key": "serviceComponentCBy"
+        },
+    }],
+    "CONTAINS": [{
+        "from_object": {
+            "label": "ServiceComponent",
+            "foreign_key": "serviceComponentAff"
+        },
+        "to_object": {
+            "label": "ConfigurationItem",
+            "foreign_key": "ciNameAff"
+        },
+    }, {
+        "from_object": {
+            "label": "ServiceComponent",
+            "foreign_key": "serviceComponentCBy"
+        },
+        "to_object": {
+            "label": "ConfigurationItem",
+            "foreign_key": "ciNameCby"
+        },
+    }]
+}
+
+EVENTS = {
+    "IncidentEvent": [
+        {
+            "log": bpic14_incident,
+            "sysId": "incidentId",
+            "id_addition": "_Open",
+            "attributes": {
+                "timestamp": "openTime"
+            },
+            "constants": {
+                "activity": "'Open'"
+            }
+        }, {
+            "log": bpic14_incident,
+            "sysId": "incidentId",
+            "id_addition": "_Resolve",
+            "attributes": {
+                "timestamp": "resolvedTime"
+            },
+            "constants": {
+                "activity": "'Resolve'"
+            }
+        }, {
+            "log": bpic14_incident,
+            "sysId": "incidentId",
+            "id_addition": "_Close",
+            "attributes": {
+                "timestamp": "closeTime"
+            },
+            "constants": {
+                "activity": "'Close'"
+            }
+        }
+    ],
+    "ChangeEvent": [
+        {
+            "log": bpic14_change,
+            "sysId": "changeId",
+            "id_addition": "_Start",
+            "attributes": {
+                "timestamp": "actualStart"
+            },
+            "constants": {
+                "activity": "'Start'"
+            }
+        }, {
+            "log": bpic14_change,
+            "sysId": "changeId",
+            "id_addition": "_End",
+            "attributes": {
+                "timestamp": "actualEnd"
+            },
+            "constants": {
+                "activity": "'End'"
+            }
+        }
+    ],
+    "InteractionEvent": [
+        {
+            "log": bpic14_interaction,
+            "sysId": "interactionId",
+            "id_addition": "_Open",
+            "attributes": {
+                "timestamp": "openTime"
+            },
+            "constants": {
+                "activity": "'Open'"
+            }
+        }, {
+            "log": bpic14_interaction,
+            "sysId": "interactionId",
+            "id_addition": "_Close",
+            "attributes": {
+                "timestamp": "closeTime"
+            },
+            "constants": {
+                "activity": "'Close'"
+            }
+        }],
+    "IncidentActivityEvent": [
+        {
+            "log": bpic14_incident_activity,
+            "sysId": "activityNumber",
+            "attributes": {
+                "activity": "incidentActivityType",
+                "timestamp": "dateStamp"
+            }
+        }
+    ],
+}
+
+e2o_relationships = {
+    "CORR": [
+        {
+            "from_object": {
+                "label": "IncidentEvent"
+            },
+            "to_object": {
+                "label": "Incident",
+                "foreign_key": "incidentId"
+            }
+        },
+        {
+            "from_object": {
+                "label": "ChangeEvent"
+            },
+            "to_object": {
+                "label": "Change",
+                "foreign_key": "changeId"
+            }
+        },
+        {
+            "from_object": {
+                "label": "InteractionEvent"
+            },
+            "to_object": {
+                "label": "Interaction",
+                "foreign_key": "interactionId"
+            }
+        },
+        {
+            "from_object": {
+                "label": "IncidentActivityEvent"
+            },
+            "to_object": {
+                "label": "Incident",
+                "foreign_key": "incidentId"
+            }
+        }
+    ]
+
+}
+
+# 3. Analysis (3_analysis.ipynb)
+# iteration 0: the objects with at least one event before the cutoff are removed together with all their events
+objects_to_prune = {
+    "cutoff": "2013-08-19T09:59:53.000000000+01:00",
+    "object_types": ['Incident', 'Interaction', 'Change']
+}
+
+objects_to_materialize = {
+    "CI_SC": [{
+        "from_object": {
+            "label": "ServiceComponent"
+        },
+        "to_object": {
+            "label": "ConfigurationItem",
+            "attributes": {  # copy over attributes
+                "ciType": "ciType",
+                "ciSubtype": "ciSubtype"
+            }
+        },
+        "relation_type": "CONTAINS"
+    }]
+}
+
+o2o_relationships_to_extend = {
+    "AFFECTED_CI_SC": [{
+        "from_object": {
+            "label": "Incident|Interaction|Change",
+            "relationships": [
+                {
+                    "related_label": "ServiceComponent",
+                    "related_object": "sc",
+                    "relation_type": "AFFECTED_SC"
+                },
+                {
+                    "related_label": "ConfigurationItem",
+                    "related_object": "ci",
+                    "relation_type": "AFFECTED_CI"
+                }]
+        },
+        "to_object": {
+            "label": "CI_SC",
+            "relationships": [
+                {
+                    "related_label": "ServiceComponent",
+                    "related_object": "sc",
+                    "relation_type": "RELATED"
+                },
+                {
+                    "related_label": "ConfigurationItem",
+                    "related_object": "ci",
+                    "relation_type": "RELATED"
+                }]
+        }
+    }],
+    "CAUSED_BY_CI_SC": [{
+        "from_object": {
+            "label": "Incident",
+            "relationships": [
+                {
+                    "related_label": "ServiceComponent",
+                    "related_object": "sc",
+                    "relation_type": "CAUSED_BY_SC"
+                },
+                {
+                    "related_label": "ConfigurationItem",
+                    "related_object": "ci",
+                    "relation_type": "CAUSED_BY_CI"
+                }]
+        },
+        "to_object": {
+            "label": "CI_SC",
+            "relationships": [
+                {
+                    "related_label": "ServiceComponent",
+                    "related_object": "sc",
+                    "relation_type": "RELATED"
+                },
+                {
+                    "related_label": "ConfigurationItem",
+                    "related_object": "ci",
+                    "relation_type": "RELATED"
+                }]
+        }
+    }]
+}
+
+e2o_relationships_to_extend = {
+    "CORR": [
+        {
+            "from_object": {
+                "label": "Event",
+                "relationships": [
+                    {
+                        "related_label": "Change",
+                        "related_object": "change",
+                        "relation_type": "CORR"
+                    }]
+            },
+            "to_object": {
+                "label": "CI_SC",
+                "relationships": [
+                    {
+                        "related_label": "Change",
+                        "related_object": "change",
+                        "relation_type": "AFFECTED_CI_SC"
+                    }]
+            }
+        },
+        {
+            "from_object": {
+                "label": "Event",
+                "relationships": [
+                    {
+                        "related_label": "Incident",
+                        "related_object": "incident",
+                        "relation_type": "CORR"
+                    }]
+            },
+            "to_object": {
+                "label": "CI_SC",
+                "relationships": [
+                    {
+                        "related_label": "Incident",
+                        "related_object": "incident",
+                        "relation_type": "AFFECTED_CI_SC"
+                    }]
+            }
+        },
+        {
+            "from_object": {
+                "label": "Event",
+                "relationships": [
+                    {
+                        "related_label": "Interaction",
+                        "related_object": "interaction",
+                        "relation_type": "CORR"
+                    }]
+            },
+            "to_object": {
+                "label": "CI_SC",
+                "relationships": [
+                    {
+                        "related_label": "Interaction",
+                        "related_object": "interaction",
+                        "relation_type": "AFFECTED_CI_SC"
+                    }]
+            }
+        }
+    ],
+}
+
+df_object_types_with_event_types = {
+    'Interaction': ['InteractionEvent'],
+    'Incident': ['IncidentEvent', 'IncidentActivityEvent'],
+    'Change': ['ChangeEvent'],
+    'CI_SC': ['InteractionEvent', 'IncidentEvent', 'IncidentActivityEvent', 'ChangeEvent']
+}
+
+# every event belongs to a single object of these object types, so the batches of objects of their DF edges do not
+# lock the same events and can run in concurrent transactions
+df_concurrent_object_types = ['Interaction', 'Incident', 'Change']
+
+start_end_object_types_with_event_types = {
+    'Interaction': ['InteractionEvent'],
+    'Incident': ['IncidentEvent', 'IncidentActivityEvent'],
+    'Change': ['ChangeEvent']
+}
+
+hle2o_relationships_to_extend = {
+    "CORR": [
+        {
+            "from_object": {
+                "label": "HighLevelEvent",
+                "relationships": [
+                    {
+                        "related_label": "Event",
+                        "related_object": "event",
+                        "relation_type": "START"
+                    }]
+            },
+            "to_object": {
+                "label": "CI_SC",
+                "relationships": [
+                    {
+                        "related_label": "Event",
+                        "related_object": "event",
+                        "relation_type": "CORR"
+                    }]
+            }
+        }, {
+            "from_object": {
+                "label": "HighLevelEvent",
+                "relationships": [
+                    {
+                        "related_label": "Event",
+                        "related_object": "event",
+                        "relation_type": "END"
+                    }]
+            },
+            "to_object": {
+                "label": "CI_SC",
+                "relationships": [
+                    {
+                        "related_label": "Event",
+                        "related_object": "event",
+                        "relation_type": "CORR"
+                    }]
+            }
+        }
+    ]
+}
+
+hle_object_types_with_event_types = {
+    'CI_SC': {
+        'eventTypes': ['HighLevelEvent'],
+        'timestampFields': ['startTime', 'endTime']
+    }
+}
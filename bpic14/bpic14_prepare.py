@@ -3,37 +3,206 @@
 Created on Mon Jul  1 14:02:29 2019
 
 @author: 20175070
+
+Prepares the BPIC14 files for import.
+The files are read in chunks (bounded memory) using the dtypes of json_files/BPIC14_DS.json and are processed in
+parallel worker processes. The output is written as CSV (default) or as Parquet, the latter is loaded using
+load_data(..., parquet_path=...) of util/db_helper_functions.py.
+
+Usage: python bpic14_prepare.py [--format csv|parquet] [--workers 4] [--max-memory-mb 2048]
 """
 
+import argparse
+import json
 import pandas as pd
 import time
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 # config
 input_path = os.path.join(os.getcwd(), "data")
 output_path = os.path.join(input_path, "prepared")  # where prepared files will be stored
-if not os.path.exists(output_path):
-    os.makedirs(output_path)
-
-start = time.time()
-
-incident = pd.read_csv(os.path.join(input_path, 'Detail_Incident.csv'), keep_default_na=True, sep=';', decimal=",",
-                       dtype={"Urgency": "str"})
-# only keep numeric values for urgency column and convert to Int64
-incident["Urgency"] = incident["Urgency"].str.replace('(\D+)', '', regex=True)
-incident["Urgency"] = incident["Urgency"].astype('Int64')
-# drop empty rows
-incident = incident.dropna(how='all')
-# drop empty columns
-incident = incident.dropna(axis='columns', how='all')
-incident.to_csv(os.path.join(output_path, "BPIC14Incident.csv"))
-
-interaction = pd.read_csv(os.path.join(input_path, 'Detail_Interaction.csv'), keep_default_na=True, sep=';',
-                          dtype={"Urgency": "str"})
-# only keep numeric values for urgency column and convert to Int64
-interaction["Urgency"] = interaction["Urgency"].str.replace('(\D+)', '', regex=True)
-interaction["Urgency"] = interaction["Urgency"].astype('Int64')
-interaction.to_csv(os.path.join(output_path, "BPIC14Interaction.csv"))
-
-end = time.time()
-print("Prepared data for import in: " + str((end - start)) + " seconds.")
+dataset_description_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_files", "BPIC14_DS.json")
+
+# raw file, name of the prepared file, name of the dataset description and read options
+files = [
+    {"input": "Detail_Incident.csv", "output": "BPIC14Incident", "description": "BPIC14Incident",
+     "read_options": {"sep": ";", "decimal": ","}, "clean_urgency": True, "drop_empty_rows": True},
+    {"input": "Detail_Interaction.csv", "output": "BPIC14Interaction", "description": "BPIC14Interaction",
+     "read_options": {"sep": ";"}, "clean_urgency": True, "drop_empty_rows": False},
+    {"input": "Detail_Change.csv", "output": "Detail_Change", "description": "BPIC14Change",
+     "read_options": {"sep": ";"}, "clean_urgency": False, "drop_empty_rows": False},
+    {"input": "Detail_Incident_Activity.csv", "output": "Detail_Incident_Activity",
+     "description": "BPIC14IncidentDetail", "read_options": {"sep": ";"}, "clean_urgency": False,
+     "drop_empty_rows": False}
+]
+
+# pandas dtypes that can be used while reading, other dtypes (e.g. datetime) are parsed by the loader
+readable_dtypes = {"str": "str", "Int64": "Int64", "float": "float64"}
+
+
+def get_dtypes(_description_name):
+    """
+    Get the dtypes per column as defined in the dataset description.
+    """
+    with open(dataset_description_path) as f:
+        descriptions = json.load(f)
+
+    dtypes = {}
+    for description in descriptions:
+        if description["name"] != _description_name:
+            continue
+        for attribute in description["attributes"]:
+            for column in attribute["columns"]:
+                if column.get("dtype") in readable_dtypes:
+                    dtypes[column["name"]] = readable_dtypes[column["dtype"]]
+    return dtypes
+
+
+def determine_chunk_size(_file, _dtypes, _memory_cap_bytes, _input_path, _sample_size=1000):
+    """
+    Estimate the number of rows that fit into the memory cap of a single worker based on a sample of the file.
+    A factor of 3 is used for the copies that pandas makes while cleaning a chunk.
+    """
+    sample = pd.read_csv(os.path.join(_input_path, _file["input"]), keep_default_na=True,
+                         dtype={column: dtype for column, dtype in _dtypes.items() if dtype == "str"},
+                         nrows=_sample_size, **_file["read_options"])
+    bytes_per_row = max(1, sample.memory_usage(deep=True).sum() / max(1, len(sample)))
+    return max(_sample_size, int(_memory_cap_bytes / (3 * bytes_per_row)))
+
+
+def cast_chunk(_chunk, _dtypes):
+    """
+    Cast the columns of the chunk to their dtype of the dataset description. Columns with values that cannot be cast
+    (e.g. text in a numeric column of the original data) keep their inferred dtype, their names are returned.
+    """
+    failed_columns = []
+    for column, dtype in _dtypes.items():
+        if column not in _chunk.columns:
+            continue
+        try:
+            _chunk[column] = _chunk[column].astype(dtype)
+        except (ValueError, TypeError):
+            failed_columns.append(column)
+    return _chunk, failed_columns
+
+
+def clean_chunk(_chunk, _file):
+    if _file["clean_urgency"]:
+        # only keep numeric values for urgency column and convert to Int64
+        _chunk["Urgency"] = _chunk["Urgency"].str.replace(r'(\D+)', '', regex=True)
+        _chunk["Urgency"] = _chunk["Urgency"].astype('Int64')
+    if _file["drop_empty_rows"]:
+        # drop empty rows
+        _chunk = _chunk.dropna(how='all')
+    # empty columns are not dropped, whether a column is empty is only known after the last chunk. The loader drops
+    # them when reading the prepared file (promg drops all columns with only nan values)
+    return _chunk
+
+
+def write_prepared_file(_file, _output_file, _output_format, _dtypes, _chunk_size, _input_path):
+    """
+    Write the cleaned chunks of the file, returns the number of rows and the columns that could not be cast to their
+    dtype. The CSV output keeps the inferred values of these columns, a Parquet file needs one type per column and is
+    stopped at the first such column.
+    """
+    # str columns are read as str, the other dtypes are cast per chunk, so a value that cannot be cast does not fail
+    # the read
+    read_dtypes = {column: dtype for column, dtype in _dtypes.items() if dtype == "str"}
+    cast_dtypes = {column: dtype for column, dtype in _dtypes.items() if dtype != "str"}
+    chunks = pd.read_csv(os.path.join(_input_path, _file["input"]), keep_default_na=True, dtype=read_dtypes,
+                         chunksize=_chunk_size, **_file["read_options"])
+
+    writer = None
+    num_rows = 0
+    failed_columns = set()
+    try:
+        for index, chunk in enumerate(chunks):
+            chunk, failed = cast_chunk(chunk, cast_dtypes)
+            failed_columns.update(failed)
+            if failed and _output_format == "parquet":
+                break
+            chunk = clean_chunk(chunk, _file)
+            num_rows += len(chunk)
+            if _output_format == "csv":
+                chunk.to_csv(_output_file, mode="w" if index == 0 else "a", header=index == 0)
+            else:
+                writer = write_parquet_chunk(writer, chunk, _output_file)
+    finally:
+        if writer is not None:
+            writer.close()
+    return num_rows, failed_columns
+
+
+def prepare_file(_file, _output_format, _memory_cap_bytes, _input_path, _output_path):
+    start = time.time()
+    dtypes = get_dtypes(_file["description"])
+    if _file["clean_urgency"]:
+        dtypes["Urgency"] = "str"  # is cleaned afterwards
+
+    chunk_size = determine_chunk_size(_file, dtypes, _memory_cap_bytes, _input_path)
+    output_file = os.path.join(_output_path, f"{_file['output']}.{_output_format}")
+
+    num_rows, failed_columns = write_prepared_file(_file, output_file, _output_format, dtypes, chunk_size,
+                                                   _input_path)
+    if failed_columns:
+        print(f"{_file['input']}: the values of {sorted(failed_columns)} cannot be cast to the dtype of the dataset "
+              f"description, {'their inferred dtype' if _output_format == 'csv' else 'str'} is used instead")
+    if failed_columns and _output_format == "parquet":
+        # the inferred dtype can differ between chunks, hence these columns are written as str
+        dtypes.update({column: "str" for column in failed_columns})
+        num_rows, _ = write_prepared_file(_file, output_file, _output_format, dtypes, chunk_size, _input_path)
+
+    duration = time.time() - start
+    size_mb = os.path.getsize(os.path.join(_input_path, _file["input"])) / 2 ** 20
+    return {"file": _file["input"], "rows": num_rows, "chunk_size": chunk_size, "seconds": round(duration, 2),
+            "rows/s": round(num_rows / duration), "MB/s": round(size_mb / duration, 2)}
+
+
+def write_parquet_chunk(_writer, _chunk, _output_file):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet requires pyarrow, install it using `pip install pyarrow`")
+
+    table = pa.Table.from_pandas(_chunk, preserve_index=False)
+    if _writer is None:
+        _writer = pq.ParquetWriter(_output_file, table.schema)
+    else:
+        table = table.cast(_writer.schema)
+    _writer.write_table(table)
+    return _writer
+
+
+def prepare(_output_format="csv", _workers=4, _max_memory_mb=2048, _input_path=input_path, _output_path=output_path):
+    if not os.path.exists(_output_path):
+        os.makedirs(_output_path)
+
+    # the loader reads the change and activity files directly, for csv only the cleaned files have to be written
+    files_to_prepare = files if _output_format == "parquet" else \
+        [_file for _file in files if _file["clean_urgency"] or _file["drop_empty_rows"]]
+    memory_cap_bytes = _max_memory_mb * 2 ** 20 / min(_workers, len(files_to_prepare))
+
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=_workers) as executor:
+        results = list(executor.map(prepare_file, files_to_prepare,
+                                    [_output_format] * len(files_to_prepare),
+                                    [memory_cap_bytes] * len(files_to_prepare),
+                                    [_input_path] * len(files_to_prepare),
+                                    [_output_path] * len(files_to_prepare)))
+    end = time.time()
+
+    print(pd.DataFrame(results).to_string(index=False))
+    print("Prepared data for import in: " + str((end - start)) + " seconds.")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare the BPIC14 data for import")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-memory-mb", type=int, default=2048,
+                        help="memory cap shared by all workers, determines the chunk size")
+    args = parser.parse_args()
+    prepare(_output_format=args.format, _workers=args.workers, _max_memory_mb=args.max_memory_mb)
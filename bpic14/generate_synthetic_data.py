@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Generates synthetic BPIC14-shaped input files (Detail_Incident.csv, Detail_Interaction.csv, Detail_Change.csv and
+Detail_Incident_Activity.csv) with the columns of json_files/BPIC14_DS.json and consistent cross-references
+(relatedIncident, relatedInteraction, relatedChange, ciNameAff, serviceComponentAff, kmNumber, ...).
+
+The number of rows scales linearly with the scale factor, scale 1 has roughly the size of the original BPIC14 data.
+Files are generated and written in chunks, so memory usage does not grow with the scale factor.
+
+Usage: python generate_synthetic_data.py --scale 0.1 [--output-path data] [--seed 42]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# number of objects at scale 1 (roughly the size of BPIC14)
+base_counts = {
+    "incident": 46606,
+    "interaction": 147004,
+    "change": 30275,
+    "configuration_item": 13000,
+    "service_component": 280,
+    "knowledge_document": 1650
+}
+activities_per_incident = 10
+chunk_size = 100_000
+
+start_period = pd.Timestamp("2013-01-01").value // 10 ** 9
+end_period = pd.Timestamp("2014-03-31").value // 10 ** 9
+
+ci_types = ["application", "subapplication", "computer", "storage", "hardware", "database", "displaydevice",
+            "software", "networkcomponents", "officeelectronics", "phone"]
+categories = ["incident", "request for information", "complaint", "request for change"]
+closure_codes = ["Other", "Software", "No error - works as designed", "User error", "Hardware", "Unknown"]
+urgencies = ["1", "2", "3", "4", "5 - Very Low"]
+activity_types = ["Open", "Assignment", "Reassignment", "Update", "Operator Update", "Status Change", "Caused By CI",
+                  "Description Update", "Communication with customer", "Closed"]
+change_types = ["Change Component", "Release Type", "Master Change"]
+risk_assessments = ["Minor Change", "Business Change", "Major Business Change"]
+
+incident_date_format = "%d/%m/%Y %H:%M:%S"
+interaction_date_format = "%d-%m-%Y %H:%M"
+change_date_format = "%d-%m-%Y %H:%M"
+activity_date_format = "%d-%m-%Y %H:%M:%S"
+
+
+def get_counts(_scale):
+    return {name: max(1, int(round(count * _scale))) for name, count in base_counts.items()}
+
+
+def format_ids(_prefix, _indices, _width):
+    return pd.Series(_indices).map(lambda index: f"{_prefix}{index:0{_width}d}").to_numpy(dtype=object)
+
+
+def format_dates(_epochs, _format):
+    return pd.to_datetime(_epochs, unit="s").strftime(_format).to_numpy(dtype=object)
+
+
+def sample_configuration_items(_rng, _size, _counts):
+    """
+    Sample (ci name, ci type, ci subtype, service component) tuples. Every CI belongs to one service component,
+    10% of the samples use another service component, so CIs are only locally unique per service component.
+    """
+    ci_indices = _rng.integers(0, _counts["configuration_item"], _size)
+    sc_indices = (ci_indices * 7919) % _counts["service_component"]
+    other_sc = _rng.random(_size) < 0.1
+    sc_indices[other_sc] = _rng.integers(0, _counts["service_component"], other_sc.sum())
+
+    types = np.array(ci_types, dtype=object)[ci_indices % len(ci_types)]
+    subtypes = types + pd.Series(ci_indices % 3).astype(str).to_numpy(dtype=object)
+    return {
+        "name": format_ids("SUB", ci_indices, 6),
+        "type": types,
+        "subtype": subtypes,
+        "service_component": format_ids("WBS", sc_indices, 6)
+    }
+
+
+def optional_references(_rng, _references, _probability, _multivalue_probability=0.0, _missing=""):
+    values = _references.copy()
+    draw = _rng.random(len(values))
+    values[draw >= _probability] = _missing
+    values[draw < _multivalue_probability] = "#MULTIVALUE"
+    return values
+
+
+def generate_incidents(_rng, _start, _end, _counts):
+    size = _end - _start
+    cis = sample_configuration_items(_rng, size, _counts)
+    caused_by = sample_configuration_items(_rng, size, _counts)
+    caused_by_missing = _rng.random(size) < 0.2
+
+    open_time = _rng.integers(start_period, end_period, size)
+    resolved_time = open_time + _rng.exponential(3 * 24 * 3600, size).astype(np.int64)
+    close_time = resolved_time + _rng.exponential(24 * 3600, size).astype(np.int64)
+    reopened = _rng.random(size) < 0.03
+    reopen_time = format_dates(resolved_time + 3600, incident_date_format)
+    reopen_time[~reopened] = ""
+
+    related_interactions = format_ids("SD", _rng.integers(0, _counts["interaction"], size), 7)
+    related_changes = format_ids("C", _rng.integers(0, _counts["change"], size), 8)
+
+    return pd.DataFrame({
+        "CI Name (aff)": cis["name"],
+        "CI Type (aff)": cis["type"],
+        "CI Subtype (aff)": cis["subtype"],
+        "Service Component WBS (aff)": cis["service_component"],
+        "Incident ID": format_ids("IM", np.arange(_start, _end), 7),
+        "Status": "Closed",
+        "Impact": _rng.integers(1, 6, size),
+        "Urgency": _rng.choice(urgencies, size),
+        "Priority": _rng.integers(1, 6, size),
+        "Category": _rng.choice(categories, size),
+        "KM number": format_ids("KM", _rng.integers(0, _counts["knowledge_document"], size), 7),
+        "Alert Status": "closed",
+        "# Reassignments": _rng.poisson(1, size),
+        "Open Time": format_dates(open_time, incident_date_format),
+        "Reopen Time": reopen_time,
+        "Resolved Time": format_dates(resolved_time, incident_date_format),
+        "Close Time": format_dates(close_time, incident_date_format),
+        "Closure Code": _rng.choice(closure_codes, size),
+        "Handle Time (Hours)": np.round(_rng.exponential(5, size), 3),
+        "# Related Interactions": 1,
+        "Related Interaction": optional_references(_rng, related_interactions, 0.98, 0.02, "#N/B"),
+        "# Related Incidents": "",
+        "# Related Changes": "",
+        "Related Change": optional_references(_rng, related_changes, 0.05, 0.002),
+        "CI Name (CBy)": np.where(caused_by_missing, "#N/B", caused_by["name"]),
+        "CI Type (CBy)": np.where(caused_by_missing, "#N/B", caused_by["type"]),
+        "CI Subtype (CBy)": np.where(caused_by_missing, "#N/B", caused_by["subtype"]),
+        "ServiceComp WBS (CBy)": np.where(caused_by_missing, "#N/B", caused_by["service_component"])
+    })
+
+
+def generate_interactions(_rng, _start, _end, _counts):
+    size = _end - _start
+    cis = sample_configuration_items(_rng, size, _counts)
+    open_time = _rng.integers(start_period, end_period, size)
+    close_time = open_time + _rng.exponential(3600, size).astype(np.int64)
+    related_incidents = format_ids("IM", _rng.integers(0, _counts["incident"], size), 7)
+
+    return pd.DataFrame({
+        "CI Name (aff)": cis["name"],
+        "CI Type (aff)": cis["type"],
+        "CI Subtype (aff)": cis["subtype"],
+        "Service Comp WBS (aff)": cis["service_component"],
+        "Interaction ID": format_ids("SD", np.arange(_start, _end), 7),
+        "Status": "Closed",
+        "Impact": _rng.integers(1, 6, size),
+        "Urgency": _rng.choice(urgencies, size),
+        "Priority": _rng.integers(1, 6, size),
+        "Category": _rng.choice(categories, size),
+        "KM number": format_ids("KM", _rng.integers(0, _counts["knowledge_document"], size), 7),
+        "Open Time (First Touch)": format_dates(open_time, interaction_date_format),
+        "Close Time": format_dates(close_time, interaction_date_format),
+        "Closure Code": _rng.choice(closure_codes + ["Unknown"], size),
+        "First Call Resolution": _rng.choice(["Y", "N"], size),
+        "Handle Time (secs)": _rng.integers(10, 5000, size),
+        "Related Incident": optional_references(_rng, related_incidents, 0.3, 0.01)
+    })
+
+
+def generate_changes(_rng, _start, _end, _counts):
+    size = _end - _start
+    cis = sample_configuration_items(_rng, size, _counts)
+    open_time = _rng.integers(start_period, end_period, size)
+    planned_start = open_time + _rng.exponential(7 * 24 * 3600, size).astype(np.int64)
+    planned_end = planned_start + _rng.exponential(4 * 3600, size).astype(np.int64)
+    actual_start = planned_start + _rng.normal(0, 1800, size).astype(np.int64)
+    actual_end = actual_start + _rng.exponential(4 * 3600, size).astype(np.int64)
+    close_time = actual_end + _rng.exponential(2 * 24 * 3600, size).astype(np.int64)
+    downtime = _rng.random(size) < 0.1
+    downtime_start = format_dates(planned_start, change_date_format)
+    downtime_end = format_dates(planned_end, change_date_format)
+    downtime_start[~downtime] = ""
+    downtime_end[~downtime] = ""
+
+    return pd.DataFrame({
+        "CI Name (aff)": cis["name"],
+        "CI Type (aff)": cis["type"],
+        "CI Subtype (aff)": cis["subtype"],
+        "Service Component WBS (aff)": cis["service_component"],
+        "Change ID": format_ids("C", np.arange(_start, _end), 8),
+        "Change Type": _rng.choice(change_types, size),
+        "Risk Assessment": _rng.choice(risk_assessments, size),
+        "Emergency Change": _rng.choice(["Y", "N"], size, p=[0.02, 0.98]),
+        "CAB-approval needed": _rng.choice(["Y", "N"], size),
+        "Planned Start": format_dates(planned_start, change_date_format),
+        "Planned End": format_dates(planned_end, change_date_format),
+        "Scheduled Downtime Start": downtime_start,
+        "Scheduled Downtime End": downtime_end,
+        "Actual Start": format_dates(actual_start, change_date_format),
+        "Actual End": format_dates(actual_end, change_date_format),
+        "Requested End Date": format_dates(planned_end, change_date_format),
+        "Change record Open Time": format_dates(open_time, change_date_format),
+        "Change record Close Time": format_dates(close_time, change_date_format),
+        "Originated from": _rng.choice(["Incident", "Interaction", "Problem"], size),
+        "# Related Interactions": _rng.poisson(0.5, size),
+        "# Related Incidents": _rng.poisson(0.5, size)
+    })
+
+
+def generate_activities(_rng, _start, _end, _counts, _first_activity_number):
+    """
+    Generate the activities of the incidents _start to _end, the first activity of every incident is Open and the
+    last one is Closed.
+    """
+    num_incidents = _end - _start
+    num_activities = _rng.poisson(activities_per_incident - 2, num_incidents) + 2
+    incident_indices = np.repeat(np.arange(_start, _end), num_activities)
+    size = len(incident_indices)
+
+    first_of_incident = np.r_[True, incident_indices[1:] != incident_indices[:-1]]
+    last_of_incident = np.r_[incident_indices[1:] != incident_indices[:-1], True]
+    types = _rng.choice(activity_types[1:-1], size).astype(object)
+    types[first_of_incident] = "Open"
+    types[last_of_incident] = "Closed"
+
+    incident_open = _rng.integers(start_period, end_period, num_incidents)
+    offsets = _rng.exponential(12 * 3600, size).astype(np.int64)
+    # cumulative offsets per incident, so the activities are ordered in time
+    offsets = np.cumsum(offsets) - np.repeat(np.cumsum(offsets)[first_of_incident] - offsets[first_of_incident],
+                                             num_activities)
+    date_stamps = np.repeat(incident_open, num_activities) + offsets
+
+    interaction_ids = format_ids("SD", _rng.integers(0, _counts["interaction"], size), 7)
+
+    return pd.DataFrame({
+        "Incident ID": format_ids("IM", incident_indices, 7),
+        "DateStamp": format_dates(date_stamps, activity_date_format),
+        "IncidentActivity_Number": format_ids("ACT", np.arange(_first_activity_number,
+                                                               _first_activity_number + size), 9),
+        "IncidentActivity_Type": types,
+        "Assignment Group": format_ids("TEAM", _rng.integers(0, 250, size), 4),
+        "KM number": format_ids("KM", _rng.integers(0, _counts["knowledge_document"], size), 7),
+        "Interaction ID": optional_references(_rng, interaction_ids, 0.1, _missing="#N/B")
+    })
+
+
+def write_chunk(_df, _path, _first, **_csv_options):
+    _df.to_csv(_path, sep=";", index=False, mode="w" if _first else "a", header=_first, **_csv_options)
+
+
+def generate(_scale, _output_path, _seed=42):
+    """
+    Generate the four BPIC14 files in _output_path and return the number of rows per file.
+    """
+    os.makedirs(_output_path, exist_ok=True)
+    counts = get_counts(_scale)
+    num_rows = {}
+
+    files = [("Detail_Incident.csv", "incident", generate_incidents, {"decimal": ","}),
+             ("Detail_Interaction.csv", "interaction", generate_interactions, {}),
+             ("Detail_Change.csv", "change", generate_changes, {})]
+    for file_index, (file_name, object_name, generate_chunk, csv_options) in enumerate(files):
+        path = os.path.join(_output_path, file_name)
+        for chunk_start in range(0, counts[object_name], chunk_size):
+            rng = np.random.default_rng([_seed, file_index, chunk_start])
+            chunk = generate_chunk(rng, chunk_start, min(chunk_start + chunk_size, counts[object_name]), counts)
+            write_chunk(chunk, path, chunk_start == 0, **csv_options)
+        num_rows[file_name] = counts[object_name]
+
+    path = os.path.join(_output_path, "Detail_Incident_Activity.csv")
+    activity_number = 0
+    incidents_per_chunk = chunk_size // activities_per_incident
+    for chunk_start in range(0, counts["incident"], incidents_per_chunk):
+        rng = np.random.default_rng([_seed, len(files), chunk_start])
+        chunk = generate_activities(rng, chunk_start, min(chunk_start + incidents_per_chunk, counts["incident"]),
+                                    counts, activity_number)
+        write_chunk(chunk, path, chunk_start == 0)
+        activity_number += len(chunk)
+    num_rows["Detail_Incident_Activity.csv"] = activity_number
+
+    return num_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic BPIC14-shaped data")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale factor, 1 is roughly the size of BPIC14")
+    parser.add_argument("--output-path", default=os.path.join(os.getcwd(), "data"))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    start = time.time()
+    rows = generate(_scale=args.scale, _output_path=args.output_path, _seed=args.seed)
+    print(rows)
+    print("Generated synthetic data in: " + str((time.time() - start)) + " seconds.")
@@ -0,0 +1,222 @@
+"""
+Headless build of the BPIC14 EKG, runs the steps of the notebooks as a pipeline with checkpoints in the graph.
+Steps of which the config (and the configs of the steps they depend on) did not change since their last successful run
+are skipped, so a failed build resumes at the failed step.
+
+Usage: python build_ekg.py [--conf bpic14/config.yaml] [--clear] [--force] [--workers 4] [--until build_df_edges]
+       [--df-partitions 4] [--batching] [--df-concurrency 4]
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import yaml
+
+from bpic14 import bpic14_configs as configs
+from util.assign_types_functions import add_object_type_node, add_event_type_node
+from util.batching import concurrent_transactions
+from util.db_helper_functions import get_db_connection, clear_database, load_data
+from util.enrichment_methods import materialize_objects, extend_relationships, build_df_edges, \
+    build_df_edges_partitioned, infer_start_end_and_high_level_events
+from util.pipeline import run_pipeline, get_checkpoints, get_step_hashes, get_topological_order
+from util.pruning import prune_before
+from util.transformer_functions import build_entities, build_relationships
+
+
+def get_input_files(_conf_path):
+    """
+    Size and modification time of the input files, so that load_data is run again when the data changed.
+    """
+    with open(_conf_path) as f:
+        config = yaml.safe_load(f)
+    with open(config["dataset_description_path"]) as f:
+        dataset_descriptions = json.load(f)
+
+    input_files = {}
+    for dataset_description in dataset_descriptions:
+        path = os.path.join(os.getcwd(), *dataset_description["file_directory"].split("\\"),
+                            dataset_description["file_name"])
+        stat = os.stat(path) if os.path.exists(path) else None
+        input_files[dataset_description["file_name"]] = [stat.st_size, stat.st_mtime] if stat else None
+    return {"config": config, "dataset_descriptions": dataset_descriptions, "files": input_files}
+
+
+def get_steps(_conf_path, _df_partitions=1, _df_concurrency=None):
+    """
+    With _df_partitions > 1, the DF edges of every object type are built by that many concurrent hash partitions of its
+    objects. With _df_concurrency (and a BatchingConnection), the batches of the DF edges of the object types in
+    df_concurrent_object_types run in that many concurrent transactions. The result is the same, so the partitions and
+    concurrency are not part of the config of the steps.
+    """
+    object_labels = list(configs.objects.keys())
+    event_labels = list(configs.EVENTS.keys())
+    materialized_labels = list(configs.objects_to_materialize.keys())
+
+    def add_object_types(_db_connection):
+        for label in object_labels:
+            add_object_type_node(_db_connection=_db_connection, _object_type=label, _type_edges=False)
+
+    def add_event_types(_db_connection):
+        for label in event_labels:
+            add_event_type_node(_db_connection=_db_connection, event_type=label, _type_edges=False)
+
+    def build_df_edges_of_object_type(_db_connection, _object_type, _event_types, _timestamp_fields=None):
+        if _df_partitions > 1:
+            build_df_edges_partitioned(_db_connection, _object_type, _event_types, _timestamp_fields,
+                                       _partitions=_df_partitions)
+        else:
+            build_df_edges(_db_connection, _object_type, _event_types, _timestamp_fields)
+
+    def df_edges(_db_connection):
+        for object_type, event_types in configs.df_object_types_with_event_types.items():
+            concurrency = _df_concurrency if object_type in configs.df_concurrent_object_types else None
+            with concurrent_transactions(_db_connection, concurrency):
+                build_df_edges_of_object_type(_db_connection, object_type, event_types)
+
+    def high_level_events(_db_connection):
+        # START and END edges and high-level events in one pass over the DF chains
+        for object_type, event_types in configs.start_end_object_types_with_event_types.items():
+            infer_start_end_and_high_level_events(_db_connection=_db_connection, _object_type=object_type,
+                                                  _event_types=event_types, _hle_event_type='HighLevelEvent',
+                                                  _type_edges=False)
+
+    def hle_df_edges(_db_connection):
+        for object_type, hle_config in configs.hle_object_types_with_event_types.items():
+            build_df_edges_of_object_type(_db_connection, object_type, hle_config['eventTypes'],
+                                          hle_config['timestampFields'])
+
+    return {
+        "load_data": {
+            "function": lambda _db_connection: load_data(_db_connection, conf_path=_conf_path),
+            "config": get_input_files(_conf_path),
+            "resources": ["Log", "Record"]
+        },
+        "build_entities_objects": {
+            "function": lambda _db_connection: build_entities(_db_connection, entities=configs.objects,
+                                                                type_property="objectType"),
+            "config": configs.objects,
+            "depends_on": ["load_data"],
+            "resources": ["Record"] + object_labels
+        },
+        "build_entities_events": {
+            "function": lambda _db_connection: build_entities(_db_connection, entities=configs.EVENTS,
+                                                                type_property="eventType"),
+            "config": configs.EVENTS,
+            "depends_on": ["load_data"],
+            "resources": ["Record"] + event_labels
+        },
+        "build_relationships_o2o": {
+            "function": lambda _db_connection: build_relationships(_db_connection, configs.o2o_relationships),
+            "config": configs.o2o_relationships,
+            "depends_on": ["build_entities_objects"],
+            "resources": object_labels
+        },
+        "build_relationships_e2o": {
+            "function": lambda _db_connection: build_relationships(_db_connection, configs.e2o_relationships),
+            "config": configs.e2o_relationships,
+            "depends_on": ["build_entities_objects", "build_entities_events"],
+            "resources": object_labels + event_labels
+        },
+        "add_object_type_nodes": {
+            "function": add_object_types,
+            "config": object_labels,
+            "depends_on": ["build_entities_objects"],
+            "resources": ["ObjectType"] + object_labels
+        },
+        "add_event_type_nodes": {
+            # removes the event labels, so all steps that use them have to be finished
+            "function": add_event_types,
+            "config": event_labels,
+            "depends_on": ["build_relationships_e2o"],
+            "resources": ["EventType", "Event"] + event_labels
+        },
+        "prune_before": {
+            # removes objects and events, so all steps that build them or relationships between them have to be
+            # finished
+            "function": lambda _db_connection: prune_before(_db_connection, configs.objects_to_prune["cutoff"],
+                                                            configs.objects_to_prune["object_types"]),
+            "config": configs.objects_to_prune,
+            "depends_on": ["build_relationships_o2o", "add_object_type_nodes", "add_event_type_nodes"],
+            "resources": ["Event"] + object_labels + event_labels
+        },
+        "materialize_objects": {
+            "function": lambda _db_connection: materialize_objects(_db_connection, configs.objects_to_materialize,
+                                                                 type_edges=False),
+            "config": configs.objects_to_materialize,
+            "depends_on": ["prune_before"],
+            "resources": ["ObjectType"] + object_labels + materialized_labels
+        },
+        "extend_relationships_o2o": {
+            "function": lambda _db_connection: extend_relationships(_db_connection,
+                                                                    configs.o2o_relationships_to_extend),
+            "config": configs.o2o_relationships_to_extend,
+            "depends_on": ["materialize_objects"],
+            "resources": object_labels + materialized_labels
+        },
+        "extend_relationships_e2o": {
+            "function": lambda _db_connection: extend_relationships(_db_connection,
+                                                                    configs.e2o_relationships_to_extend),
+            "config": configs.e2o_relationships_to_extend,
+            "depends_on": ["extend_relationships_o2o", "add_event_type_nodes"],
+            "resources": ["Event"] + materialized_labels
+        },
+        "build_df_edges": {
+            "function": df_edges,
+            "config": configs.df_object_types_with_event_types,
+            "depends_on": ["extend_relationships_e2o", "add_object_type_nodes", "add_event_type_nodes"],
+            "resources": ["Event", "HighLevelEvent"]
+        },
+        "infer_high_level_events": {
+            "function": high_level_events,
+            "config": configs.start_end_object_types_with_event_types,
+            "depends_on": ["build_df_edges"],
+            "resources": ["Event", "HighLevelEvent", "EventType"] + object_labels
+        },
+        "extend_relationships_hle2o": {
+            "function": lambda _db_connection: extend_relationships(_db_connection,
+                                                                    configs.hle2o_relationships_to_extend),
+            "config": configs.hle2o_relationships_to_extend,
+            "depends_on": ["infer_high_level_events"],
+            "resources": ["HighLevelEvent"] + materialized_labels
+        },
+        "build_hle_df_edges": {
+            "function": hle_df_edges,
+            "config": configs.hle_object_types_with_event_types,
+            "depends_on": ["extend_relationships_hle2o"],
+            "resources": ["Event", "HighLevelEvent"]
+        }
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BPIC14 EKG without Jupyter")
+    parser.add_argument("--conf", default=str(Path('bpic14', 'config.yaml')))
+    parser.add_argument("--clear", action="store_true", help="clear the database (and its checkpoints) first")
+    parser.add_argument("--force", action="store_true", help="run all steps, also when their checkpoint is up to date")
+    parser.add_argument("--workers", type=int, default=4, help="number of steps that can run in parallel")
+    parser.add_argument("--until", nargs="+", default=None, help="only run these steps and their dependencies")
+    parser.add_argument("--df-partitions", type=int, default=1,
+                        help="number of concurrent partitions of the objects when building the DF edges")
+    parser.add_argument("--batching", action="store_true",
+                        help="tune the batch sizes of the IN TRANSACTIONS queries (util/batching.py)")
+    parser.add_argument("--df-concurrency", type=int, default=None,
+                        help="number of concurrent transactions for the DF edges of df_concurrent_object_types, "
+                             "requires --batching")
+    args = parser.parse_args()
+
+    steps = get_steps(args.conf, args.df_partitions, args.df_concurrency)
+    db_connection = get_db_connection(args.conf, batching=args.batching)
+    if args.clear:
+        clear_database(db_connection)
+
+    # records that are already loaded are not updated by load_data, changed input data requires a clean build
+    load_data_checkpoint = get_checkpoints(db_connection).get("load_data")
+    load_data_hash = get_step_hashes(steps, get_topological_order(steps))["load_data"]
+    if load_data_checkpoint is not None and load_data_checkpoint != load_data_hash:
+        raise SystemExit("The input data or dataset description changed since the last build, use --clear")
+
+    report = run_pipeline(db_connection, steps, max_workers=args.workers, force=args.force, targets=args.until)
+    if not report["status"].isin(["done", "skipped"]).all():
+        raise SystemExit(1)
@@ -0,0 +1,48 @@
+"""
+Offline build of the initial BPIC14 EKG for neo4j-admin database import.
+
+The prepared files of the configuration are read as DataFrames and the objects, EVENTS, o2o_relationships and
+e2o_relationships configs of the notebooks are applied in Python, the resulting records, entities and relationships are
+written as node and relationship CSV files. An empty database is then populated by a single neo4j-admin import
+instead of load_data and the transactional entity and relationship passes. The files contain the checkpoints of these
+steps, so python build_ekg.py continues the build at materialize_objects.
+
+Usage: python build_import_files.py [--conf bpic14/config.yaml] [--output import] [--database neo4j]
+       neo4j-admin database import full ... (the printed command, with the database stopped)
+       python build_import_files.py --create-indexes (with the database started)
+       python build_ekg.py
+"""
+
+import argparse
+from pathlib import Path
+
+from bpic14 import bpic14_configs as configs
+from build_ekg import get_steps
+from util.bulk_import import write_import_files, get_import_command, create_imported_indexes
+from util.db_helper_functions import get_db_connection
+from util.pipeline import get_step_hashes, get_topological_order
+
+# the steps of build_ekg.py of which the result is contained in the import files
+imported_steps = ["load_data", "build_entities_objects", "build_entities_events", "build_relationships_o2o",
+                  "build_relationships_e2o", "add_object_type_nodes", "add_event_type_nodes"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the initial BPIC14 EKG as neo4j-admin import files")
+    parser.add_argument("--conf", default=str(Path('bpic14', 'config.yaml')))
+    parser.add_argument("--output", default="import", help="directory of the import files")
+    parser.add_argument("--database", default="neo4j")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="create the indexes in the imported database instead of writing the files")
+    args = parser.parse_args()
+
+    if args.create_indexes:
+        create_imported_indexes(get_db_connection(args.conf), configs.objects, configs.EVENTS)
+        raise SystemExit(0)
+
+    steps = get_steps(args.conf)
+    hashes = get_step_hashes(steps, get_topological_order(steps))
+    nodes, relationships = write_import_files(args.conf, configs.objects, configs.EVENTS, configs.o2o_relationships,
+                                              configs.e2o_relationships, args.output,
+                                              _checkpoints={step: hashes[step] for step in imported_steps})
+    print(f"\nImport the files into the stopped database using:\n"
+          f"{get_import_command(args.database, nodes, relationships)}")
@@ -0,0 +1,53 @@
+"""
+Query-plan regression check of the templated Cypher queries.
+
+Every query that the EKG build renders from the configs of the notebooks (entities, relationships, materialized
+objects, extended relationships, DF edges, start/end and high-level events) and every query of
+analysis_queries.cypher is EXPLAINed against the database of the configuration file, nothing is executed. The check
+fails when a plan contains a forbidden operator (AllNodesScan, CartesianProduct) or an operator whose estimated rows
+exceed the budget. Schema commands (CREATE INDEX, DROP CONSTRAINT, ...) are skipped, the check never changes the
+schema. With --fingerprints, the check also fails when the operators of a plan differ from the stored fingerprints,
+which are written using --save-fingerprints (see tests/test_query_plans.py).
+
+The estimates depend on the data and the indexes, so the database should contain a graph built on the synthetic data,
+e.g. by running python benchmark.py --scales 0.1 first.
+
+Usage: python check_query_plans.py [--conf bpic14/config.yaml] [--row-budget 1000000] [--output query_plans.csv]
+                                   [--fingerprints tests/query_plan_fingerprints.json] [--save-fingerprints ...]
+Exits with status 1 when a plan violates the checks or a query cannot be planned.
+"""
+
+import argparse
+from pathlib import Path
+
+from bpic14 import bpic14_configs as configs
+from util.db_helper_functions import get_db_connection
+from util.query_plans import check_query_plans, save_plan_fingerprints, compare_plan_fingerprints
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN the templated queries and check their plans")
+    parser.add_argument("--conf", default=str(Path('bpic14', 'config.yaml')))
+    parser.add_argument("--row-budget", type=float, default=None,
+                        help="maximum estimated rows per operator, by default 10 times the number of nodes")
+    parser.add_argument("--output", default=None, help="CSV file with the plans of all queries")
+    parser.add_argument("--fingerprints", default=None, help="JSON file with the stored plan fingerprints to compare")
+    parser.add_argument("--save-fingerprints", default=None, help="JSON file to store the plan fingerprints in")
+    args = parser.parse_args()
+
+    db_connection = get_db_connection(args.conf)
+    report = check_query_plans(db_connection, configs, _row_budget=args.row_budget)
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+    if args.save_fingerprints:
+        save_plan_fingerprints(report, args.save_fingerprints)
+
+    failed = report[report["status"].isin(["violations", "error"])]
+    for _, row in failed.iterrows():
+        print(f"\n[{row['source']}] {row['error'] or ', '.join(row['violations'])}\n{row['query']}")
+    changed = compare_plan_fingerprints(report, args.fingerprints) if args.fingerprints else {}
+    for source, operators in changed.items():
+        print(f"\n[{source}] plan changed\nstored:  {operators['stored']}\ncurrent: {operators['current']}")
+    if len(failed) or changed:
+        raise SystemExit(1)
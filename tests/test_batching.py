@@ -0,0 +1,64 @@
+import threading
+
+from promg import DatabaseConnection, Query
+
+from util.batching import BatchingConnection, concurrent_transactions
+from util.instrumentation import InstrumentedConnection
+
+IN_TRANSACTIONS_QUERY = '''
+    MATCH (c:Class)
+    CALL (c) {
+        SET c.visited = true
+    } IN TRANSACTIONS OF $batch_size ROWS
+'''
+
+
+class PreparingConnection:
+    _prepare_query = DatabaseConnection._prepare_query
+
+    def __init__(self):
+        self.batch_size = 1000
+
+
+def prepare(_db_connection, _query_str):
+    return _db_connection._prepare_query(Query(query_str=_query_str))[0]
+
+
+def test_batches_are_serial_by_default():
+    db_connection = BatchingConnection(PreparingConnection())
+
+    assert "IN TRANSACTIONS OF 1000 ROWS" in prepare(db_connection, IN_TRANSACTIONS_QUERY)
+
+
+def test_concurrency_only_applies_to_the_thread_of_the_block():
+    db_connection = BatchingConnection(PreparingConnection())
+    other_thread = []
+
+    with db_connection.concurrent_transactions(4):
+        assert "IN 4 CONCURRENT TRANSACTIONS OF 1000 ROWS" in prepare(db_connection, IN_TRANSACTIONS_QUERY)
+        thread = threading.Thread(target=lambda: other_thread.append(prepare(db_connection, IN_TRANSACTIONS_QUERY)))
+        thread.start()
+        thread.join()
+
+    assert "IN TRANSACTIONS OF 1000 ROWS" in other_thread[0]
+    assert "IN TRANSACTIONS OF 1000 ROWS" in prepare(db_connection, IN_TRANSACTIONS_QUERY)
+
+
+def test_concurrency_stated_by_the_query_is_kept():
+    db_connection = BatchingConnection(PreparingConnection())
+    query_str = IN_TRANSACTIONS_QUERY.replace("IN TRANSACTIONS", "IN 2 CONCURRENT TRANSACTIONS")
+
+    assert "IN 2 CONCURRENT TRANSACTIONS OF 1000 ROWS" in prepare(db_connection, query_str)
+
+
+def test_concurrent_transactions_through_wrappers():
+    batching_connection = BatchingConnection(PreparingConnection())
+    db_connection = InstrumentedConnection(batching_connection)
+
+    with concurrent_transactions(db_connection, 4):
+        assert batching_connection.concurrency == 4
+    with concurrent_transactions(db_connection, None):
+        assert batching_connection.concurrency is None
+    # without a BatchingConnection the batches stay serial
+    with concurrent_transactions(PreparingConnection(), 4):
+        pass
@@ -0,0 +1,46 @@
+import pandas as pd
+from promg import DatabaseConnection
+
+from util.dfg import MISSING_CLASS_VALUE, aggregate_df_durations, write_dfg_edges
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.queries = []
+
+    def exec_query(self, query, **kwargs):
+        self.queries.append(DatabaseConnection._transform_query(query, **kwargs))
+        return []
+
+
+def get_df_durations():
+    return pd.DataFrame([
+        {"fromEventType": "IncidentEvent", "fromActivity": "Open", "toEventType": "IncidentEvent",
+         "toActivity": None, "duration": 10.0},
+        {"fromEventType": "IncidentEvent", "fromActivity": "Open", "toEventType": "IncidentEvent",
+         "toActivity": None, "duration": 30.0},
+        {"fromEventType": "IncidentEvent", "fromActivity": "Open", "toEventType": "IncidentEvent",
+         "toActivity": "Close", "duration": 20.0}
+    ])
+
+
+def test_null_activity_gets_its_own_class():
+    aggregates = aggregate_df_durations(get_df_durations()).set_index("toActivity")
+
+    assert aggregates.loc[MISSING_CLASS_VALUE, "count"] == 2
+    assert aggregates.loc[MISSING_CLASS_VALUE, "minDuration"] == 10.0
+    assert aggregates.loc["Close", "count"] == 1
+
+
+def test_null_activity_is_written_with_placeholder():
+    aggregates = aggregate_df_durations(get_df_durations())
+    aggregates.loc[0, "fromActivity"] = None  # aggregates of another source can still contain nulls
+    db_connection = RecordingConnection()
+
+    write_dfg_edges(db_connection, "Incident", aggregates)
+
+    rows = db_connection.queries[0].kwargs["rows"]
+    assert len(rows) == 2
+    for row in rows:
+        assert all(row[key] is not None for key in ["fromEventType", "fromActivity", "toEventType", "toActivity"])
+    assert MISSING_CLASS_VALUE in [row["fromActivity"] for row in rows]
@@ -0,0 +1,26 @@
+from promg import DatabaseConnection
+
+from util.enrichment_methods import get_materialize_pairs
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.executed = []
+
+    def exec_query(self, query, **kwargs):
+        self.executed.append(DatabaseConnection._transform_query(query, **kwargs).query_string)
+        return []
+
+
+def test_materialize_pairs_attributes_have_unique_keys():
+    db_connection = RecordingConnection()
+    config = {
+        "from_object": {"label": "Incident", "attributes": {"impact": "impact", "sysId": "sysId", "ci": "ciName"}},
+        "to_object": {"label": "Change", "attributes": {"ci": "ciName", "risk": "risk"}},
+        "relation_type": "CAUSED_BY"
+    }
+
+    get_materialize_pairs(db_connection, "IncidentChange", config)
+
+    assert ("{impact: from.impact, ci: COALESCE(from.ciName, to.ciName), risk: to.risk} as attributes"
+            in db_connection.executed[0])
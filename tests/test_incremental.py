@@ -0,0 +1,32 @@
+import pandas as pd
+from promg.data_managers.datastructures import DataStructure
+
+from util.incremental import read_delta_data_set
+
+
+def get_structure(_file_directory):
+    return DataStructure.from_dict({
+        "name": "Incident",
+        "file_directory": str(_file_directory) + "/",
+        "file_name": "incidents.csv",
+        "labels": ["GeneralRecord"],
+        "add_log": True,
+        "attributes": [
+            {"name": "incidentId", "columns": [{"name": "Incident ID", "dtype": "str"}], "optional": False},
+            {"name": "impact", "columns": [{"name": "Impact", "dtype": "int64"}], "optional": True}
+        ]
+    })
+
+
+def test_delta_rows_match_full_read(tmp_path):
+    pd.DataFrame({"Incident ID": [f"IM{index}" for index in range(10)],
+                  "Impact": range(10),
+                  "Ignored": "x"}).to_csv(tmp_path / "incidents.csv", index=False)
+    structure = get_structure(tmp_path)
+
+    df_log = structure.read_data_set(file_name="incidents.csv", use_sample=False, store_preprocessed_file=False)
+    df_delta = read_delta_data_set(structure, "incidents.csv", 6)
+
+    pd.testing.assert_frame_equal(df_delta, df_log[df_log.index > 6])
+    assert df_delta["recordId"].tolist() == ["7_incidents", "8_incidents", "9_incidents"]
+    assert len(read_delta_data_set(structure, "incidents.csv", 9)) == 0
@@ -0,0 +1,37 @@
+import threading
+
+from util.instrumentation import InstrumentedConnection
+
+
+class BatchedConnection:
+    """
+    Prepares every query as an apoc.periodic query, which InstrumentedConnection passes to exec_query.
+    """
+
+    def _prepare_query(self, query):
+        return query.query_string, {}, None, True, False
+
+    def exec_query(self, query):
+        return []
+
+
+def test_steps_of_threads_are_kept_apart():
+    db_connection = InstrumentedConnection(BatchedConnection())
+    barrier = threading.Barrier(2)
+
+    def run_step(_name, _queries):
+        with db_connection.step("build_entity", _name):
+            # both steps are active while the queries are executed
+            barrier.wait()
+            for _ in range(_queries):
+                db_connection.exec_query(f"CREATE (:{_name})")
+            barrier.wait()
+
+    threads = [threading.Thread(target=run_step, args=("Incident", 3)),
+               threading.Thread(target=run_step, args=("Change", 5))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert db_connection.get_report().set_index("name")["queries"].to_dict() == {"Incident": 3, "Change": 5}
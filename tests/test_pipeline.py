@@ -0,0 +1,66 @@
+from promg import DatabaseConnection
+
+from util.pipeline import run_pipeline
+
+
+class CheckpointConnection:
+    """
+    Keeps the checkpoints of the pipeline in memory, every other query fails (returns None, as exec_query of promg)
+    while fail is set.
+    """
+
+    def __init__(self):
+        self.checkpoints = {}
+        self.executed = []
+        self.fail = False
+
+    def exec_query(self, query, **kwargs):
+        query = DatabaseConnection._transform_query(query, **kwargs)
+        query_str, parameters = query.query_string, query.kwargs or {}
+        if "MERGE (c:PipelineCheckpoint" in query_str:
+            self.checkpoints[parameters["step"]] = parameters["hash"]
+            return []
+        if "DELETE c" in query_str:
+            self.checkpoints.pop(parameters["step"], None)
+            return []
+        if "PipelineCheckpoint" in query_str:
+            return [{"step": step, "hash": hash} for step, hash in self.checkpoints.items()]
+        self.executed.append(query_str)
+        return None if self.fail else []
+
+
+def get_steps():
+    return {
+        "first": {"function": lambda _db_connection: _db_connection.exec_query("CREATE (:First)"),
+                  "config": {"first": 1}},
+        "second": {"function": lambda _db_connection: _db_connection.exec_query("CREATE (:Second)"),
+                   "config": {"second": 1}, "depends_on": ["first"]}
+    }
+
+
+def test_step_with_failed_query_is_not_checkpointed():
+    db_connection = CheckpointConnection()
+    db_connection.fail = True
+
+    report = run_pipeline(db_connection, get_steps())
+
+    assert report.set_index("step")["status"].to_dict() == {"first": "failed", "second": "blocked"}
+    assert db_connection.checkpoints == {}
+
+
+def test_rerun_executes_failed_step_again():
+    db_connection = CheckpointConnection()
+    db_connection.fail = True
+    run_pipeline(db_connection, get_steps())
+
+    db_connection.fail = False
+    db_connection.executed = []
+    report = run_pipeline(db_connection, get_steps())
+
+    assert report.set_index("step")["status"].to_dict() == {"first": "done", "second": "done"}
+    assert db_connection.executed == ["CREATE (:First)", "CREATE (:Second)"]
+
+    db_connection.executed = []
+    report = run_pipeline(db_connection, get_steps())
+    assert report["status"].eq("skipped").all()
+    assert db_connection.executed == []
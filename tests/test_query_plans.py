@@ -0,0 +1,103 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+from promg import DatabaseConnection
+
+from util.query_plans import PlanCheckConnection, check_plan, check_query_plans, compare_plan_fingerprints
+
+# python check_query_plans.py --save-fingerprints tests/query_plan_fingerprints.json stores the fingerprints, the
+# database of the configuration in EKG_TEST_CONF should contain a graph built on the synthetic data
+FINGERPRINTS_PATH = Path(__file__).parent / "query_plan_fingerprints.json"
+
+
+PRODUCE_RESULTS_PLAN = {"operatorType": "ProduceResults@neo4j", "args": {}, "children": []}
+
+
+class ExplainResult:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def keys(self):
+        return ["count"]
+
+    def consume(self):
+        return type("Summary", (), {"plan": self.plan})()
+
+
+class ExplainSession:
+    def __init__(self, explained, plan):
+        self.explained = explained
+        self.plan = plan
+
+    def run(self, query_str, parameters):
+        self.explained.append(query_str)
+        return ExplainResult(self.plan)
+
+
+class ExplainConnection:
+    """
+    Records the executed and the explained queries instead of sending them to a database.
+    """
+    _prepare_query = DatabaseConnection._prepare_query
+
+    def __init__(self, plan=None):
+        self.plan = PRODUCE_RESULTS_PLAN if plan is None else plan
+        self.db_name = "neo4j"
+        self.batch_size = 1000
+        self.executed = []
+        self.explained = []
+        self.driver = self
+
+    @contextmanager
+    def get_session(self, database):
+        yield ExplainSession(self.explained, self.plan)
+
+    def exec_query(self, query, **kwargs):
+        self.executed.append(DatabaseConnection._transform_query(query, **kwargs).query_string)
+        return []
+
+
+def test_schema_commands_are_skipped():
+    db_connection = ExplainConnection()
+    plan_connection = PlanCheckConnection(db_connection)
+
+    plan_connection.exec_query("SHOW INDEXES YIELD name RETURN name")
+    plan_connection.exec_query("CREATE INDEX event_timestamp IF NOT EXISTS FOR (n:Event) ON (n.timestamp)")
+    plan_connection.exec_query("CREATE RANGE INDEX event_type IF NOT EXISTS FOR (n:Event) ON (n.eventType)")
+    plan_connection.exec_query("DROP CONSTRAINT incident_sysId IF EXISTS")
+    plan_connection.exec_query("CALL db.awaitIndexes(300)")
+    plan_connection.exec_query("CREATE (:Event {sysId: 'e1'})")
+
+    assert db_connection.executed == ["SHOW INDEXES YIELD name RETURN name"]
+    assert db_connection.explained == ["EXPLAIN CREATE (:Event {sysId: 'e1'})"]
+    assert [plan["skipped"] for plan in plan_connection.plans] == [True, True, True, True, False]
+
+
+def test_plan_over_row_budget_is_a_violation():
+    plan = {"operatorType": "ProduceResults@neo4j", "args": {"EstimatedRows": 5000.0},
+            "children": [{"operatorType": "NodeByLabelScan@neo4j", "args": {"EstimatedRows": 5000.0},
+                          "children": []}]}
+    plan_connection = PlanCheckConnection(ExplainConnection(plan))
+
+    plan_connection.exec_query("MATCH (e:Event) RETURN count(e) as count")
+
+    explained_plan = plan_connection.plans[0]["plan"]
+    assert check_plan(explained_plan, 100, []) == ["ProduceResults estimates 5000 rows (budget 100)",
+                                                   "NodeByLabelScan estimates 5000 rows (budget 100)"]
+    assert check_plan(explained_plan, 10000, ["NodeByLabelScan"]) == ["NodeByLabelScan"]
+
+
+@pytest.mark.skipif("EKG_TEST_CONF" not in os.environ, reason="no database configured, set EKG_TEST_CONF")
+def test_query_plans_match_fingerprints():
+    if not FINGERPRINTS_PATH.exists():
+        pytest.skip(f"no fingerprints stored in {FINGERPRINTS_PATH}")
+    from bpic14 import bpic14_configs as configs
+    from util.db_helper_functions import get_db_connection
+
+    report = check_query_plans(get_db_connection(os.environ["EKG_TEST_CONF"]), configs)
+
+    assert report[report["status"] == "error"]["source"].tolist() == []
+    assert report[report["status"] == "violations"][["source", "violations"]].values.tolist() == []
+    assert compare_plan_fingerprints(report, FINGERPRINTS_PATH) == {}
@@ -0,0 +1,48 @@
+from promg import DatabaseConnection
+
+from util.pipeline import StepConnection
+from util.scheduler import conflicts, get_entity_footprint, get_relationship_footprint, run_scheduled
+
+
+def get_relationship_config(_from_label, _to_label):
+    return {"from_object": {"label": _from_label}, "to_object": {"label": _to_label}}
+
+
+def test_relationships_to_the_same_nodes_conflict():
+    # different relationship types, both lock the Incident nodes
+    assert conflicts(get_relationship_footprint("PART_OF", get_relationship_config("Interaction", "Incident")),
+                     get_relationship_footprint("CAUSED_BY", get_relationship_config("Incident", "Change")))
+    assert not conflicts(get_relationship_footprint("PART_OF", get_relationship_config("Interaction", "Incident")),
+                         get_relationship_footprint("RELATED_TO", get_relationship_config("Change", "KM")))
+    # entities link the records of their own log only
+    assert not conflicts(get_entity_footprint("Incident", {"log": "incidents"}),
+                         get_entity_footprint("Change", {"log": "changes"}))
+    assert conflicts(get_entity_footprint("Incident", {"log": "incidents"}),
+                     get_entity_footprint("Interaction", {"log": None}))
+
+
+class DeadlockConnection:
+    """
+    Rolls back (returns None, as exec_query of promg) the first execution of every query.
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def exec_query(self, query, **kwargs):
+        query = DatabaseConnection._transform_query(query, **kwargs)
+        self.executed.append(query.query_string)
+        return [] if self.executed.count(query.query_string) > 1 else None
+
+
+def test_scheduled_queries_go_through_wrapped_connection():
+    db_connection = StepConnection(DeadlockConnection())
+    tasks = [(label, get_entity_footprint(label, {"log": label}), f"MERGE (:{label})",
+              ("build_entity", label, {"log": label}, 0)) for label in ["Incident", "Change"]]
+
+    run_scheduled(db_connection, tasks, max_retries=1)
+
+    assert sorted(db_connection.executed) == ["MERGE (:Change)", "MERGE (:Change)",
+                                              "MERGE (:Incident)", "MERGE (:Incident)"]
+    # the retries succeeded, so the step did not fail
+    assert db_connection.failures == []
@@ -1,6 +1,8 @@
 # Import logging and surpress warnings
 import logging
 
+from util.index_manager import get_index_manager
+from util.instrumentation import instrumented_step
 from util.transformer_functions import create_index
 
 logging.getLogger("neo4j").setLevel(logging.ERROR)
@@ -12,7 +14,12 @@ from promg import Query
 first = True
 
 
-def add_object_type_node(_db_connection, _object_type):
+def add_object_type_node(_db_connection, _object_type, _type_edges=True):
+    """
+    Create the ObjectType node and stamp the objectType property on every node with label _object_type.
+    With _type_edges, the nodes are also linked to the ObjectType node with an IS_OF_TYPE relationship, without them
+    the ObjectType node is metadata only and queries filter on the label or the objectType property.
+    """
     query_create_ot = '''
         MERGE (ot:ObjectType {objectType: $objectType})
     '''
@@ -28,29 +35,35 @@ def add_object_type_node(_db_connection, _object_type):
         MATCH (ot:ObjectType {objectType: $objectType })
         MATCH (o:$label)
         CALL (o, ot) {
-            MERGE (o) - [:IS_OF_TYPE] -> (ot)
-            } IN TRANSACTIONS
+            SET o.objectType = $objectType
+            $type_edge
+            } IN TRANSACTIONS OF $batch_size ROWS
     '''
 
     query = Query(
         query_str=query_str,
         parameters={'objectType': _object_type},
-        template_string_parameters={"label": _object_type}
+        template_string_parameters={"label": _object_type,
+                                    "type_edge": "MERGE (o) - [:IS_OF_TYPE] -> (ot)" if _type_edges else ""}
     )
 
-    _db_connection.exec_query(query)
+    with instrumented_step(_db_connection, "add_object_type_node", _object_type):
+        _db_connection.exec_query(query)
     print(f'→ (:ObjectType {{objectType: "{_object_type}"}}) created.')
 
 
-def add_event_type_node(_db_connection, event_type):
+def add_event_type_node(_db_connection, event_type, _type_edges=True):
     '''
-    This function creates an EventType node (e.g., "IncidentEvent", "InteractionEvent") and then links every node of
-    that label in the graph to this type node with an IS_OF_TYPE relationship.
+    This function creates an EventType node (e.g., "IncidentEvent", "InteractionEvent"), stamps the eventType property
+    on every node of that label and relabels it to :Event. With _type_edges, the nodes are also linked to this type
+    node with an IS_OF_TYPE relationship.
     :param _db_connection:
     :param event_type:
+    :param _type_edges:
     :return:
     '''
     create_index(_db_connection, 'Event')
+    get_index_manager(_db_connection).ensure_node_index('Event', 'eventType')
 
     query_create_et = '''
         MERGE (et:EventType {eventType: $eventType})
@@ -67,18 +80,21 @@ def add_event_type_node(_db_connection, event_type):
         MATCH (et:EventType {eventType: $eventType })
         MATCH (e:$label)
         CALL (e, et) {
-            MERGE (e) - [:IS_OF_TYPE] -> (et)
+            $type_edge
+            SET e.eventType = $eventType
             REMOVE e:$label
             SET e:Event
         }
-        IN TRANSACTIONS
+        IN TRANSACTIONS OF $batch_size ROWS
     '''
 
     query = Query(
         query_str=query_str,
         parameters={'eventType': event_type},
-        template_string_parameters={"label": event_type}
+        template_string_parameters={"label": event_type,
+                                    "type_edge": "MERGE (e) - [:IS_OF_TYPE] -> (et)" if _type_edges else ""}
     )
 
-    _db_connection.exec_query(query)
+    with instrumented_step(_db_connection, "add_event_type_node", event_type):
+        _db_connection.exec_query(query)
     print(f'→ (:EventType {{eventType: "{event_type}"}}) created.')
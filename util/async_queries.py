@@ -0,0 +1,83 @@
+# Import logging and surpress warnings
+import logging
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import yaml
+from neo4j import AsyncGraphDatabase
+
+# Import promg
+from promg import Query
+
+
+def split_query(_query):
+    """
+    Return the query string and parameters of a string, a (string, parameters) tuple or a promg Query.
+    """
+    if isinstance(_query, Query):
+        return _query.query_string, _query.kwargs or {}
+    if isinstance(_query, tuple):
+        return _query[0], _query[1] or {}
+    return _query, {}
+
+
+async def _fetch(tx, _query_str, _parameters):
+    result = await tx.run(_query_str, _parameters)
+    return await result.data()
+
+
+async def _run_query(_driver, _db_name, _name, _query, _semaphore):
+    query_str, parameters = split_query(_query)
+    async with _semaphore:
+        start = time.perf_counter()
+        try:
+            async with _driver.session(database=_db_name) as session:
+                records = await session.execute_read(_fetch, query_str, parameters)
+            return _name, pd.DataFrame(records), time.perf_counter() - start, None
+        except Exception as e:
+            print(f"Query {_name} failed: {e}")
+            return _name, None, time.perf_counter() - start, str(e)
+
+
+async def run_queries_async(conf_path, queries, max_connections=8):
+    """
+    Run the independent read queries concurrently on a pool of at most max_connections connections.
+    queries maps a name to a query string, a (query string, parameters) tuple or a promg Query.
+    Returns a dict with a DataFrame per name (None when the query failed) and a DataFrame with the time per query.
+    """
+    config = yaml.safe_load(open(conf_path))
+    semaphore = asyncio.Semaphore(max_connections)
+
+    start = time.perf_counter()
+    async with AsyncGraphDatabase.driver(config["uri"], auth=(config["user"], config["password"]),
+                                         max_connection_pool_size=max_connections) as driver:
+        results = await asyncio.gather(*[_run_query(driver, config["db_name"], name, query, semaphore)
+                                         for name, query in queries.items()])
+    total_time = time.perf_counter() - start
+
+    timings = pd.DataFrame([{"query": name, "seconds": round(seconds, 3), "rows": len(df) if df is not None else None,
+                             "error": error} for name, df, seconds, error in results])
+    print(f"→ {len(queries)} queries executed in {total_time:.2f}s "
+          f"(sum of query times {timings['seconds'].sum():.2f}s)")
+    return {name: df for name, df, _, _ in results}, timings
+
+
+def run_queries(conf_path, queries, max_connections=8):
+    """
+    Synchronous version of run_queries_async, can also be used in Jupyter where an event loop is already running.
+    """
+    coroutine = run_queries_async(conf_path, queries, max_connections)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # an event loop is running (e.g. in a notebook), so the queries are run in the event loop of another thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,169 @@
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+# Import promg
+from promg import DatabaseConnection
+
+IN_TRANSACTIONS = re.compile(r"IN\s+(\d+\s+)?(CONCURRENT\s+)?TRANSACTIONS(\s+OF\s+\S+\s+ROWS?)?", re.IGNORECASE)
+CONCURRENCY = re.compile(r"IN\s+(\d+)\s+CONCURRENT\s+TRANSACTIONS", re.IGNORECASE)
+CYPHER_KEYWORDS = re.compile(r"\b(MATCH|OPTIONAL MATCH|MERGE|CREATE|SET|REMOVE|DELETE|DETACH DELETE|UNWIND|WITH|CALL|"
+                             r"WHERE|RETURN|FOREACH|ORDER BY|COLLECT)\b")
+
+
+def get_query_shape(_query_str):
+    """
+    The sequence of clauses of a query, queries that only differ in labels, properties or parameters (e.g. the same
+    function for another config) share their shape and thereby their batch size.
+    """
+    return " ".join(CYPHER_KEYWORDS.findall(_query_str.upper()))
+
+
+def is_memory_error(_error):
+    return "memory" in str(_error).lower()
+
+
+def concurrent_transactions(_db_connection, _concurrency=None):
+    """
+    concurrent_transactions of the BatchingConnection that _db_connection is or wraps. Without a BatchingConnection or
+    _concurrency, the batches stay serial.
+    """
+    if _concurrency and hasattr(_db_connection, "concurrent_transactions"):
+        return _db_connection.concurrent_transactions(_concurrency)
+    return nullcontext()
+
+
+class BatchingConnection:
+    """
+    Wraps a DatabaseConnection and sets the batch size of all CALL {...} IN TRANSACTIONS queries. The batch size is tuned per query shape from the measured updates per second: it is doubled
+    while the throughput improves and halved once it drops. When a query runs out of transaction memory, it is retried
+    with half the batch size. The settings and throughput of every query are logged.
+    The batches are only run concurrently when the query states IN n CONCURRENT TRANSACTIONS itself, or within
+    concurrent_transactions for the queries of the calling thread, e.g. the DF edges of an object type of which the
+    objects do not share events. The memory handling is reactive: the transaction memory is not measured.
+    Use get_db_connection(conf_path, batching=True), can be combined with instrumented=True.
+    """
+
+    def __init__(self, db_connection, batch_size=None, min_batch_size=1000, max_batch_size=100000, adaptive=True,
+                 max_memory_retries=3):
+        self._db_connection = db_connection
+        self.initial_batch_size = batch_size or db_connection.batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.adaptive = adaptive
+        self.max_memory_retries = max_memory_retries
+        # concurrency of concurrent_transactions per thread, so it does not leak into steps that run in parallel
+        self._local = threading.local()
+        self.rows = []
+        # per query shape: current batch size, direction of the last change and last throughput
+        self._settings = {}
+
+    def __getattr__(self, item):
+        return getattr(self._db_connection, item)
+
+    @property
+    def concurrency(self):
+        return getattr(self._local, "concurrency", None)
+
+    @contextmanager
+    def concurrent_transactions(self, _concurrency=4):
+        """
+        Run the batches of the queries that this thread executes in this block as IN CONCURRENT TRANSACTIONS.
+        Only use this for steps of which the batches do not write to the same nodes (e.g. not for steps that MERGE
+        shared Class or entity nodes or DF edges between shared events), otherwise they deadlock or duplicate work.
+        """
+        previous = self.concurrency
+        self._local.concurrency = _concurrency
+        try:
+            yield
+        finally:
+            self._local.concurrency = previous
+
+    def get_batch_size(self, _shape):
+        return self._settings.get(_shape, {}).get("batch_size", self.initial_batch_size)
+
+    def _prepare_query(self, query):
+        query_str, parameters, db_name, is_batched, is_implicit = self._db_connection._prepare_query(query)
+        if IN_TRANSACTIONS.search(query_str):
+            batch_size = self.get_batch_size(get_query_shape(query_str))
+            # the concurrency that the query states itself is kept
+            stated = CONCURRENCY.search(query_str)
+            concurrency = self.concurrency or (int(stated.group(1)) if stated else None)
+            concurrency = f"{concurrency} CONCURRENT " if concurrency else ""
+            query_str = IN_TRANSACTIONS.sub(f"IN {concurrency}TRANSACTIONS OF {batch_size} ROWS", query_str)
+            parameters = {**parameters, "batch_size": batch_size}
+        return query_str, parameters, db_name, is_batched, is_implicit
+
+    def exec_query(self, query, **kwargs):
+        query = DatabaseConnection._transform_query(query, **kwargs)
+        query_str = query.query_string
+        if not IN_TRANSACTIONS.search(query_str):
+            return self._db_connection.exec_query(query)
+
+        shape = get_query_shape(query_str)
+        for attempt in range(self.max_memory_retries + 1):
+            prepared_query_str, parameters, db_name, _, _ = self._prepare_query(query)
+            start = time.perf_counter()
+            try:
+                with self._db_connection.driver.get_session(database=db_name or self._db_connection.db_name) as session:
+                    result = session.run(prepared_query_str, parameters)
+                    data = result.data()
+                    summary = result.consume()
+            except Exception as e:
+                if is_memory_error(e) and attempt < self.max_memory_retries:
+                    self._set_batch_size(shape, max(self.min_batch_size, parameters["batch_size"] // 2), -1)
+                    print(f"Transaction memory exceeded with {parameters['batch_size']} rows, retrying with "
+                          f"{self.get_batch_size(shape)} rows")
+                    continue
+                # same behaviour as exec_query of promg
+                print("Latest transaction was rolled back")
+                print(f"This was your latest query: {prepared_query_str}")
+                print(e)
+                return None
+
+            seconds = time.perf_counter() - start
+            self.observe_query(prepared_query_str, seconds, summary)
+            return data
+
+    def _set_batch_size(self, _shape, _batch_size, _direction, _throughput=None):
+        self._settings[_shape] = {"batch_size": _batch_size, "direction": _direction, "throughput": _throughput}
+
+    def observe_query(self, query_str, seconds, summary):
+        """
+        Log the throughput of a query and tune the batch size of its shape for the next query.
+        """
+        if not IN_TRANSACTIONS.search(query_str):
+            return
+        match = re.search(r"TRANSACTIONS\s+OF\s+(\d+)\s+ROWS", query_str, re.IGNORECASE)
+        batch_size = int(match.group(1)) if match else self.initial_batch_size
+        counters = summary.counters
+        updates = counters.nodes_created + counters.relationships_created + counters.properties_set + \
+            counters.labels_added + counters.nodes_deleted + counters.relationships_deleted
+        throughput = updates / seconds if seconds > 0 else 0
+
+        shape = get_query_shape(query_str)
+        settings = self._settings.get(shape, {"direction": 1, "throughput": None})
+        next_batch_size = batch_size
+        if self.adaptive and updates > batch_size:
+            # keep the direction while the throughput improves, reverse it otherwise
+            direction = settings["direction"]
+            if settings["throughput"] is not None and throughput < settings["throughput"]:
+                direction = -direction
+            next_batch_size = batch_size * 2 if direction > 0 else batch_size // 2
+            next_batch_size = min(self.max_batch_size, max(self.min_batch_size, next_batch_size))
+            self._set_batch_size(shape, next_batch_size, direction, throughput)
+
+        concurrency = CONCURRENCY.search(query_str)
+        concurrency = int(concurrency.group(1)) if concurrency else None
+        self.rows.append({"shape": shape, "batch_size": batch_size, "concurrency": concurrency,
+                          "seconds": round(seconds, 3), "updates": updates, "updates/s": round(throughput),
+                          "next_batch_size": next_batch_size})
+        print(f"   [batching] {batch_size} rows per transaction"
+              f"{f', {concurrency} concurrent' if concurrency else ''}: "
+              f"{round(throughput)} updates/s, next {next_batch_size}")
+
+    def get_report(self):
+        return pd.DataFrame(self.rows)
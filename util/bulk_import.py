@@ -0,0 +1,369 @@
+# Import logging and surpress warnings
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import pandas as pd
+
+# Import promg
+from promg import Configuration, DatasetDescriptions, SemanticHeader
+
+from util.index_manager import get_index_manager
+from util.transformer_functions import create_index
+
+# Java DateTimeFormatter letters of the dataset description and their strptime directives, the offset (X) is not
+# parsed but taken from timezone_offset, as promg appends it to the value before parsing
+datetime_directives = {"d": "%d", "M": "%m", "y": "%Y", "H": "%H", "m": "%M", "s": "%S", "S": "%f", "X": ""}
+
+
+#######################################################################
+########################### READ THE LOGS #############################
+#######################################################################
+
+def get_strptime_format(_format):
+    def replace(match):
+        letters = match.group(0)
+        if letters == "yy":
+            return "%y"
+        if letters[0] not in datetime_directives:
+            raise ValueError(f"Datetime format {_format} cannot be converted, {letters} is not supported")
+        return datetime_directives[letters[0]]
+
+    return re.sub(r"([A-Za-z])\1*", replace, _format).strip()
+
+
+def get_offset(_timezone_offset):
+    if not _timezone_offset:
+        return "Z"
+    sign, digits = _timezone_offset[0], _timezone_offset[1:].replace(":", "")
+    return f"{sign}{digits[:2]}:{digits[2:4] or '00'}"
+
+
+def convert_datetime_column(_values, _datetime_object):
+    """
+    ISO strings of the datetime attribute and the import type, the same values as the timestamp conversion of load_data.
+    """
+    if _datetime_object.is_epoch:
+        timestamps = pd.to_datetime(_values, unit=_datetime_object.unit or "s", errors="coerce")
+    else:
+        timestamps = pd.to_datetime(_values, format=get_strptime_format(_datetime_object.format), errors="coerce")
+    if _datetime_object.get_date_type() == "DATE":
+        return timestamps.dt.strftime("%Y-%m-%d"), "date"
+    return timestamps.dt.strftime("%Y-%m-%dT%H:%M:%S") + get_offset(_datetime_object.timezone_offset), "datetime"
+
+
+def get_import_type(_dtype):
+    # same mapping as the CSV load of promg, other columns are strings
+    if pd.api.types.is_bool_dtype(_dtype):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(_dtype):
+        return "long"
+    if pd.api.types.is_float_dtype(_dtype):
+        return "double"
+    return "string"
+
+
+def filter_records(_structure, _df_log):
+    # same filters as load_data applies to the imported records
+    for exclude in [True, False]:
+        for name, values in _structure.get_attribute_value_pairs_filtered(exclude=exclude).items():
+            column = _df_log[name] if name in _df_log.columns else pd.Series(None, index=_df_log.index)
+            if values is None:
+                remove = column.notna() if exclude else column.isna()
+            else:
+                remove = column.isin(values) if exclude else ~column.isin(values)
+            _df_log = _df_log[~remove]
+    return _df_log
+
+
+def read_logs(_conf_path):
+    """
+    Read the files of the dataset description of the configuration into DataFrames, using the same preprocessing of
+    promg as load_data (samples, renaming, nan values, record ids and record labels).
+    Returns per file the log name (None when the records are not added to a log), the records, the labels per record
+    and the import type per column.
+    """
+    config = Configuration.init_conf_with_config_file(_conf_path)
+    dataset_descriptions = DatasetDescriptions(config=config)
+    semantic_header = SemanticHeader.create_semantic_header(config=config)
+
+    logs = []
+    for structure in dataset_descriptions.structures:
+        required_labels = structure.get_required_labels(records=semantic_header.records)
+        for file_name in structure.file_names:
+            df_log = structure.read_data_set(file_name=file_name, use_sample=config.use_sample,
+                                             use_preprocessed_file=config.use_preprocessed_files,
+                                             store_preprocessed_file=False)
+            df_log = structure.determine_optional_labels_in_log(df_log, records=semantic_header.records)
+            df_log = filter_records(structure, df_log)
+
+            labels = df_log.pop("labels").map(
+                lambda optional_labels: sorted(set(required_labels + optional_labels.split(":")) - {""}))
+            log_name = df_log.pop("log").iloc[0] if "log" in df_log.columns and len(df_log) else None
+
+            types = {column: get_import_type(dtype) for column, dtype in df_log.dtypes.items()}
+            for attribute, datetime_object in structure.get_datetime_formats().items():
+                if attribute in df_log.columns:
+                    df_log[attribute], types[attribute] = convert_datetime_column(df_log[attribute], datetime_object)
+
+            logs.append({"file_name": file_name, "log": log_name, "records": df_log, "labels": labels,
+                         "types": types})
+            print(f"→ {len(df_log)} records read from {file_name}")
+    return logs
+
+
+#######################################################################
+########################## ENTITIES OFFLINE ###########################
+#######################################################################
+
+def get_constant_value(_constant):
+    """
+    The value of a constant of a config, which is a Python value or a Cypher literal (e.g. "'Open'").
+    """
+    if not isinstance(_constant, str):
+        return _constant
+    if len(_constant) >= 2 and _constant[0] == _constant[-1] and _constant[0] in "'\"":
+        return _constant[1:-1]
+    raise ValueError(f"Constant {_constant} is a Cypher expression that cannot be evaluated offline")
+
+
+def get_constant_type(_value):
+    if isinstance(_value, bool):
+        return "boolean"
+    if isinstance(_value, int):
+        return "long"
+    if isinstance(_value, float):
+        return "double"
+    return "string"
+
+
+def get_config_logs(_logs, _config):
+    # configs without log read the records of all logs
+    return [log for log in _logs if _config.get("log") is None or log["log"] == _config["log"]]
+
+
+def get_entities(_logs, _label, _configs):
+    """
+    The entities of a label and their EXTRACTED_FROM record ids, with the same result as build_entity for all configs
+    in order: an entity is created per sysId (plus id_addition) of the records that have the sysId (and timestamp)
+    column and per property the first non-null value is kept, like n.key = COALESCE(n.key, r.attr).
+    Returns the entities, the import type per property and the (sysId, recordId) pairs.
+    """
+    frames = []
+    types = {}
+    for _config in _configs:
+        attributes = _config.get("attributes", {})
+        constants = {key: get_constant_value(value) for key, value in _config.get("constants", {}).items()}
+        for log in get_config_logs(_logs, _config):
+            records = log["records"]
+            if _config["sysId"] not in records.columns:
+                continue
+            if "timestamp" in attributes and attributes["timestamp"] not in records.columns:
+                continue
+            selected = records[_config["sysId"]].notna()
+            if "timestamp" in attributes:
+                selected &= records[attributes["timestamp"]].notna()
+            records = records[selected]
+
+            frame = pd.DataFrame({"sysId": records[_config["sysId"]].astype(str) + _config.get("id_addition", ""),
+                                  "recordId": records["recordId"]})
+            for key, attr in attributes.items():
+                frame[key] = records[attr] if attr in records.columns else None
+                types.setdefault(key, log["types"].get(attr, "string"))
+            for key, value in constants.items():
+                frame[key] = value
+                types.setdefault(key, get_constant_type(value))
+            frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=["sysId"]), types, pd.DataFrame(columns=["sysId", "recordId"])
+
+    extracted = pd.concat(frames, ignore_index=True)
+    grouped = extracted.groupby("sysId", sort=False)
+    entities = grouped[list(types.keys())].first() if types else pd.DataFrame(index=grouped.size().index)
+    return entities.reset_index(), types, extracted[["sysId", "recordId"]].drop_duplicates()
+
+
+def get_relationship_candidates(_logs, _extracted, _object, _config):
+    # the entities of the side that are extracted from the records of the config, matching the foreign key if set
+    candidates = pd.concat([_extracted[label].assign(label=label) for label in _object["label"].split("|")],
+                           ignore_index=True)
+    if "foreign_key" in _object:
+        foreign_keys = pd.concat([log["records"].loc[log["records"][_object["foreign_key"]].notna(),
+                                                     ["recordId", _object["foreign_key"]]]
+                                  for log in get_config_logs(_logs, _config)
+                                  if _object["foreign_key"] in log["records"].columns] or
+                                 [pd.DataFrame(columns=["recordId", _object["foreign_key"]])])
+        foreign_keys = pd.DataFrame({"recordId": foreign_keys["recordId"],
+                                     "sysId": foreign_keys[_object["foreign_key"]].astype(str)})
+        return candidates.merge(foreign_keys, on=["recordId", "sysId"])
+    record_ids = pd.concat([log["records"]["recordId"] for log in get_config_logs(_logs, _config)] or
+                           [pd.Series(dtype=object, name="recordId")])
+    return candidates[candidates["recordId"].isin(record_ids)]
+
+
+def get_relationships(_logs, _extracted, _type, _configs):
+    """
+    The relationships of a type with the same result as build_relationship for all configs in order: every pair of a
+    from and to entity that are extracted from the same record (and match the foreign keys) is related once and per
+    property the first non-null value is kept.
+    Returns the relationships (with the labels of both ends, which are the ID spaces) and the import type per property.
+    """
+    frames = []
+    types = {}
+    for _config in _configs:
+        attributes = _config.get("attributes", {})
+        constants = {key: get_constant_value(value) for key, value in _config.get("constants", {}).items()}
+        from_candidates = get_relationship_candidates(_logs, _extracted, _config["from_object"], _config)
+        to_candidates = get_relationship_candidates(_logs, _extracted, _config["to_object"], _config)
+        pairs = from_candidates.merge(to_candidates, on="recordId", suffixes=("_from", "_to"))
+
+        if attributes:
+            records = pd.concat([log["records"] for log in get_config_logs(_logs, _config)], ignore_index=True)
+            pairs = pairs.merge(records[["recordId"] + [attr for attr in set(attributes.values())
+                                                        if attr in records.columns]], on="recordId", how="left")
+            for key, attr in attributes.items():
+                pairs[key] = pairs[attr] if attr in pairs.columns else None
+                types.setdefault(key, next((log["types"][attr] for log in _logs if attr in log["types"]), "string"))
+        for key, value in constants.items():
+            pairs[key] = value
+            types.setdefault(key, get_constant_type(value))
+        frames.append(pairs[["sysId_from", "label_from", "sysId_to", "label_to"] +
+                            [key for key in types if key in pairs.columns]])
+
+    keys = ["sysId_from", "label_from", "sysId_to", "label_to"]
+    relationships = pd.concat(frames, ignore_index=True)
+    if types:
+        relationships = relationships.groupby(keys, sort=False)[list(types.keys())].first().reset_index()
+    else:
+        relationships = relationships.drop_duplicates(keys)
+    return relationships, types
+
+
+#######################################################################
+######################## WRITE THE IMPORT FILES #######################
+#######################################################################
+
+def write_import_file(_df, _header, _path):
+    """
+    Write the rows with the header (e.g. sysId:ID(Incident), timestamp:datetime, :LABEL) in the first line, null values
+    are written as empty fields, which are not imported as property.
+    """
+    _df = _df.astype(object).where(_df.notna(), None)
+    _df.to_csv(_path, index=False, header=_header)
+    return _path
+
+
+def get_property_header(_types):
+    return [key if import_type == "string" else f"{key}:{import_type}" for key, import_type in _types.items()]
+
+
+def write_import_files(_conf_path, _objects, _events, _o2o_relationships, _e2o_relationships, _output_directory,
+                       _checkpoints: Dict[str, str] = None):
+    """
+    Build the initial EKG offline: the (:Log), (:Record) and (:RecordType) nodes of load_data, the entities of the
+    objects and events configs and the relationships of the o2o and e2o configs are written as node and
+    relationship CSV files in the format of neo4j-admin database import, without a database.
+    The graph is typed like build_ekg.py: objects get the objectType property, events get the :Event label and the
+    eventType property and the ObjectType/EventType nodes have no IS_OF_TYPE relationships. With _checkpoints
+    (step: hash), (:PipelineCheckpoint) nodes are written so build_ekg.py skips these steps after the import.
+    Returns the node files and relationship files.
+    """
+    os.makedirs(_output_directory, exist_ok=True)
+    nodes, relationships = [], []
+
+    def path(_name):
+        return os.path.join(_output_directory, re.sub(r"[^\w.-]", "_", _name) + ".csv")
+
+    logs = read_logs(_conf_path)
+    log_names = sorted({log["log"] for log in logs if log["log"] is not None})
+    nodes.append(write_import_file(pd.DataFrame({"name": log_names, ":LABEL": "Log"}),
+                                   ["name:ID(Log)", ":LABEL"], path("Log")))
+    record_types = sorted({label for log in logs for labels in log["labels"] for label in labels})
+    nodes.append(write_import_file(pd.DataFrame({"type": record_types, ":LABEL": "RecordType"}),
+                                   ["type:ID(RecordType)", ":LABEL"], path("RecordType")))
+
+    for log in logs:
+        name = log["file_name"][:-4]
+        # the ID column also sets the recordId property
+        header = ["recordId:ID(Record)" if column == "recordId" else
+                  get_property_header({column: log["types"][column]})[0] for column in log["records"].columns]
+        nodes.append(write_import_file(log["records"].assign(**{":LABEL": "Record"}), header + [":LABEL"],
+                                       path(f"Record_{name}")))
+
+        if log["log"] is not None:
+            relationships.append(write_import_file(
+                pd.DataFrame({"log": log["log"], "recordId": log["records"]["recordId"], ":TYPE": "CONTAINS"}),
+                [":START_ID(Log)", ":END_ID(Record)", ":TYPE"], path(f"CONTAINS_Log_{name}")))
+        record_labels = log["labels"].explode().dropna()
+        relationships.append(write_import_file(
+            pd.DataFrame({"recordId": log["records"]["recordId"].loc[record_labels.index],
+                          "recordType": record_labels, ":TYPE": "IS_OF_TYPE"}),
+            [":START_ID(Record)", ":END_ID(RecordType)", ":TYPE"], path(f"IS_OF_TYPE_Record_{name}")))
+
+    extracted = {}
+    for _entities, type_property in [(_objects, "objectType"), (_events, "eventType")]:
+        for _label, _configs in _entities.items():
+            entities, types, extracted[_label] = get_entities(logs, _label, _configs)
+            node_label = "Event" if type_property == "eventType" else _label
+            entities = entities.assign(**{type_property: _label, ":LABEL": node_label})
+            header = [f"sysId:ID({_label})"] + get_property_header(types) + [type_property, ":LABEL"]
+            nodes.append(write_import_file(entities, header, path(_label)))
+            relationships.append(write_import_file(
+                extracted[_label].assign(**{":TYPE": "EXTRACTED_FROM"}),
+                [f":START_ID({_label})", ":END_ID(Record)", ":TYPE"], path(f"EXTRACTED_FROM_{_label}")))
+            print(f"→ {len(entities)} {_label} nodes")
+
+    nodes.append(write_import_file(pd.DataFrame({"objectType": list(_objects.keys()), ":LABEL": "ObjectType"}),
+                                   ["objectType:ID(ObjectType)", ":LABEL"], path("ObjectType")))
+    nodes.append(write_import_file(pd.DataFrame({"eventType": list(_events.keys()), ":LABEL": "EventType"}),
+                                   ["eventType:ID(EventType)", ":LABEL"], path("EventType")))
+
+    for _relationships in [_o2o_relationships, _e2o_relationships]:
+        for _type, _configs in _relationships.items():
+            _relationships_of_type, types = get_relationships(logs, extracted, _type, _configs)
+            # one file per pair of ID spaces
+            for (from_label, to_label), group in _relationships_of_type.groupby(["label_from", "label_to"]):
+                header = [f":START_ID({from_label})", f":END_ID({to_label})"] + get_property_header(types) + [":TYPE"]
+                relationships.append(write_import_file(
+                    group[["sysId_from", "sysId_to"] + list(types.keys())].assign(**{":TYPE": _type}), header,
+                    path(f"{_type}_{from_label}_{to_label}")))
+            print(f"→ {len(_relationships_of_type)} [:{_type}] relationships")
+
+    if _checkpoints:
+        finished_at = datetime.now(timezone.utc).isoformat()
+        nodes.append(write_import_file(
+            pd.DataFrame({"step": list(_checkpoints.keys()), "hash": list(_checkpoints.values()), "seconds": 0.0,
+                          "finishedAt": finished_at, ":LABEL": "PipelineCheckpoint"}),
+            ["step:ID(PipelineCheckpoint)", "hash", "seconds:double", "finishedAt:datetime", ":LABEL"],
+            path("PipelineCheckpoint")))
+
+    print(f"→ {len(nodes)} node files and {len(relationships)} relationship files written to {_output_directory}")
+    return nodes, relationships
+
+
+def get_import_command(_database, _nodes: List[str], _relationships: List[str]):
+    """
+    The neo4j-admin command that imports the files into an empty database, the database has to be stopped.
+    """
+    return " ".join(["neo4j-admin database import full", _database, "--overwrite-destination"] +
+                    [f"--nodes={node_file}" for node_file in _nodes] +
+                    [f"--relationships={relationship_file}" for relationship_file in _relationships])
+
+
+def create_imported_indexes(_db_connection, _objects, _events):
+    """
+    neo4j-admin import does not create indexes, ensure the indexes that build_entities and add_event_type_node
+    create in a transactional build.
+    """
+    for _label in _objects.keys():
+        create_index(_db_connection, _label)
+    create_index(_db_connection, "Event")
+    index_manager = get_index_manager(_db_connection)
+    index_manager.ensure_node_index("Event", "eventType")
+    index_manager.await_indexes()
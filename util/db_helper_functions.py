@@ -1,49 +1,112 @@
 from promg.modules.db_management import DBManagement
+from promg.modules.data_importer import Importer
 from promg import Configuration, DatabaseConnection, Performance, SemanticHeader, DatasetDescriptions, OcedPg, Query
+from neo4j.exceptions import TransientError
+import os
+import time
+from weakref import WeakKeyDictionary
+
+import pandas as pd
 import yaml
 
+from util.batching import BatchingConnection
+from util.index_manager import get_index_manager
+from util.instrumentation import InstrumentedConnection
+
+# last statistics per connection, used to report the growth between calls of get_graph_statistics
+_previous_statistics = WeakKeyDictionary()
+
 
-def get_graph_statistics(_db_connection):
+def get_count_store_statistics(_db_connection):
     """
-    Statistics about nodes and relations.
+    Node counts per label, relationship counts per type and totals, answered from the count store.
+    Uses apoc.meta.stats when available, otherwise one count query per label and type (also served by the count
+    store, as they have a single label or type and no predicates).
     """
+    stats_query = """
+        CALL apoc.meta.stats() YIELD labels, relTypesCount, nodeCount, relCount
+        RETURN labels, relTypesCount, nodeCount, relCount
+    """
+    with _db_connection.driver.get_session(database=_db_connection.db_name) as session:
+        try:
+            stats = session.run(stats_query).single()
+            rows = [("node", label, count) for label, count in stats["labels"].items()]
+            rows += [("relationship", rel_type, count) for rel_type, count in stats["relTypesCount"].items()]
+            rows += [("total", "nodes", stats["nodeCount"]), ("total", "relationships", stats["relCount"])]
+            return rows
+        except Exception:
+            pass
+
+        labels = [record["label"] for record in session.run("CALL db.labels() YIELD label RETURN label")]
+        rel_types = [record["relationshipType"] for record in
+                     session.run("CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType")]
+        rows = [("node", label, session.run(f"MATCH (n:`{label}`) RETURN count(n) AS count").single()["count"])
+                for label in labels]
+        rows += [("relationship", rel_type,
+                  session.run(f"MATCH ()-[r:`{rel_type}`]->() RETURN count(r) AS count").single()["count"])
+                 for rel_type in rel_types]
+        rows += [("total", "nodes", session.run("MATCH (n) RETURN count(n) AS count").single()["count"]),
+                 ("total", "relationships", session.run("MATCH ()-[r]->() RETURN count(r) AS count").single()["count"])]
+        return rows
+
 
+def get_label_combination_statistics(_db_connection):
+    """
+    Node counts per combination of labels, requires a scan over all nodes.
+    """
+    node_query = """
+    MATCH (n)
+    WITH n, labels(n) as labels
+    RETURN reduce(label_str = "(", l in labels | label_str + ":" + l) + ")" as label, count(n) as count ORDER 
+    BY count DESC
+    """
     with _db_connection.driver.get_session(database=_db_connection.db_name) as session:
-        print("\n=== GRAPH STATISTICS ===")
+        return [("label_combination", record["label"], record["count"]) for record in session.run(node_query)]
 
-        try:
-            node_query = """
-            MATCH (n)
-            WITH n, labels(n) as labels
-            RETURN reduce(label_str = "(", l in labels | label_str + ":" + l) + ")" as label, count(n) as count ORDER 
-            BY count DESC
-            """
-            node_counts = session.run(node_query)
-            print("\n--- Node counts ---")
-            for record in node_counts:
-                print(f"{record['label']:<30} {record['count']}")
-
-            rel_query = """
-            MATCH (n) - [r] -> (n2)
-            RETURN "[:" + type(r) + "]" as  type, count(r) as count ORDER BY count DESC
-            """
-            rel_counts = session.run(rel_query)
-            print("\n--- Relationship counts ---")
-            for record in rel_counts:
-                print(f"{record['type']:<30} {record['count']}")
-
-            total_nodes = session.run("MATCH (n) RETURN count(n) AS total").single()["total"]
-            total_rels = session.run("MATCH ()-[r]->() RETURN count(r) AS total").single()["total"]
-
-            print("\n--- Totals ---")
-            print(f"Total nodes: {total_nodes}")
-            print(f"Total relationships: {total_rels}")
-
-        except Exception as e:
-            print(f"Failed to get graph statistics: {e}")
-
-
-def get_db_connection(conf_path):
+
+def get_graph_statistics(_db_connection, _label_combinations=False):
+    """
+    Statistics about nodes and relations, taken from the count store so that it can be called after every step.
+    The exact breakdown per combination of labels scans the whole graph and is only added when _label_combinations is
+    set.
+    Returns a DataFrame with the counts and the difference with the previous call on the same connection.
+    """
+    print("\n=== GRAPH STATISTICS ===")
+
+    try:
+        rows = get_count_store_statistics(_db_connection)
+        if _label_combinations:
+            rows += get_label_combination_statistics(_db_connection)
+    except Exception as e:
+        print(f"Failed to get graph statistics: {e}")
+        return None
+
+    statistics = pd.DataFrame(rows, columns=["kind", "name", "count"])
+    previous = _previous_statistics.get(_db_connection)
+    if previous is not None:
+        statistics = statistics.merge(previous.rename(columns={"count": "previous"}), on=["kind", "name"],
+                                      how="outer")
+        statistics[["count", "previous"]] = statistics[["count", "previous"]].fillna(0).astype("int64")
+    else:
+        statistics["previous"] = 0
+    statistics["diff"] = statistics["count"] - statistics["previous"]
+    statistics = statistics.sort_values(["kind", "count"], ascending=[True, False], ignore_index=True)
+    _previous_statistics[_db_connection] = statistics[["kind", "name", "count"]]
+
+    for kind, title in [("node", "Node counts"), ("label_combination", "Label combination counts"),
+                        ("relationship", "Relationship counts"), ("total", "Totals")]:
+        kind_statistics = statistics[statistics["kind"] == kind]
+        if len(kind_statistics) == 0:
+            continue
+        print(f"\n--- {title} ---")
+        for _, row in kind_statistics.iterrows():
+            diff = f" ({row['diff']:+})" if previous is not None and row["diff"] != 0 else ""
+            print(f"{row['name']:<30} {row['count']}{diff}")
+
+    return statistics
+
+
+def get_db_connection(conf_path, instrumented=False, profile=False, batching=False):
     # retrieve configuration for case_study
     config = yaml.safe_load(open(conf_path))
     print(f"These are the credentials that I expect to be set for the database.")
@@ -54,19 +117,135 @@ def get_db_connection(conf_path):
     print(f"If you have other credentials, please change them at: {conf_path}")
     config = Configuration.init_conf_with_config_file(conf_path)
     db_connection = DatabaseConnection.set_up_connection(config=config)
+    if batching:
+        # tunes the batch size of the IN TRANSACTIONS queries, concurrency is opt-in per step, see
+        # concurrent_transactions of util/batching.py
+        db_connection = BatchingConnection(db_connection)
+    if instrumented:
+        # records time and counters per step, see db_connection.save_report
+        db_connection = InstrumentedConnection(db_connection, profile=profile)
     return db_connection
 
 
 def clear_database(db_connection):
     db_manager = DBManagement(db_connection=db_connection, semantic_header=None)
     db_manager.clear_db()
+    # the database is replaced, including its indexes and constraints
+    get_index_manager(db_connection).invalidate()
+
+
+def read_parquet_data_set(structure, file_name, parquet_path):
+    """
+    Read a file of the dataset description from its Parquet copy in parquet_path (written by
+    bpic14/bpic14_prepare.py --format parquet) with the same preprocessing as promg applies to the CSV file.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet requires pyarrow, install it using `pip install pyarrow`")
+
+    path = os.path.join(parquet_path, f"{file_name[:-4]}.parquet")
+    columns = pq.read_schema(path).names
+    df_log = pd.read_parquet(path, columns=[column for column in structure.get_required_columns()
+                                            if column in columns])
+    for column, dtype in structure.get_dtype_dict().items():
+        if column in df_log.columns:
+            try:
+                df_log[column] = df_log[column].astype(dtype)
+            except (ValueError, TypeError):
+                pass  # written as str by bpic14_prepare.py as the values cannot be cast
+    # promg parses the true and false values of the columns without dtype as booleans
+    boolean_values = {**{value: True for value in structure.true_values or []},
+                      **{value: False for value in structure.false_values or []}}
+    for column in df_log.columns:
+        values = df_log[column].dropna()
+        if boolean_values and column not in structure.get_dtype_dict() and len(values) and \
+                values.isin(list(boolean_values.keys())).all():
+            df_log[column] = df_log[column].map(boolean_values)
+
+    return preprocess_data_set(structure, df_log, file_name)
+
+
+def preprocess_data_set(structure, df_log, file_name):
+    """
+    The preprocessing of prepare_event_data_sets of promg for a file that has been read, without sample as load_data
+    does not use samples. The recordIds are based on the index of df_log.
+    """
+    df_log = structure.preprocess_according_to_attributes(df_log)
+    df_log = df_log[[f"{attribute_name}_attribute" for attribute_name in structure.attributes.keys()]]
+    df_log = df_log.rename(columns={f"{attribute_name}_attribute": attribute_name
+                                    for attribute_name in structure.attributes.keys()})
+    if structure.split_combined_events:
+        df_log = structure.split_df_log_into_combined_events(df_log)
+        structure.update_attributes()
+    if structure.add_log:
+        df_log["log"] = file_name
+    if structure.add_index:
+        df_log["index"] = df_log.index
+    df_log = df_log.dropna(how='all', axis=1)
+    df_log = df_log.dropna(how='all')
+    df_log["recordId"] = structure.create_record_id_column(df_log, file_name)
+    return df_log
 
 
-def load_data(db_connection, conf_path):
+def load_data(db_connection, conf_path, parquet_path=None):
+    """
+    Load the files of the dataset description. With parquet_path, the Parquet copies of the files in this directory
+    are read instead of the CSV files (see bpic14/bpic14_prepare.py --format parquet), skipping the CSV parsing.
+    """
     config = Configuration.init_conf_with_config_file(conf_path)
     dataset_descriptions = DatasetDescriptions(config=config)
     semantic_header = SemanticHeader.create_semantic_header(config=config)
-    data_loader = OcedPg(database_connection=db_connection,
-                         dataset_descriptions=dataset_descriptions,
-                         semantic_header=semantic_header)
-    data_loader.load()
+    if parquet_path is None:
+        data_loader = OcedPg(database_connection=db_connection,
+                             dataset_descriptions=dataset_descriptions,
+                             semantic_header=semantic_header)
+        data_loader.load()
+        return
+
+    # same steps as the Importer of promg, with the DataFrames read from Parquet, see load_delta of incremental.py
+    importer = Importer(database_connection=db_connection,
+                        data_structures=dataset_descriptions,
+                        semantic_header=semantic_header)
+    imported_logs = DBManagement(db_connection=db_connection).get_imported_logs()
+    for structure in dataset_descriptions.structures:
+        required_labels = structure.get_required_labels(records=importer.records)
+        for file_name in structure.file_names:
+            if file_name in imported_logs:
+                continue
+            df_log = read_parquet_data_set(structure, file_name, parquet_path)
+            df_log = structure.determine_optional_labels_in_log(df_log, records=importer.records)
+            importer._import_nodes_from_data(df_log=df_log, file_name=file_name, required_labels=required_labels)
+            if structure.has_datetime_attribute():
+                importer._reformat_timestamps(structure=structure, required_labels=required_labels)
+            importer._filter_nodes(structure=structure, required_labels=required_labels)
+            print(f"→ {len(df_log)} records loaded for {file_name} from Parquet")
+
+
+def exec_query_with_retry(_db_connection, query, max_retries=5, backoff=0.5):
+    """
+    Execute a query in its own session and retry it with exponential backoff on transient errors (e.g. deadlocks).
+    In contrast to exec_query, errors are raised instead of printed, so callers can act on failures.
+    Queries that use CALL {...} IN TRANSACTIONS may have committed some batches before failing, hence only
+    idempotent (MERGE based) queries should be retried.
+    """
+    query_str = query.query_string.strip()
+    parameters = {"batch_size": _db_connection.batch_size, **(query.kwargs or {})}
+    is_implicit = query_str.lower().startswith(":auto")
+    if is_implicit:
+        query_str = query_str[len(":auto"):]
+
+    attempt = 0
+    while True:
+        try:
+            with _db_connection.driver.get_session(database=query.database or _db_connection.db_name) as session:
+                if is_implicit:
+                    return session.run(query_str, parameters).data()
+                return session.execute_write(lambda tx: tx.run(query_str, parameters).data())
+        except TransientError as e:
+            if attempt >= max_retries:
+                raise
+            wait = backoff * 2 ** attempt
+            print(f"Transient error ({e.code}), retrying in {wait:.1f}s")
+            time.sleep(wait)
+            attempt += 1
@@ -0,0 +1,236 @@
+# Import logging and surpress warnings
+import logging
+from typing import List
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import numpy as np
+import pandas as pd
+
+# Import promg
+from promg import Query
+
+from util.instrumentation import instrumented_step
+from util.result_streaming import query_to_dataframe
+from util.transformer_functions import create_index
+
+# durations are kept in a histogram with logarithmic buckets so the aggregates can be updated without the instance
+# edges: bucket 0 holds durations below one second, bucket k the durations in [2^((k-1)/4), 2^(k/4)) seconds
+NUM_BUCKETS = 128
+BUCKETS_PER_DOUBLING = 4
+# event type or activity of the class of events without one, the sysId of a (:Class) cannot be null
+MISSING_CLASS_VALUE = "(none)"
+CLASS_KEYS = ["fromEventType", "fromActivity", "toEventType", "toActivity"]
+
+
+#######################################################################
+############################## HISTOGRAMS #############################
+#######################################################################
+
+def get_buckets(_durations):
+    durations = np.asarray(_durations, dtype=float)
+    buckets = np.zeros(len(durations), dtype=int)
+    positive = durations >= 1
+    buckets[positive] = 1 + np.floor(BUCKETS_PER_DOUBLING * np.log2(durations[positive])).astype(int)
+    return np.minimum(buckets, NUM_BUCKETS - 1)
+
+
+def get_histogram(_durations):
+    return np.bincount(get_buckets(_durations), minlength=NUM_BUCKETS)
+
+
+def get_bucket_lower_bound(_bucket):
+    return 0.0 if _bucket == 0 else 2 ** ((_bucket - 1) / BUCKETS_PER_DOUBLING)
+
+
+def get_percentile_from_histogram(_histogram, _q):
+    """
+    Approximate percentile: the geometric middle of the bucket that contains it.
+    """
+    histogram = np.asarray(_histogram)
+    if histogram.sum() == 0:
+        return None
+    bucket = int(np.searchsorted(np.cumsum(histogram), _q * histogram.sum()))
+    return 0.0 if bucket == 0 else 2 ** ((bucket - 0.5) / BUCKETS_PER_DOUBLING)
+
+
+#######################################################################
+############################ AGGREGATION ##############################
+#######################################################################
+
+def get_df_durations(_db_connection, _object_type: str, _object_ids: List[str] = None):
+    """
+    Stream the event classes and the duration in seconds of all :DF edges of the object type, or only of the objects
+    with the given sysIds. Events without timestamp have no duration.
+    """
+    object_filter = "UNWIND $objectIds as objectId" if _object_ids is not None else ""
+    object_condition = "{objectType: $objectType, id: objectId}" if _object_ids is not None \
+        else "{objectType: $objectType}"
+
+    q_df_durations_str = '''
+        $object_filter
+        MATCH (e1) - [:DF $object_condition] -> (e2)
+        WITH e1.eventType as fromEventType, e1.activity as fromActivity, coalesce(e1.timestamp, e1.startTime) as t1,
+             e2.eventType as toEventType, e2.activity as toActivity, coalesce(e2.timestamp, e2.startTime) as t2
+        RETURN fromEventType, fromActivity, toEventType, toActivity,
+            (t2.epochSeconds - t1.epochSeconds) + (t2.nanosecond - t1.nanosecond) / 1000000000.0 as duration
+    '''
+
+    q_df_durations = Query(query_str=q_df_durations_str,
+                           parameters={"objectType": _object_type, "objectIds": _object_ids},
+                           template_string_parameters={"object_filter": object_filter,
+                                                       "object_condition": object_condition})
+
+    df_durations = query_to_dataframe(_db_connection, q_df_durations)
+    if df_durations.empty:
+        return pd.DataFrame(columns=["fromEventType", "fromActivity", "toEventType", "toActivity", "duration"])
+    return df_durations
+
+
+def fill_missing_classes(_df):
+    """
+    Replace a missing event type or activity by MISSING_CLASS_VALUE, so these events are counted in a class of their
+    own instead of failing the write of the batch.
+    """
+    _df = _df.copy()
+    for key in CLASS_KEYS:
+        _df[key] = _df[key].astype(object).where(_df[key].notna(), MISSING_CLASS_VALUE)
+    return _df
+
+
+def aggregate_df_durations(_df_durations):
+    """
+    Count, exact min, median and p95 duration and the duration histogram per pair of event classes.
+    """
+    keys = CLASS_KEYS
+    rows = []
+    for key, group in fill_missing_classes(_df_durations).groupby(keys, observed=True, dropna=False):
+        durations = group["duration"].dropna().to_numpy(dtype=float)
+        rows.append({
+            **dict(zip(keys, key)),
+            "count": len(group),
+            "minDuration": float(durations.min()) if len(durations) else None,
+            "medianDuration": float(np.median(durations)) if len(durations) else None,
+            "p95Duration": float(np.percentile(durations, 95)) if len(durations) else None,
+            "histogram": get_histogram(durations).tolist()
+        })
+    return pd.DataFrame(rows, columns=keys + ["count", "minDuration", "medianDuration", "p95Duration", "histogram"])
+
+
+#######################################################################
+############################## DFG LAYER ##############################
+#######################################################################
+
+def write_dfg_edges(_db_connection, _object_type: str, _aggregates: pd.DataFrame):
+    """
+    Write the aggregates as (:Class) - [:DF_C {objectType}] -> (:Class) edges, edges with count 0 are removed.
+    """
+    rows = [{key: (None if isinstance(value, float) and np.isnan(value) else value) for key, value in row.items()}
+            for row in fill_missing_classes(_aggregates).to_dict("records")]
+
+    q_write_dfg_edges_str = '''
+        UNWIND $rows as row
+        MERGE (c1:Class {sysId: row.fromEventType + ":" + row.fromActivity})
+        ON CREATE SET c1.eventType = row.fromEventType, c1.activity = row.fromActivity
+        MERGE (c2:Class {sysId: row.toEventType + ":" + row.toActivity})
+        ON CREATE SET c2.eventType = row.toEventType, c2.activity = row.toActivity
+        MERGE (c1) - [dfc:DF_C {objectType: $objectType}] -> (c2)
+        SET dfc.count = row.count, dfc.minDuration = row.minDuration, dfc.medianDuration = row.medianDuration,
+            dfc.p95Duration = row.p95Duration, dfc.histogram = row.histogram
+        WITH dfc, row
+        WHERE row.count <= 0
+        DELETE dfc
+    '''
+
+    _db_connection.exec_query(Query(query_str=q_write_dfg_edges_str,
+                                    parameters={"objectType": _object_type, "rows": rows}))
+
+
+def build_dfg(_db_connection, _object_type: str):
+    """
+    Aggregate the :DF edges of the object type into a directly-follows graph on (:Class {eventType, activity}) nodes.
+    The durations of all DF edges are streamed in one pass, the existing DF_C edges of the object type are replaced.
+    """
+    create_index(_db_connection, 'Class', _unique=True)
+
+    q_remove_dfg_edges = '''
+        MATCH (:Class) - [dfc:DF_C {objectType: $objectType}] -> (:Class)
+        DELETE dfc
+    '''
+
+    with instrumented_step(_db_connection, "build_dfg", _object_type):
+        _db_connection.exec_query(Query(query_str=q_remove_dfg_edges, parameters={"objectType": _object_type}))
+        aggregates = aggregate_df_durations(get_df_durations(_db_connection, _object_type))
+        write_dfg_edges(_db_connection, _object_type, aggregates)
+    print(f"→ {_object_type} DFG: {len(aggregates)} (:Class) - [:DF_C] -> (:Class) edges for "
+          f"{aggregates['count'].sum()} DF edges")
+
+
+def get_dfg(_db_connection, _object_type: str = None):
+    q_dfg_str = '''
+        MATCH (c1:Class) - [dfc:DF_C] -> (c2:Class)
+        WHERE $objectType IS NULL OR dfc.objectType = $objectType
+        RETURN dfc.objectType as objectType, c1.sysId as fromClass, c2.sysId as toClass, dfc.count as count,
+            dfc.minDuration as minDuration, dfc.medianDuration as medianDuration, dfc.p95Duration as p95Duration
+        ORDER BY objectType, count DESC
+    '''
+
+    return pd.DataFrame(_db_connection.exec_query(Query(query_str=q_dfg_str,
+                                                        parameters={"objectType": _object_type})),
+                        columns=["objectType", "fromClass", "toClass", "count", "minDuration", "medianDuration",
+                                 "p95Duration"])
+
+
+def update_dfg(_db_connection, _object_type: str, _object_ids: List[str], _sign: int):
+    """
+    Add (_sign=1) or subtract (_sign=-1) the current :DF edges of the given objects to the DF_C edges of the object
+    type. To update the DFG when the DF edges of objects change, subtract the objects before and add them after the
+    change. The counts stay exact, the median and p95 are estimated from the histogram (within a bucket, ~19%) and the
+    min is exact unless the edge with the minimum duration was removed.
+    """
+    if not _object_ids:
+        return
+
+    changes = aggregate_df_durations(get_df_durations(_db_connection, _object_type, _object_ids))
+    if changes.empty:
+        return
+
+    q_current_str = '''
+        UNWIND $rows as row
+        MATCH (:Class {sysId: row.fromEventType + ":" + row.fromActivity})
+            - [dfc:DF_C {objectType: $objectType}] -> (:Class {sysId: row.toEventType + ":" + row.toActivity})
+        RETURN row.fromEventType as fromEventType, row.fromActivity as fromActivity, row.toEventType as toEventType,
+            row.toActivity as toActivity, dfc.count as count, dfc.minDuration as minDuration,
+            dfc.histogram as histogram
+    '''
+
+    keys = CLASS_KEYS
+    current = _db_connection.exec_query(Query(query_str=q_current_str,
+                                              parameters={"objectType": _object_type,
+                                                          "rows": changes[keys].to_dict("records")})) or []
+    current = {tuple(record[key] for key in keys): record for record in current}
+
+    rows = []
+    for change in changes.to_dict("records"):
+        existing = current.get(tuple(change[key] for key in keys),
+                               {"count": 0, "minDuration": None, "histogram": [0] * NUM_BUCKETS})
+        count = existing["count"] + _sign * change["count"]
+        histogram = np.maximum(np.asarray(existing["histogram"]) + _sign * np.asarray(change["histogram"]), 0)
+
+        minimum = existing["minDuration"]
+        if _sign > 0 and pd.notna(change["minDuration"]):
+            minimum = change["minDuration"] if minimum is None else min(minimum, change["minDuration"])
+        elif _sign < 0 and minimum is not None and pd.notna(change["minDuration"]) \
+                and change["minDuration"] <= minimum:
+            nonempty = np.flatnonzero(histogram)
+            minimum = max(minimum, get_bucket_lower_bound(nonempty[0])) if len(nonempty) else None
+
+        rows.append({**{key: change[key] for key in keys},
+                     "count": count,
+                     "minDuration": minimum,
+                     "medianDuration": get_percentile_from_histogram(histogram, 0.5),
+                     "p95Duration": get_percentile_from_histogram(histogram, 0.95),
+                     "histogram": histogram.tolist()})
+
+    write_dfg_edges(_db_connection, _object_type, pd.DataFrame(rows))
@@ -1,13 +1,22 @@
 # Import logging and surpress warnings
 import logging
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 
 from util.assign_types_functions import add_object_type_node
+from util.db_helper_functions import exec_query_with_retry
+from util.index_manager import get_index_manager
+from util.instrumentation import instrumented_step
 from util.transformer_functions import create_index, create_event_timestamp_index
+from util.variants import get_event_log, compute_length_statistics, compute_set_variants, \
+    compute_sequence_variants, compute_bag_variants
 
 logging.getLogger("neo4j").setLevel(logging.ERROR)
 logging.getLogger("pd").setLevel(logging.ERROR)
 
+import numpy as np
 import pandas as pd
 
 # Import promg
@@ -19,7 +28,13 @@ from promg import Query
 ##################### MATERIALIZE OBJECTS #############################
 #######################################################################
 
-def materialize_object(_db_connection, _label, _config):
+def materialize_object(_db_connection, _label, _config, _record_label=None):
+    """
+    Create a _label node per related (from, to) pair of the config.
+    With _record_label, only the pairs of which the from object is extracted from a record with this label are
+    materialized, e.g. the :DeltaRecord nodes of an incremental update; the relationships built from a record connect
+    objects that are both extracted from it.
+    """
     from_object = _config["from_object"]
     to_object = _config["to_object"]
     set_attributes = []
@@ -32,16 +47,18 @@ def materialize_object(_db_connection, _label, _config):
 
     materialize_relationship_query = '''
         :auto
-        MATCH (from) - [ :IS_OF_TYPE] -> (:ObjectType {objectType: $from_object})
-        MATCH (to) - [ :IS_OF_TYPE] -> (:ObjectType {objectType: $to_object})
+        $record_match
+        MATCH (from:$from_label)
+        MATCH (to:$to_label)
         MATCH (from) - [r WHERE type(r) = $relation_type] -> (to)
         CALL (from, r, to) {
             MERGE (new:$materialized_object {sysId: from.sysId + '_' + to.sysId})
             MERGE (from) <- [:RELATED] - (new) - [:RELATED] -> (to)
             SET new[$from_object] = from.sysId,
-                new[$to_object] = to.sysId
+                new[$to_object] = to.sysId,
+                new.objectType = $materializedObject
             $set_attributes
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
         RETURN count(r) as count
     '''
 
@@ -50,11 +67,16 @@ def materialize_object(_db_connection, _label, _config):
         parameters={
             "from_object": from_object["label"],
             "to_object": to_object["label"],
-            "relation_type": _config["relation_type"]
+            "relation_type": _config["relation_type"],
+            "materializedObject": _label
         },
         template_string_parameters={
+            "from_label": from_object["label"],
+            "to_label": to_object["label"],
             "materialized_object": _label,
-            "set_attributes": "SET " + ", ".join(set_attributes)
+            "set_attributes": "SET " + ", ".join(set_attributes) if set_attributes else "",
+            "record_match": f"MATCH (:{_record_label}) <- [:EXTRACTED_FROM] - (from)\nWITH DISTINCT from"
+            if _record_label is not None else ""
         }
     )
 
@@ -62,30 +84,121 @@ def materialize_object(_db_connection, _label, _config):
     print(f"→ {result[0]['count']} {_label} nodes created.")
 
 
-def materialize_objects(_db_connection, _objects_to_materialize):
+def get_materialize_pairs(_db_connection, _label, _config):
+    """
+    Phase 1 of materialize_object_bulk: the distinct (from, to) pairs with the attributes to copy, using typed label
+    and relationship patterns. Pairs of which the materialized object already exists are skipped using the
+    uniqueness constraint on :_label(sysId).
+    """
+    from_object = _config["from_object"]
+    to_object = _config["to_object"]
+
+    pairs_query_str = '''
+        MATCH (from:$from_object) - [:$relation_type] -> (to:$to_object)
+        WITH DISTINCT from, to, from.sysId + '_' + to.sysId as sysId
+        WHERE NOT EXISTS { MATCH (:$materialized_object {sysId: sysId}) }
+        RETURN sysId, elementId(from) as fromElementId, elementId(to) as toElementId,
+            from.sysId as fromId, to.sysId as toId, {$attributes} as attributes
+    '''
+
+    # a map literal keeps the last value of a duplicate key, so the values of a key are combined as in
+    # materialize_object: the first non-null value is kept and the sysId of the new node is not overwritten
+    values = {}
+    for object_type, _object in {"from": from_object, "to": to_object}.items():
+        for key, attr in _object.get("attributes", {}).items():
+            values.setdefault(key, []).append(f"{object_type}.{attr}")
+    values.pop("sysId", None)
+    attributes = [f"{key}: {_values[0]}" if len(_values) == 1 else f"{key}: COALESCE({', '.join(_values)})"
+                  for key, _values in values.items()]
+
+    pairs_query = Query(
+        query_str=pairs_query_str,
+        template_string_parameters={
+            "from_object": from_object["label"],
+            "to_object": to_object["label"],
+            "relation_type": _config["relation_type"],
+            "materialized_object": _label,
+            "attributes": ", ".join(attributes)
+        }
+    )
+
+    return _db_connection.exec_query(pairs_query) or []
+
+
+def materialize_object_bulk(_db_connection, _label, _config):
+    """
+    Create the same nodes and RELATED relationships as materialize_object in two phases: the new pairs are read once
+    and the nodes are created in UNWIND batches of batch_size rows, instead of a MERGE per related pair.
+    Requires the uniqueness constraint on :_label(sysId), which materialize_objects creates.
+    """
+    create_query_str = '''
+        UNWIND $rows AS row
+        MATCH (from) WHERE elementId(from) = row.fromElementId
+        MATCH (to) WHERE elementId(to) = row.toElementId
+        CREATE (new:$materialized_object {sysId: row.sysId})
+        SET new += row.attributes,
+            new[$from_object] = row.fromId,
+            new[$to_object] = row.toId,
+            new.objectType = $materializedObject
+        CREATE (from) <- [:RELATED] - (new) - [:RELATED] -> (to)
+        RETURN count(new) as count
+    '''
+
+    pairs = get_materialize_pairs(_db_connection=_db_connection, _label=_label, _config=_config)
+
+    count = 0
+    batch_size = _db_connection.batch_size
+    for start in range(0, len(pairs), batch_size):
+        create_query = Query(
+            query_str=create_query_str,
+            parameters={
+                "from_object": _config["from_object"]["label"],
+                "to_object": _config["to_object"]["label"],
+                "materializedObject": _label,
+                "rows": pairs[start:start + batch_size]
+            },
+            template_string_parameters={
+                "materialized_object": _label
+            }
+        )
+        result = _db_connection.exec_query(create_query)
+        if result:
+            count += result[0]["count"]
+
+    print(f"→ {count} {_label} nodes created.")
+
+
+def materialize_objects(_db_connection, _objects_to_materialize, bulk=False, type_edges=True):
     """
     Create entities. Includes indexing.
+    When bulk is set, the objects are created using materialize_object_bulk.
+    The objectType property is set on creation, type_edges is passed to add_object_type_node.
     """
 
     print("\n=== Materializing Relationships into Objects ===")
     for _label, _configs in _objects_to_materialize.items():
-        for _config in _configs:
+        for _index, _config in enumerate(_configs):
             try:
                 create_index(_db_connection=_db_connection,
-                             _label=_label)
+                             _label=_label,
+                             _unique=True)
+                get_index_manager(_db_connection).await_indexes()
             except Exception as e:
                 print(f"Failed to create index for {_label}: {e}")
                 return
 
             try:
-                materialize_object(
-                    _db_connection=_db_connection,
-                    _label=_label,
-                    _config=_config)
+                _materialize_object = materialize_object_bulk if bulk else materialize_object
+                with instrumented_step(_db_connection, "materialize_object", _label, _config, _index):
+                    _materialize_object(
+                        _db_connection=_db_connection,
+                        _label=_label,
+                        _config=_config)
 
                 add_object_type_node(
                     _db_connection=_db_connection,
-                    _object_type=_label
+                    _object_type=_label,
+                    _type_edges=type_edges
                 )
 
             except Exception as e:
@@ -97,40 +210,139 @@ def materialize_objects(_db_connection, _objects_to_materialize):
 ########### Infer E2O and O2O relationships in simple cases ###########
 #######################################################################
 
-def extend_relationship(_db_connection, _type, _config):
+def get_relation_conditions(_config):
+    """
+    The relationships of the from and to object as (object, relation type, related object, related label).
+    """
+    relation_conditions = []
+    for _object_type in ["from", "to"]:
+        for relationship in _config[f"{_object_type}_object"].get("relationships", []):
+            relation_conditions.append((_object_type, relationship["relation_type"], relationship["related_object"],
+                                        relationship["related_label"]))
+    return relation_conditions
+
+
+def get_extend_relationship_naive_match(_config):
+    match_clauses = [f"MATCH (from:{_config['from_object']['label']})",
+                     f"MATCH (to:{_config['to_object']['label']})"]
+    for _object_type, rel_type, related_object, related_label in get_relation_conditions(_config):
+        match_clauses.append(f"MATCH ({_object_type}) - [:{rel_type}] - ({related_object}:{related_label})")
+    return "\n".join(match_clauses)
+
+
+def get_extend_relationship_planned_match(_config):
+    """
+    Join the from and to side on the related objects they share (e.g. sc and ci), so that both sides are expanded from
+    the shared objects and combined using a hash join instead of a cartesian product of from and to.
+    Returns None when there are no shared related objects, or when relationship uniqueness within one MATCH could
+    exclude matches of the separate MATCH clauses of the naive query.
+    """
+    relation_conditions = get_relation_conditions(_config)
+    related_objects = {_object_type: {related_object for _type, _, related_object, _ in relation_conditions
+                                      if _type == _object_type} for _object_type in ["from", "to"]}
+    shared_objects = sorted(related_objects["from"] & related_objects["to"])
+    if not shared_objects:
+        return None
+
+    from_labels = set(_config["from_object"]["label"].split("|"))
+    to_labels = set(_config["to_object"]["label"].split("|"))
+    for index, (_type, rel_type, _, related_label) in enumerate(relation_conditions):
+        for other_type, other_rel_type, _, other_related_label in relation_conditions[index + 1:]:
+            if (rel_type, related_label) == (other_rel_type, other_related_label) and \
+                    (_type == other_type or from_labels & to_labels):
+                return None
+
+    patterns = []
+    for _object_type in ["from", "to"]:
+        label = _config[f"{_object_type}_object"]["label"]
+        side_conditions = [condition for condition in relation_conditions if condition[0] == _object_type]
+        for index, (_, rel_type, related_object, related_label) in enumerate(side_conditions):
+            object_pattern = f"({_object_type}:{label})" if index == 0 else f"({_object_type})"
+            patterns.append(f"{object_pattern} - [:{rel_type}] - ({related_object}:{related_label})")
+
+    return f"MATCH {', '.join(patterns)}\nUSING JOIN ON {', '.join(shared_objects)}"
+
+
+def get_extend_relationship_record_match(_config, _record_label):
+    """
+    The naive match anchored on each object of the pattern in turn, so that only the pairs of which at least one of
+    the objects is extracted from a record with _record_label are matched, starting from these records.
+    """
+    naive_match = get_extend_relationship_naive_match(_config)
+    anchors = ["from", "to"] + sorted({related_object for _, _, related_object, _ in get_relation_conditions(_config)})
+    subqueries = [f"MATCH (:{_record_label}) <- [:EXTRACTED_FROM] - ({anchor})\n{naive_match}\nRETURN from, to"
+                  for anchor in anchors]
+    return "CALL () {\n" + "\nUNION\n".join(subqueries) + "\n}"
+
+
+def get_extend_relationship_pairs(_db_connection, _match_clauses):
+    pairs_query_str = '''
+        $match_clauses
+        RETURN DISTINCT elementId(from) as from, elementId(to) as to
+    '''
+
+    query = Query(query_str=pairs_query_str, template_string_parameters={"match_clauses": _match_clauses})
+    return {(record["from"], record["to"]) for record in _db_connection.exec_query(query)}
+
+
+def compare_extend_relationship_plans(_db_connection, _type, _config):
+    """
+    Check that the planned join returns the same (from, to) pairs as the naive query, without writing.
+    """
+    planned_match = get_extend_relationship_planned_match(_config)
+    if planned_match is None:
+        print(f"→ [:{_type}] No shared related objects, the naive query is used")
+        return
+
+    start = time.perf_counter()
+    naive_pairs = get_extend_relationship_pairs(_db_connection, get_extend_relationship_naive_match(_config))
+    naive_time = time.perf_counter() - start
+    start = time.perf_counter()
+    planned_pairs = get_extend_relationship_pairs(_db_connection, planned_match)
+    planned_time = time.perf_counter() - start
+
+    print(f"→ [:{_type}] naive: {len(naive_pairs)} pairs in {naive_time:.2f}s, "
+          f"planned: {len(planned_pairs)} pairs in {planned_time:.2f}s")
+    if naive_pairs != planned_pairs:
+        raise ValueError(f"Planned join for [:{_type}] differs from the naive query: "
+                         f"{len(naive_pairs - planned_pairs)} pairs missing, "
+                         f"{len(planned_pairs - naive_pairs)} pairs extra")
+
+
+def extend_relationship(_db_connection, _type, _config, _compare=False, _record_label=None):
+    """
+    Create [:_type] between from and to objects that are related to the same objects according to the config.
+    When _compare is set, the planned join is first checked against the naive query.
+    With _record_label, only the pairs of which one of the objects is extracted from a record with this label are
+    related, e.g. the :DeltaRecord nodes of an incremental update.
+    """
     from_object = _config["from_object"]
     to_object = _config["to_object"]
 
+    if _compare:
+        compare_extend_relationship_plans(_db_connection, _type, _config)
+
     query_str = '''
         :auto
-        MATCH (from:$from_object)
-        MATCH (to:$to_object)
-        $relation_conditions
+        $match_clauses
         WITH distinct from, to
         CALL (from, to) {
             MERGE (from) - [r:$type] -> (to)
             RETURN r
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
         RETURN count(r) as count
     '''
 
-    relation_conditions = []
-    for _object_type, _object in {"from": from_object, "to": to_object}.items():
-        if "relationships" in _object:
-            for relationship in _object['relationships']:
-                rel_type = relationship["relation_type"]
-                related_object = relationship["related_object"]
-                related_label = relationship["related_label"]
-                relation_conditions.append(
-                    f"MATCH ({_object_type}) - [:{rel_type}] - ({related_object}:{related_label})")
+    if _record_label is not None:
+        match_clauses = get_extend_relationship_record_match(_config, _record_label)
+    else:
+        match_clauses = get_extend_relationship_planned_match(_config) or get_extend_relationship_naive_match(_config)
 
     query = Query(
         query_str=query_str,
         template_string_parameters={
-            "from_object": from_object["label"],
-            "to_object": to_object["label"],
             "type": _type,
-            "relation_conditions": "\n".join(relation_conditions)
+            "match_clauses": match_clauses
         }
     )
 
@@ -138,11 +350,12 @@ def extend_relationship(_db_connection, _type, _config):
     print(f'→ {res[0]["count"]} (:{from_object["label"]}) - [:{_type}] -> (:{to_object["label"]}) Relationship built')
 
 
-def extend_relationships(_db_connection, _relationships):
+def extend_relationships(_db_connection, _relationships, compare=False):
     for _type, _configs in _relationships.items():
-        for _config in _configs:
+        for _index, _config in enumerate(_configs):
             try:
-                extend_relationship(_db_connection, _type, _config)
+                with instrumented_step(_db_connection, "extend_relationship", _type, _config, _index):
+                    extend_relationship(_db_connection, _type, _config, _compare=compare)
             except Exception as e:
                 print(f"Failed for {_type}: {e}")
 
@@ -152,115 +365,382 @@ def extend_relationships(_db_connection, _relationships):
 ######### Infer DF EDGES for objects of specific object type ##########
 #######################################################################
 
-def build_df_edges(_db_connection, _object_type: str, _event_types: List[str], _timestamp_fields: List[str] = None):
+def create_df_indexes(_db_connection, _timestamp_fields: List[str] = None):
     """
-    Build :DF:* edges for all events related to objects of type :_object_type.
-    Creates separate DF edges for each object type and incident event type.
+    Ensure the indexes on the timestamps, on :DF(id) and :DF(objectType), the latter are used to find the events
+    without incoming or outgoing DF edge of an object, and on the :SEQ edges of the sequence index. Waits until the
+    indexes are online.
     """
-
-    if _timestamp_fields is None:
-        _timestamp_fields = ['timestamp']
-
-    for timestamp_field in _timestamp_fields:
+    index_manager = get_index_manager(_db_connection)
+    index_manager.ensure_relationship_index('DF', 'id')
+    index_manager.ensure_relationship_index('DF', 'objectType')
+    # seek the k next events or the events in a time range of an object in the sequence index
+    index_manager.ensure_relationship_index('SEQ', ('id', 'sequence', 'position'))
+    index_manager.ensure_relationship_index('SEQ', ('id', 'sequence', 'timestamp'))
+
+    # events are filtered on their type using the eventType property instead of IS_OF_TYPE relationships
+    index_manager.ensure_node_index('Event', 'eventType')
+    index_manager.ensure_node_index('HighLevelEvent', 'eventType')
+
+    for timestamp_field in _timestamp_fields or []:
         create_event_timestamp_index(_db_connection,
                                      _label='Event',
                                      _timestamp_field=timestamp_field)
 
-
         create_event_timestamp_index(_db_connection,
                                      _label='HighLevelEvent',
                                      _timestamp_field=timestamp_field)
 
+    index_manager.await_indexes()
+
 
-    get_all_events_per_timestamp_field_attribute = "\n UNION ALL \n".join([
+def get_all_events_per_timestamp_field_subquery(_timestamp_fields: List[str]):
+    return "\n UNION ALL \n".join([
         f'''
-                MATCH (e:Event|HighLevelEvent) -- (o)
-                MATCH (e) - [:IS_OF_TYPE] -> (et:EventType)
-                WHERE et.eventType in $eventTypes AND e.{timestamp_field} IS NOT NULL
+                MATCH (e:Event|HighLevelEvent) - [:CORR] -> (o)
+                WHERE e.eventType in $eventTypes AND e.{timestamp_field} IS NOT NULL
                 RETURN e, e.{timestamp_field} as timestamp
             ''' for timestamp_field in _timestamp_fields
     ])
 
+
+def get_sequence_name(_object_type: str, _timestamp_fields: List[str] = None):
+    """
+    Name of the sequence of the events of an object type ordered on the timestamp fields, e.g. Incident or
+    CI_SC:startTime,endTime for the high-level events.
+    """
+    if _timestamp_fields is None or _timestamp_fields == ['timestamp']:
+        return _object_type
+    return f"{_object_type}:{','.join(_timestamp_fields)}"
+
+
+# (event) - [:SEQ {sequence, id, position, timestamp}] -> (object) for every position in the ordered events of an object
+sequence_index_subquery = '''
+            CALL (o, events, timestamps) {
+                UNWIND range(0, size(events) - 1) AS position
+                WITH o, events[position] as event, timestamps[position] as timestamp, position
+                MERGE (event) - [seq:SEQ {sequence: $sequence, id: o.sysId, position: position}] -> (o)
+                SET seq.timestamp = timestamp
+            }
+'''
+
+
+def get_discover_df_query(_object_type: str, _event_types: List[str], _timestamp_fields: List[str],
+                          _sequence_index=False, _object_ids: List[str] = None):
+    """
+    The query that builds the DF (and SEQ) edges of all objects of type :_object_type, or only of the objects with the
+    given sysIds.
+    """
+    object_filter = "WHERE o.sysId IN $objectIds" if _object_ids is not None else ""
     discover_df_query_str = '''
         :auto
-        MATCH (o) - [:IS_OF_TYPE] -> (ot:ObjectType {objectType: $objectType})
-        WITH o, ot.objectType as oType
+        MATCH (o:$object_label)
+        $object_filter
+        WITH o, $objectType as oType
         CALL (o) {
             $get_all_events_per_timestamp_field_attribute
         }
-        WITH o, oType, e ORDER BY timestamp, elementId(e)
-        WITH o.sysId as sysId, oType, collect(e) as events
-        UNWIND range(0, size(events) - 2) AS index
-        WITH events[index] as fromEvent, events[index+1] as toEvent, sysId, oType
-        WHERE fromEvent <> toEvent
-        WITH fromEvent, toEvent, sysId, oType
-        CALL (fromEvent, toEvent, sysId, oType) {
-            MERGE (fromEvent) -[rel:DF {objectType:oType, id:sysId}]->(toEvent)
+        WITH o, oType, e, timestamp ORDER BY timestamp, elementId(e)
+        WITH o, oType, collect(e) as events, collect(timestamp) as timestamps
+        CALL (o, oType, events, timestamps) {
+            $sequence_index_subquery
+            UNWIND range(0, size(events) - 2) AS index
+            WITH o, oType, events[index] as fromEvent, events[index+1] as toEvent
+            WHERE fromEvent <> toEvent
+            MERGE (fromEvent) -[rel:DF {objectType:oType, id:o.sysId}]->(toEvent)
             RETURN count(rel) as count
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
         RETURN sum(count) as count
        '''
 
-    discover_df = Query(query_str=discover_df_query_str,
-                        parameters={
-                            'objectType': _object_type,
-                            'eventTypes': _event_types
-                        },
-                        template_string_parameters={
-                            'get_all_events_per_timestamp_field_attribute': get_all_events_per_timestamp_field_attribute
-                        })
+    return Query(query_str=discover_df_query_str,
+                 parameters={
+                     'objectType': _object_type,
+                     'eventTypes': _event_types,
+                     'sequence': get_sequence_name(_object_type, _timestamp_fields),
+                     'objectIds': _object_ids
+                 },
+                 template_string_parameters={
+                     'object_label': _object_type,
+                     'object_filter': object_filter,
+                     'get_all_events_per_timestamp_field_attribute':
+                         get_all_events_per_timestamp_field_subquery(_timestamp_fields),
+                     'sequence_index_subquery': sequence_index_subquery if _sequence_index else ""
+                 })
+
+
+def build_df_edges(_db_connection, _object_type: str, _event_types: List[str], _timestamp_fields: List[str] = None,
+                   _sequence_index=False):
+    """
+    Build :DF:* edges for all events related to objects of type :_object_type.
+    Creates separate DF edges for each object type and incident event type.
+    With _sequence_index, the position of every event in the sequence of the object is also stored on a :SEQ edge in
+    the same pass, see util/sequences.py. Otherwise the sequence index is built with build_sequence_index.
+    """
+
+    if _timestamp_fields is None:
+        _timestamp_fields = ['timestamp']
+
+    create_df_indexes(_db_connection, _timestamp_fields)
+    discover_df = get_discover_df_query(_object_type, _event_types, _timestamp_fields, _sequence_index)
 
-    res = _db_connection.exec_query(discover_df)
+    with instrumented_step(_db_connection, "build_df_edges", _object_type, {"event_types": _event_types,
+                                                                            "timestamp_fields": _timestamp_fields}):
+        res = _db_connection.exec_query(discover_df)
     print(f"→ {_object_type} DF creation result: {res[0]['count']}")
 
 
+def get_object_partitions(_db_connection, _object_type: str, _partitions: int):
+    """
+    Split the sysIds of the objects of type :_object_type into _partitions partitions on the CRC32 hash of the sysId.
+    The hash does not depend on the Python process, so an object is always assigned to the same partition.
+    """
+    result = _db_connection.exec_query(Query(query_str='''
+            MATCH (o:$object_label)
+            RETURN collect(o.sysId) as objectIds
+        ''', template_string_parameters={'object_label': _object_type}))
+
+    partitions = [[] for _ in range(_partitions)]
+    for object_id in result[0]["objectIds"] if result else []:
+        partitions[zlib.crc32(str(object_id).encode()) % _partitions].append(object_id)
+    return partitions
+
+
+def build_df_edges_partitioned(_db_connection, _object_type: str, _event_types: List[str],
+                               _timestamp_fields: List[str] = None, _partitions=4, _sequence_index=False,
+                               _max_retries=5):
+    """
+    Build the same :DF:* (and :SEQ) edges as build_df_edges, but split the objects of type :_object_type into
+    _partitions hash partitions that are processed concurrently, each in its own session, so that large object types
+    such as CI_SC and Incident use all cores of the database.
+    The DF edges of an object only depend on its own events, hence the partitions commit independently. Objects of
+    different partitions can share events, so deadlocks on these events are retried per partition with exponential
+    backoff; the MERGE makes a retried partition idempotent.
+    """
+
+    if _timestamp_fields is None:
+        _timestamp_fields = ['timestamp']
+
+    create_df_indexes(_db_connection, _timestamp_fields)
+
+    with instrumented_step(_db_connection, "build_df_edges", _object_type, {"event_types": _event_types,
+                                                                            "timestamp_fields": _timestamp_fields,
+                                                                            "partitions": _partitions}):
+        partitions = get_object_partitions(_db_connection, _object_type, _partitions)
+
+        def build_partition(_object_ids):
+            start = time.time()
+            discover_df = get_discover_df_query(_object_type, _event_types, _timestamp_fields, _sequence_index,
+                                                _object_ids)
+            res = exec_query_with_retry(_db_connection, discover_df, _max_retries)
+            return res[0]['count'], time.time() - start
+
+        count = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=_partitions) as executor:
+            futures = {executor.submit(build_partition, object_ids): index
+                       for index, object_ids in enumerate(partitions) if object_ids}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    partition_count, seconds = future.result()
+                    count += partition_count
+                    print(f"→ {_object_type} partition {index + 1}/{_partitions}: {partition_count} DF edges for "
+                          f"{len(partitions[index])} objects in {seconds:.1f}s")
+                except Exception as e:
+                    failed.append(index + 1)
+                    print(f"Failed for {_object_type} partition {index + 1}/{_partitions}: {e}")
+
+        if failed:
+            raise RuntimeError(f"DF creation failed for {_object_type} partitions {failed}, rerun to complete them")
+    print(f"→ {_object_type} DF creation result: {count}")
+
+
+def build_sequence_index(_db_connection, _object_type: str, _event_types: List[str],
+                         _timestamp_fields: List[str] = None, _object_ids: List[str] = None):
+    """
+    (Re)build the :SEQ edges of all objects of type :_object_type, or only of the objects with the given sysIds, e.g.
+    after their DF chains were patched. Uses the same order as build_df_edges.
+    """
+    if _timestamp_fields is None:
+        _timestamp_fields = ['timestamp']
+
+    create_df_indexes(_db_connection, _timestamp_fields)
+
+    object_filter = "WHERE o.sysId IN $objectIds" if _object_ids is not None else ""
+    build_sequence_index_query_str = '''
+        :auto
+        MATCH (o:$object_label)
+        $object_filter
+        CALL (o) {
+            $get_all_events_per_timestamp_field_attribute
+        }
+        WITH o, e, timestamp ORDER BY timestamp, elementId(e)
+        WITH o, collect(e) as events, collect(timestamp) as timestamps
+        CALL (o, events, timestamps) {
+            OPTIONAL MATCH () - [old:SEQ {sequence: $sequence, id: o.sysId}] -> (o)
+            DELETE old
+            WITH DISTINCT o, events, timestamps
+            $sequence_index_subquery
+            RETURN size(events) as count
+        } IN TRANSACTIONS OF $batch_size ROWS
+        RETURN sum(count) as count
+    '''
+
+    build_sequence = Query(query_str=build_sequence_index_query_str,
+                           parameters={
+                               'objectType': _object_type,
+                               'eventTypes': _event_types,
+                               'objectIds': _object_ids,
+                               'sequence': get_sequence_name(_object_type, _timestamp_fields)
+                           },
+                           template_string_parameters={
+                               'object_label': _object_type,
+                               'object_filter': object_filter,
+                               'get_all_events_per_timestamp_field_attribute':
+                                   get_all_events_per_timestamp_field_subquery(_timestamp_fields),
+                               'sequence_index_subquery': sequence_index_subquery
+                           })
+
+    with instrumented_step(_db_connection, "build_sequence_index", _object_type,
+                           {"event_types": _event_types, "timestamp_fields": _timestamp_fields}):
+        res = _db_connection.exec_query(build_sequence)
+    print(f"→ {_object_type} sequence index: {res[0]['count']} positions")
+
+
+def get_object_event_timestamps(_db_connection, _object_type: str, _event_types: List[str],
+                                _timestamp_fields: List[str]):
+    """
+    Stream the (objectId, eventId, timestamp) triples of all objects of type :_object_type out of the database.
+    Timestamps are returned as epoch seconds and nanoseconds so they can be sorted without conversion.
+    """
+    q_object_event_timestamps_str = '''
+        MATCH (o:$object_label)
+        CALL (o) {
+            $get_all_events_per_timestamp_field_attribute
+        }
+        RETURN o.sysId as objectId, elementId(e) as eventId,
+            timestamp.epochSeconds as seconds, timestamp.nanosecond as nanoseconds
+    '''
+
+    q_object_event_timestamps = Query(
+        query_str=q_object_event_timestamps_str,
+        parameters={
+            'objectType': _object_type,
+            'eventTypes': _event_types
+        },
+        template_string_parameters={
+            'object_label': _object_type,
+            'get_all_events_per_timestamp_field_attribute': get_all_events_per_timestamp_field_subquery(
+                _timestamp_fields)
+        })
+
+    return pd.DataFrame(_db_connection.exec_query(q_object_event_timestamps),
+                        columns=['objectId', 'eventId', 'seconds', 'nanoseconds'])
+
+
+def discover_df_pairs(_object_event_timestamps: pd.DataFrame):
+    """
+    Determine the consecutive (fromEvent, toEvent) pairs per object by sorting all triples at once on (objectId,
+    timestamp, eventId) and shifting the sorted arrays by one.
+    """
+    object_codes, _ = pd.factorize(_object_event_timestamps['objectId'])
+    # sort=True makes the codes follow the same ordering as elementId(e) in ORDER BY timestamp, elementId(e)
+    event_codes, event_ids = pd.factorize(_object_event_timestamps['eventId'], sort=True)
+    seconds = _object_event_timestamps['seconds'].to_numpy(dtype=np.int64)
+    nanoseconds = _object_event_timestamps['nanoseconds'].to_numpy(dtype=np.int64)
+
+    order = np.lexsort((event_codes, nanoseconds, seconds, object_codes))
+    object_codes = object_codes[order]
+    event_codes = event_codes[order]
+
+    same_object = object_codes[1:] == object_codes[:-1]
+    from_events = event_codes[:-1][same_object]
+    to_events = event_codes[1:][same_object]
+    object_idx = order[1:][same_object]
+
+    different_events = from_events != to_events
+    df_pairs = pd.DataFrame({
+        'objectId': _object_event_timestamps['objectId'].to_numpy()[object_idx[different_events]],
+        'fromEvent': np.asarray(event_ids)[from_events[different_events]],
+        'toEvent': np.asarray(event_ids)[to_events[different_events]]
+    })
+    # the same pair can occur more than once when events are ordered on multiple timestamp fields
+    return df_pairs.drop_duplicates(ignore_index=True)
+
+
+def build_df_edges_vectorized(_db_connection, _object_type: str, _event_types: List[str],
+                              _timestamp_fields: List[str] = None, _sequence_index=False):
+    """
+    Build :DF:* edges for all events related to objects of type :_object_type, equal to build_df_edges.
+    The events are ordered client-side and the edges are created in batches using CREATE, hence this method assumes
+    that no :DF edges exist yet for objects of type :_object_type.
+    With _sequence_index, the sequence index is built afterwards with build_sequence_index.
+    """
+
+    if _timestamp_fields is None:
+        _timestamp_fields = ['timestamp']
+
+    create_df_indexes(_db_connection, _timestamp_fields)
+
+    object_event_timestamps = get_object_event_timestamps(_db_connection=_db_connection,
+                                                          _object_type=_object_type,
+                                                          _event_types=_event_types,
+                                                          _timestamp_fields=_timestamp_fields)
+    df_pairs = discover_df_pairs(object_event_timestamps)
+
+    create_df_query_str = '''
+        UNWIND $rows AS row
+        MATCH (fromEvent) WHERE elementId(fromEvent) = row.fromEvent
+        MATCH (toEvent) WHERE elementId(toEvent) = row.toEvent
+        CREATE (fromEvent) - [rel:DF {objectType: $objectType, id: row.objectId}] -> (toEvent)
+        RETURN count(rel) as count
+    '''
+
+    count = 0
+    batch_size = _db_connection.batch_size
+    with instrumented_step(_db_connection, "build_df_edges_vectorized", _object_type,
+                           {"event_types": _event_types, "timestamp_fields": _timestamp_fields}):
+        for start in range(0, len(df_pairs), batch_size):
+            create_df = Query(query_str=create_df_query_str,
+                              parameters={
+                                  'objectType': _object_type,
+                                  'rows': df_pairs.iloc[start:start + batch_size].to_dict('records')
+                              })
+            res = _db_connection.exec_query(create_df)
+            count += res[0]['count']
+
+    print(f"→ {_object_type} DF creation result: {count}")
+    if _sequence_index:
+        build_sequence_index(_db_connection, _object_type, _event_types, _timestamp_fields)
+
+
 #######################################################################
 ##################### STANDARD PM TECHNIQUES ##########################
 #######################################################################
 #######################################################################
 
 def get_variant_length_statistics(_db_connection, _object_type: str, _event_types: List[str]):
-    q_variants_str = '''
-        MATCH (:ObjectType {objectType: $objectType}) <- [:IS_OF_TYPE] - (o)
-        MATCH (o) -- (e:Event|HighLevelEvent) - [:IS_OF_TYPE] -> (et:EventType)
-        WHERE et.eventType IN $eventTypes
-        WITH o.sysId as objectId, count(e) as number_of_events
-        RETURN min(number_of_events) AS min_length, max(number_of_events) AS max_length, 
-        avg(number_of_events) AS avg_length, stDev(number_of_events) AS stDev_length
-    '''
+    event_log = get_event_log(_db_connection, _object_type, _event_types)
+    return compute_length_statistics(event_log)
 
-    q_variants = Query(query_str=q_variants_str,
-                       parameters={
-                           'objectType': _object_type,
-                           'eventTypes': _event_types
-                       })
 
-    _result = pd.DataFrame(_db_connection.exec_query(q_variants))
-    return _result
+def get_activity_set_variants(_db_connection, _object_type, _event_types):
+    # get the set variants on the high_level
+    event_log = get_event_log(_db_connection, _object_type, _event_types)
+    return compute_set_variants(event_log)
 
 
-def get_activity_set_variants(_db_connection, _object_type, _event_types):
-    # get the bag variants on the high_level
-    q_set_activity_variants_str = '''
-        MATCH (:ObjectType {objectType: $objectType}) <- [:IS_OF_TYPE] - (o) -- (e:Event|HighLevelEvent) - [
-        :IS_OF_TYPE] -> (et:EventType)
-        WHERE et.eventType IN $eventTypes
-        WITH o, e.activity AS activity ORDER BY activity
-        WITH o, collect(distinct activity) as set_variant
-        RETURN ltrim(reduce(initial = "", activity in set_variant | initial + " - (" + activity + ")" ), " - " ) as 
-        set_variant, count(o) as count_objects order by count_objects DESC
-    '''
+def get_sequence_variants(_db_connection, _object_type, _event_types):
+    # activities ordered by timestamp (startTime for high-level events)
+    event_log = get_event_log(_db_connection, _object_type, _event_types)
+    return compute_sequence_variants(event_log)
 
-    q_set_activity_variants = Query(query_str=q_set_activity_variants_str,
-                                    parameters={
-                                        'objectType': _object_type,
-                                        'eventTypes': _event_types
-                                    })
 
-    _result = pd.DataFrame(_db_connection.exec_query(q_set_activity_variants))
-    _result['%_set_variant'] = round(
-        _result.groupby(['set_variant']).count_objects.transform("sum") / sum(_result['count_objects']) * 100, 2)
-    return _result
+def get_bag_variants(_db_connection, _object_type, _event_types):
+    # multiset of activities
+    event_log = get_event_log(_db_connection, _object_type, _event_types)
+    return compute_bag_variants(event_log)
 
 
 #######################################################################
@@ -274,17 +754,19 @@ def get_activity_set_variants(_db_connection, _object_type, _event_types):
 #######################################################################
 
 def infer_start_event(_db_connection, _object_type: str, _event_types: List[str]):
+    create_df_indexes(_db_connection)
+
     # infer start and end events for each object type
     q_start_event = '''
         :auto
         // Infer start event of an object
-        MATCH (o) - [:IS_OF_TYPE] -> (ot:ObjectType {objectType: $objectType})
-        MATCH (o)<-[]-(e:Event|HighLevelEvent) - [:IS_OF_TYPE] -> (et:EventType)
-        WHERE NOT ()-[:DF {id:o.sysId}]->(e) AND et.eventType IN $eventTypes
+        MATCH (o:$object_label)
+        MATCH (o)<-[:CORR]-(e:Event|HighLevelEvent)
+        WHERE NOT ()-[:DF {id:o.sysId}]->(e) AND e.eventType IN $eventTypes
         CALL (o, e){
             MERGE (o)<-[rel:START]-(e)
             RETURN rel
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
         RETURN count(rel) as count
     '''
 
@@ -293,26 +775,30 @@ def infer_start_event(_db_connection, _object_type: str, _event_types: List[str]
         parameters={
             "objectType": _object_type,
             "eventTypes": _event_types
-        }
+        },
+        template_string_parameters={"object_label": _object_type}
     )
 
-    res = _db_connection.exec_query(q_start_event_result)
+    with instrumented_step(_db_connection, "infer_start_event", _object_type, {"event_types": _event_types}):
+        res = _db_connection.exec_query(q_start_event_result)
 
     print(f'→ Inferred Start Events for {res[0]["count"]} objects ({_object_type})')
 
 
 def infer_end_event(_db_connection, _object_type: str, _event_types: List[str]):
+    create_df_indexes(_db_connection)
+
     # infer start and end events for each object type
     q_end_event = '''
         :auto
         // Infer start event of an object
-        MATCH (o) - [:IS_OF_TYPE] -> (ot:ObjectType {objectType: $objectType})
-        MATCH (o)<-[]-(e:Event|HighLevelEvent) - [:IS_OF_TYPE] -> (et:EventType)
-        WHERE NOT (e)-[:DF {id:o.sysId}]->() AND et.eventType IN $eventTypes
+        MATCH (o:$object_label)
+        MATCH (o)<-[:CORR]-(e:Event|HighLevelEvent)
+        WHERE NOT (e)-[:DF {id:o.sysId}]->() AND e.eventType IN $eventTypes
         CALL (o, e){
             MERGE (o)<-[rel:END]-(e)
             RETURN rel
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
         RETURN count(rel) as count
     '''
 
@@ -321,35 +807,40 @@ def infer_end_event(_db_connection, _object_type: str, _event_types: List[str]):
         parameters={
             "objectType": _object_type,
             "eventTypes": _event_types
-        }
+        },
+        template_string_parameters={"object_label": _object_type}
     )
 
-    res = _db_connection.exec_query(q_end_event_result)
+    with instrumented_step(_db_connection, "infer_end_event", _object_type, {"event_types": _event_types}):
+        res = _db_connection.exec_query(q_end_event_result)
 
     print(f'→ Inferred End Events for {res[0]["count"]} objects ({_object_type})')
 
 
-def infer_high_level_events_based_on_start_and_end_events(_db_connection, _object_type: str, _hle_event_type: str):
-    create_index(_db_connection, 'HighLevelEvent')
+def infer_high_level_events_based_on_start_and_end_events(_db_connection, _object_type: str, _hle_event_type: str,
+                                                          _type_edges=True):
+    create_index(_db_connection, 'HighLevelEvent', _unique=True)
     create_event_timestamp_index(_db_connection, 'HighLevelEvent', 'startTime')
     create_event_timestamp_index(_db_connection, 'HighLevelEvent', 'endTime')
+    get_index_manager(_db_connection).await_indexes()
 
     # build high-level events
     q_build_high_level_event_str = '''
         :auto
-        MATCH (n) - [:IS_OF_TYPE] -> (ot:ObjectType {objectType: $objectType})
+        MATCH (n:$object_label)
         MATCH (eStart:Event)-[st:START]->(n)<-[en:END]-(eEnd:Event)
         WITH DISTINCT eStart, eEnd, n
         CALL (eStart, eEnd, n) {
             MERGE (h:HighLevelEvent {sysId: "HLE_" + eStart.sysId + "_" + eEnd.sysId})
+            ON CREATE SET h.startTime=eStart.timestamp, h.endTime=eEnd.timestamp, h.activity=$objectType,
+                h.eventType=$hleEventType
             MERGE (h_et:EventType {eventType: $hleEventType})
-            MERGE (h) - [:IS_OF_TYPE] -> (h_et)
-            ON CREATE SET h.startTime=eStart.timestamp, h.endTime=eEnd.timestamp, h.activity=$objectType
+            $type_edge
             MERGE (h)-[:START]->(eStart)
             MERGE (h)-[:END]->(eEnd)
             MERGE (h) - [c:CORR] -> (n)
             RETURN h
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
         RETURN count(h) as count
     '''
 
@@ -358,9 +849,82 @@ def infer_high_level_events_based_on_start_and_end_events(_db_connection, _objec
         parameters={
             "objectType": _object_type,
             "hleEventType": _hle_event_type
-        }
+        },
+        template_string_parameters={"object_label": _object_type,
+                                    "type_edge": "MERGE (h) - [:IS_OF_TYPE] -> (h_et)" if _type_edges else ""}
     )
 
-    res = _db_connection.exec_query(q_build_high_level_event_result)
+    with instrumented_step(_db_connection, "infer_high_level_events", _object_type,
+                           {"hle_event_type": _hle_event_type}):
+        res = _db_connection.exec_query(q_build_high_level_event_result)
     print(f'→ Inferred {res[0]["count"]} (:HighLevelEvent) of type {_hle_event_type} for ObjectType ({_object_type})')
 
+
+def infer_start_end_and_high_level_events(_db_connection, _object_type: str, _event_types: List[str],
+                                          _hle_event_type: str = 'HighLevelEvent', _type_edges=True):
+    """
+    Fused version of infer_start_event, infer_end_event and infer_high_level_events_based_on_start_and_end_events.
+    The events of every object are ordered once in the order of its DF chain (on timestamp, see build_df_edges) and
+    the first and the last event are its start and end event, so there is no lookup of DF edges per event. The START
+    and END edges and the high-level event from the start to the end event are written in the same batch.
+    The high-level events get the eventType property, and with _type_edges an IS_OF_TYPE relationship.
+    """
+    create_df_indexes(_db_connection)
+    create_index(_db_connection, 'HighLevelEvent', _unique=True)
+    create_event_timestamp_index(_db_connection, 'HighLevelEvent', 'startTime')
+    create_event_timestamp_index(_db_connection, 'HighLevelEvent', 'endTime')
+    get_index_manager(_db_connection).await_indexes()
+
+    _db_connection.exec_query(Query(query_str='''MERGE (:EventType {eventType: $hleEventType})''',
+                                    parameters={"hleEventType": _hle_event_type}))
+
+    q_start_end_high_level_events_str = '''
+        :auto
+        MATCH (o:$object_label)
+        MATCH (h_et:EventType {eventType: $hleEventType})
+        CALL (o, h_et) {
+            // the first and the last event in the order of the DF chain of the object, objects without events are
+            // skipped
+            MATCH (o)<-[:CORR]-(e:Event|HighLevelEvent)
+            WHERE e.eventType IN $eventTypes
+            WITH DISTINCT o, e, coalesce(e.timestamp, e.startTime) as timestamp
+            WHERE timestamp IS NOT NULL
+            WITH o, e ORDER BY timestamp, elementId(e)
+            WITH o, collect(e) as events
+            WITH o, head(events) as eStart, last(events) as eEnd
+            MERGE (o)<-[:START]-(eStart)
+            MERGE (o)<-[:END]-(eEnd)
+            WITH o, eStart, eEnd
+            CALL (o, h_et, eStart, eEnd) {
+                UNWIND [start IN [eStart] WHERE start:Event AND eEnd:Event] as hleStart
+                MERGE (h:HighLevelEvent {sysId: "HLE_" + hleStart.sysId + "_" + eEnd.sysId})
+                ON CREATE SET h.startTime=hleStart.timestamp, h.endTime=eEnd.timestamp, h.activity=$objectType,
+                    h.eventType=$hleEventType
+                $type_edge
+                MERGE (h)-[:START]->(hleStart)
+                MERGE (h)-[:END]->(eEnd)
+                MERGE (h) - [c:CORR] -> (o)
+                RETURN count(h) as numHighLevelEvents
+            }
+            RETURN numHighLevelEvents
+        } IN TRANSACTIONS OF $batch_size ROWS
+        RETURN count(*) as starts, count(*) as ends, sum(numHighLevelEvents) as count
+    '''
+
+    q_start_end_high_level_events = Query(
+        query_str=q_start_end_high_level_events_str,
+        parameters={
+            "objectType": _object_type,
+            "eventTypes": _event_types,
+            "hleEventType": _hle_event_type
+        },
+        template_string_parameters={"object_label": _object_type,
+                                    "type_edge": "MERGE (h) - [:IS_OF_TYPE] -> (h_et)" if _type_edges else ""}
+    )
+
+    with instrumented_step(_db_connection, "infer_start_end_and_high_level_events", _object_type,
+                           {"event_types": _event_types, "hle_event_type": _hle_event_type}):
+        res = _db_connection.exec_query(q_start_end_high_level_events)
+
+    print(f'→ Inferred {res[0]["starts"]} Start Events, {res[0]["ends"]} End Events and {res[0]["count"]} '
+          f'(:HighLevelEvent) of type {_hle_event_type} for ObjectType ({_object_type})')
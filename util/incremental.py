@@ -0,0 +1,395 @@
+# Import logging and surpress warnings
+import logging
+import os
+from typing import List
+
+import pandas as pd
+
+from util.db_helper_functions import preprocess_data_set
+from util.dfg import update_dfg
+from util.enrichment_methods import create_df_indexes, build_sequence_index, materialize_object, extend_relationship
+from util.index_manager import get_index_manager
+from util.transformer_functions import get_build_entity_query, get_build_relationship_query
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+# Import promg
+from promg import Configuration, SemanticHeader, DatasetDescriptions, Query
+from promg.modules.data_importer import Importer
+
+DELTA_LABEL = "DeltaRecord"
+# the events per label that are new in the delta: events extracted from a delta record, and high-level events of which
+# the start or end event is such an event (inferred again by infer_start_end_and_high_level_events)
+NEW_EVENT_PATTERNS = {
+    "Event": f"(:{DELTA_LABEL}) <- [:EXTRACTED_FROM] - (new:Event)",
+    "HighLevelEvent": f"(:{DELTA_LABEL}) <- [:EXTRACTED_FROM] - (:Event) <- [:START|END] - (new:HighLevelEvent)"
+}
+
+
+#######################################################################
+############################ WATERMARKS ###############################
+#######################################################################
+
+def get_watermark(_db_connection, _log_name):
+    """
+    Return the position of the last row of the source file of the log that has been processed.
+    The recordIds of promg start with the position of the row in the source file, as load_data and load_delta read the
+    files without sample, so the position of a row does not change when rows are appended. When no watermark is stored
+    yet (i.e. the log was loaded using load_data), it is derived from the recordIds once.
+    """
+    query_str = '''
+        MATCH (l:Log {name: $log_name})
+        CALL (l) {
+            MATCH (l) - [:CONTAINS] -> (r:Record)
+            WHERE l.watermark IS NULL
+            RETURN max(toInteger(split(r.recordId, '_')[0])) as derived_watermark
+        }
+        RETURN coalesce(l.watermark, derived_watermark, -1) as watermark
+    '''
+
+    result = _db_connection.exec_query(Query(query_str=query_str, parameters={"log_name": _log_name}))
+    if not result:
+        return -1
+    return result[0]["watermark"]
+
+
+def commit_watermarks(_db_connection):
+    """
+    Advance the watermark of every log that received new records and remove the delta marker from the records.
+    """
+    query_str = '''
+        MATCH (l:Log) WHERE l.pendingWatermark IS NOT NULL
+        SET l.watermark = l.pendingWatermark
+        REMOVE l.pendingWatermark
+        RETURN l.name as log, l.watermark as watermark
+    '''
+
+    result = _db_connection.exec_query(query_str)
+    for record in result:
+        print(f"→ Watermark of {record['log']} set to {record['watermark']}")
+
+    remove_marker_query_str = '''
+        :auto
+        MATCH (r:$delta_label)
+        CALL (r) {
+            REMOVE r:$delta_label
+        } IN TRANSACTIONS OF $batch_size ROWS
+    '''
+
+    _db_connection.exec_query(Query(query_str=remove_marker_query_str,
+                                    template_string_parameters={"delta_label": DELTA_LABEL}))
+
+
+#######################################################################
+########################### LOAD DELTA ################################
+#######################################################################
+
+def mark_delta_records(_db_connection, _log_name, _record_ids, _watermark):
+    index_manager = get_index_manager(_db_connection)
+    index_manager.ensure_node_index("Record", "recordId")
+    index_manager.await_indexes()
+
+    mark_query_str = '''
+        :auto
+        UNWIND $record_ids as record_id
+        CALL (record_id) {
+            MATCH (r:Record {recordId: record_id})
+            SET r:$delta_label
+        } IN TRANSACTIONS OF $batch_size ROWS
+    '''
+
+    _db_connection.exec_query(Query(query_str=mark_query_str,
+                                    parameters={"record_ids": _record_ids},
+                                    template_string_parameters={"delta_label": DELTA_LABEL}))
+
+    watermark_query_str = '''
+        MATCH (l:Log {name: $log_name})
+        SET l.pendingWatermark = $watermark
+    '''
+    _db_connection.exec_query(Query(query_str=watermark_query_str,
+                                    parameters={"log_name": _log_name, "watermark": _watermark}))
+
+
+def read_delta_data_set(structure, file_name, _watermark):
+    """
+    Read the rows of the CSV file beyond the watermark with the same preprocessing as promg, the rows up to the
+    watermark are skipped instead of parsed. The index continues at the position of the first new row in the file, so
+    the recordIds are the same as when the whole file is read.
+    """
+    path = os.path.join(structure.file_directory, file_name)
+    columns = pd.read_csv(path, nrows=0, sep=structure.seperator, encoding=structure.encoding).columns
+    # skip the header and the rows up to and including the watermark
+    df_log = pd.read_csv(path, keep_default_na=True, header=None, names=columns, skiprows=_watermark + 2,
+                         usecols=structure.get_required_columns(), dtype=structure.get_dtype_dict(),
+                         true_values=structure.true_values, false_values=structure.false_values,
+                         sep=structure.seperator, decimal=structure.decimal, encoding=structure.encoding)
+    df_log.index = df_log.index + _watermark + 1
+    return preprocess_data_set(structure, df_log, file_name)
+
+
+def reformat_delta_timestamps(_db_connection, structure, _record_ids):
+    """
+    Convert the timestamp strings of the new records, as _reformat_timestamps of the promg Importer does for all
+    records.
+    """
+    for attribute, datetime_format in structure.get_datetime_formats().items():
+        if datetime_format.is_epoch:
+            epoch_query_str = '''
+                :auto
+                UNWIND $record_ids as record_id
+                CALL (record_id) {
+                    MATCH (record:Record {recordId: record_id})
+                    WHERE record.$attribute IS NOT NULL AND NOT apoc.meta.cypher.isType(record.$attribute, $date_type)
+                    SET record.$attribute = apoc.date.format(record.$attribute, $unit, $dt_format)
+                } IN TRANSACTIONS OF $batch_size ROWS
+            '''
+            _db_connection.exec_query(Query(query_str=epoch_query_str,
+                                            parameters={"record_ids": _record_ids,
+                                                        "unit": datetime_format.unit,
+                                                        "dt_format": datetime_format.format,
+                                                        "date_type": datetime_format.convert_to.replace("ISO_", "")},
+                                            template_string_parameters={"attribute": attribute}))
+
+        offset = datetime_format.timezone_offset
+        timestamp_query_str = '''
+            :auto
+            UNWIND $record_ids as record_id
+            CALL (record_id) {
+                MATCH (record:Record {recordId: record_id})
+                WHERE record.$attribute IS NOT NULL AND NOT apoc.meta.cypher.isType(record.$attribute, $date_type)
+                SET record.$attribute = datetime(apoc.date.convertFormat(record.$attribute + $offset, $dt_format,
+                    $convert_to))
+            } IN TRANSACTIONS OF $batch_size ROWS
+        '''
+        _db_connection.exec_query(Query(query_str=timestamp_query_str,
+                                        parameters={"record_ids": _record_ids,
+                                                    "offset": offset,
+                                                    "dt_format": datetime_format.format,
+                                                    "convert_to": datetime_format.convert_to,
+                                                    "date_type": datetime_format.get_date_type()},
+                                        template_string_parameters={"attribute": attribute}))
+
+
+def filter_delta_records(_db_connection, structure, _record_ids):
+    """
+    Remove the new records that are filtered by the dataset description, as _filter_nodes of the promg Importer does
+    for all records.
+    """
+    for exclude in [True, False]:
+        for prop, values in structure.get_attribute_value_pairs_filtered(exclude=exclude).items():
+            if values is None:  # remove the records that (do not) have the property
+                condition = f"record.$prop IS {'NOT ' if exclude else ''}NULL"
+            else:  # remove the records of which the property has (not) one of the values
+                condition = f"{'' if exclude else 'NOT '}record.$prop IN $values"
+            filter_query_str = f'''
+                :auto
+                UNWIND $record_ids as record_id
+                CALL (record_id) {{
+                    MATCH (record:Record {{recordId: record_id}})
+                    WHERE {condition}
+                    DETACH DELETE record
+                }} IN TRANSACTIONS OF $batch_size ROWS
+            '''
+            _db_connection.exec_query(Query(query_str=filter_query_str,
+                                            parameters={"record_ids": _record_ids, "values": values},
+                                            template_string_parameters={"prop": prop}))
+
+
+def load_delta(_db_connection, conf_path, _log_names: List[str] = None):
+    """
+    Load only the rows of the (append-only) input files that are beyond the watermark of their log.
+    The new (:Record) nodes are marked with the :DeltaRecord label so that the next steps only process them.
+    The rows up to the watermark are not parsed, and the timestamps are converted and the filters of the dataset
+    description applied for the new records only, so a delta costs the same regardless of the size of the history.
+    As load_data, the files are read without sample: the sample renumbers the rows, so the positions in the source
+    file, on which the recordIds and the watermark are based, would not line up between runs.
+    """
+    config = Configuration.init_conf_with_config_file(conf_path)
+    dataset_descriptions = DatasetDescriptions(config=config)
+    semantic_header = SemanticHeader.create_semantic_header(config=config)
+    importer = Importer(database_connection=_db_connection,
+                        data_structures=dataset_descriptions,
+                        semantic_header=semantic_header)
+
+    print("\n=== LOADING DELTA ===")
+    for structure in dataset_descriptions.structures:
+        required_labels = structure.get_required_labels(records=importer.records)
+        for file_name in structure.file_names:
+            if _log_names is not None and file_name not in _log_names:
+                continue
+
+            watermark = get_watermark(_db_connection, file_name)
+            df_log = read_delta_data_set(structure, file_name, watermark)
+            if len(df_log) == 0:
+                print(f"→ No new records for {file_name} (watermark {watermark})")
+                continue
+
+            df_log = structure.determine_optional_labels_in_log(df_log, records=importer.records)
+            importer._import_nodes_from_data(df_log=df_log, file_name=file_name, required_labels=required_labels)
+            record_ids = df_log["recordId"].tolist()
+            mark_delta_records(_db_connection=_db_connection,
+                               _log_name=file_name,
+                               _record_ids=record_ids,
+                               _watermark=int(df_log.index.max()))
+            if structure.has_datetime_attribute():
+                reformat_delta_timestamps(_db_connection, structure, record_ids)
+            filter_delta_records(_db_connection, structure, record_ids)
+            print(f"→ {len(df_log)} new records loaded for {file_name} (watermark {watermark})")
+
+
+#######################################################################
+################### DELTA ENTITIES AND RELATIONSHIPS ##################
+#######################################################################
+
+def build_delta_entities(_db_connection, entities, type_property=None):
+    """
+    Create or update only the entities that are extracted from the :DeltaRecord nodes.
+    Indexes are expected to exist from the initial build. type_property as in build_entities.
+    """
+    print(f"\n=== Building DELTA ENTITY NODES ===")
+    for _label, _configs in entities.items():
+        for _config in _configs:
+            try:
+                query = get_build_entity_query(_label=_label, _config=_config, _record_label=DELTA_LABEL,
+                                               _type_property=type_property)
+                _db_connection.exec_query(query)
+                print(f"→ {_label} nodes created or updated.")
+            except Exception as e:
+                print(f"Failed for {_label}: {e}")
+
+
+def build_delta_relationships(_db_connection, _relationships):
+    """
+    Create only the relationships that are derived from the :DeltaRecord nodes.
+    """
+    print("\n=== DELTA RELATIONSHIPS ===")
+    for _type, _configs in _relationships.items():
+        for _config in _configs:
+            query = get_build_relationship_query(_type=_type, _config=_config, _record_label=DELTA_LABEL)
+            _db_connection.exec_query(query)
+            print(f"→ (:{_config['from_object']['label']}) - [:{_type}] -> (:{_config['to_object']['label']}) "
+                  f"Relationship built")
+
+
+def materialize_delta_objects(_db_connection, _objects_to_materialize):
+    """
+    Materialize only the related pairs derived from the :DeltaRecord nodes (see materialize_object), the uniqueness
+    constraints are expected to exist from the initial build.
+    """
+    print("\n=== Materializing DELTA Relationships into Objects ===")
+    for _label, _configs in _objects_to_materialize.items():
+        for _config in _configs:
+            try:
+                materialize_object(_db_connection, _label, _config, _record_label=DELTA_LABEL)
+            except Exception as e:
+                print(f"Failed to materialize object {_label}: {e}")
+
+
+def extend_delta_relationships(_db_connection, _relationships):
+    """
+    Extend the relationships only for the pairs with an object extracted from the :DeltaRecord nodes (see
+    extend_relationship), e.g. the CORR relationships of the new events to the materialized objects.
+    """
+    print("\n=== DELTA EXTENDED RELATIONSHIPS ===")
+    for _type, _configs in _relationships.items():
+        for _config in _configs:
+            try:
+                extend_relationship(_db_connection, _type, _config, _record_label=DELTA_LABEL)
+            except Exception as e:
+                print(f"Failed for {_type}: {e}")
+
+
+#######################################################################
+########################## PATCH DF EDGES #############################
+#######################################################################
+
+def get_new_event_pattern(_event_label: str):
+    if _event_label not in NEW_EVENT_PATTERNS:
+        raise ValueError(f"New events of label {_event_label} cannot be determined, use one of "
+                         f"{list(NEW_EVENT_PATTERNS)}")
+    return NEW_EVENT_PATTERNS[_event_label]
+
+
+def get_objects_with_delta_events(_db_connection, _object_type: str, _event_types: List[str],
+                                  _event_label: str = 'Event'):
+    query_str = '''
+        MATCH $new_event_pattern - [:CORR] -> (o:$object_label)
+        WHERE new.eventType IN $eventTypes
+        RETURN DISTINCT o.sysId as objectId
+    '''
+
+    result = _db_connection.exec_query(Query(query_str=query_str,
+                                             parameters={'objectType': _object_type, 'eventTypes': _event_types},
+                                             template_string_parameters={
+                                                 'new_event_pattern': get_new_event_pattern(_event_label),
+                                                 'object_label': _object_type})) or []
+    return [record["objectId"] for record in result]
+
+
+def patch_df_edges(_db_connection, _object_type: str, _event_types: List[str], _timestamp_field: str = 'timestamp',
+                   _update_dfg=False, _sequence_index=False, _event_label: str = 'Event'):
+    """
+    Repair the :DF chains of objects of type :_object_type that received new events.
+    Per object, only the suffix of the chain starting at the last existing event before the earliest new event is
+    rebuilt, so appended events extend the tail and late events are inserted mid-chain.
+    The events and their types should already be assigned (add_event_type_node) before patching.
+    _event_label is the label of the events of the chain, e.g. HighLevelEvent with _timestamp_field startTime for the
+    chains of the high-level events, which should be inferred for the new events first.
+    With _update_dfg, the DF edges of the patched objects are subtracted from the DF_C edges of the DFG (build_dfg)
+    before the patch and added again afterwards. With _sequence_index, the :SEQ edges of the patched objects are
+    rebuilt.
+    """
+    create_df_indexes(_db_connection, [_timestamp_field])
+
+    object_ids = get_objects_with_delta_events(_db_connection, _object_type, _event_types, _event_label) \
+        if _update_dfg or _sequence_index else []
+    if _update_dfg:
+        update_dfg(_db_connection, _object_type, object_ids, -1)
+
+    patch_df_query_str = '''
+        :auto
+        MATCH $new_event_pattern - [:CORR] -> (o:$object_label)
+        WHERE new.eventType IN $eventTypes AND new.$timestamp_field IS NOT NULL
+        WITH o, min(new.$timestamp_field) as firstNewTimestamp
+        CALL (o, firstNewTimestamp) {
+            OPTIONAL MATCH (o) <- [:CORR] - (prev:$event_label)
+            WHERE prev.eventType IN $eventTypes AND prev.$timestamp_field < firstNewTimestamp
+            RETURN coalesce(max(prev.$timestamp_field), firstNewTimestamp) as cutoff
+        }
+        CALL (o, cutoff) {
+            OPTIONAL MATCH (from:$event_label) - [df:DF {id: o.sysId, objectType: $objectType}] -> (:$event_label)
+            WHERE from.$timestamp_field >= cutoff
+            DELETE df
+            WITH DISTINCT o, cutoff
+            MATCH (o) <- [:CORR] - (e:$event_label)
+            WHERE e.eventType IN $eventTypes AND e.$timestamp_field >= cutoff
+            WITH DISTINCT o, e ORDER BY e.$timestamp_field, elementId(e)
+            WITH o, collect(e) as events
+            UNWIND range(0, size(events) - 2) AS index
+            WITH o, events[index] as fromEvent, events[index+1] as toEvent
+            MERGE (fromEvent) - [rel:DF {objectType: $objectType, id: o.sysId}] -> (toEvent)
+            RETURN count(rel) as count
+        } IN TRANSACTIONS OF $batch_size ROWS
+        RETURN count(o) as objects, sum(count) as count
+    '''
+
+    patch_df = Query(query_str=patch_df_query_str,
+                     parameters={
+                         'objectType': _object_type,
+                         'eventTypes': _event_types
+                     },
+                     template_string_parameters={
+                         'new_event_pattern': get_new_event_pattern(_event_label),
+                         'event_label': _event_label,
+                         'object_label': _object_type,
+                         'timestamp_field': _timestamp_field
+                     })
+
+    res = _db_connection.exec_query(patch_df)
+    if _update_dfg:
+        update_dfg(_db_connection, _object_type, object_ids, 1)
+    if _sequence_index and object_ids:
+        build_sequence_index(_db_connection, _object_type, _event_types, [_timestamp_field], object_ids)
+    print(f"→ {_object_type} DF patch result ({_event_label}): {res[0]['count']} edges for {res[0]['objects']} "
+          f"objects")
@@ -0,0 +1,170 @@
+# Import logging and surpress warnings
+import logging
+from weakref import WeakKeyDictionary, proxy
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+# Import promg
+from promg import Query
+
+# one catalog per connection, see get_index_manager
+_index_managers = WeakKeyDictionary()
+
+
+class IndexManager:
+    """
+    Keeps the index and constraint catalog of the database in memory, so that SHOW INDEXES is executed once instead of
+    for every index that is ensured. Indexes and constraints created through the manager are added to the catalog and
+    marked as pending until await_indexes has waited for them to come ONLINE.
+    """
+
+    def __init__(self, db_connection):
+        # a proxy, so that the cached manager does not keep the connection alive
+        self._db_connection = proxy(db_connection)
+        self._catalog = None
+        self._pending = False
+
+    def _load(self):
+        if self._catalog is not None:
+            return self._catalog
+
+        query = '''
+            SHOW INDEXES
+            YIELD name, type, entityType, labelsOrTypes, properties, owningConstraint, state
+            WHERE properties IS NOT NULL
+            RETURN name, type, entityType, labelsOrTypes, properties, owningConstraint, state
+        '''
+
+        result = self._db_connection.exec_query(query) or []
+        # (entity type, label or relationship type, property) -> name and whether a uniqueness constraint owns it,
+        # the property of a composite index is the tuple of its properties
+        self._catalog = {}
+        for record in result:
+            if len(record["labelsOrTypes"]) != 1:
+                continue
+            properties = record["properties"]
+            key = (record["entityType"], record["labelsOrTypes"][0],
+                   properties[0] if len(properties) == 1 else tuple(properties))
+            self._catalog[key] = {"name": record["name"], "unique": record["owningConstraint"] is not None}
+            if record["state"] != "ONLINE":
+                self._pending = True
+        return self._catalog
+
+    def invalidate(self):
+        """
+        Forget the catalog, e.g. after the database has been replaced.
+        """
+        self._catalog = None
+        self._pending = False
+
+    def has_index(self, _entity_type, _label, _property):
+        return (_entity_type, _label, _property) in self._load()
+
+    def has_unique_constraint(self, _label, _property):
+        entry = self._load().get(("NODE", _label, _property))
+        return entry is not None and entry["unique"]
+
+    def ensure_node_index(self, _label, _property):
+        if self.has_index("NODE", _label, _property):
+            return
+
+        index_query_str = '''
+            CREATE INDEX $index_name IF NOT EXISTS
+            FOR (n:$label)
+            ON (n.$property)
+        '''
+
+        index_name = f"{_label.lower()}_{_property}_index"
+        self._create(Query(query_str=index_query_str,
+                           parameters={"index_name": index_name},
+                           template_string_parameters={"label": _label, "property": _property}),
+                     ("NODE", _label, _property), index_name)
+        print(f"→ Index for :{_label}({_property}) created to improve performance")
+
+    def ensure_relationship_index(self, _type, _property):
+        """
+        Ensure an index on [:_type](_property), a tuple of properties gives a composite index.
+        """
+        if self.has_index("RELATIONSHIP", _type, _property):
+            return
+
+        index_query_str = '''
+            CREATE INDEX $index_name IF NOT EXISTS
+            FOR () - [r:$type] - ()
+            ON ($properties)
+        '''
+
+        properties = _property if isinstance(_property, tuple) else (_property,)
+        index_name = f"{_type.lower()}_{'_'.join(properties)}_index"
+        self._create(Query(query_str=index_query_str,
+                           parameters={"index_name": index_name},
+                           template_string_parameters={"type": _type,
+                                                       "properties": ", ".join(f"r.{prop}" for prop in properties)}),
+                     ("RELATIONSHIP", _type, _property), index_name)
+        print(f"→ Index for [:{_type}]({', '.join(properties)}) created to improve performance")
+
+    def ensure_unique_constraint(self, _label, _property="sysId"):
+        """
+        Declare _property as unique key of _label, which lets MERGE on the key use the backing index and guarantees
+        that no duplicates are created by concurrent writers.
+        A plain index on the same property is replaced, as the constraint brings its own index.
+        When the existing data violates the constraint, a plain index is ensured instead.
+        """
+        if self.has_unique_constraint(_label, _property):
+            return
+
+        existing = self._load().get(("NODE", _label, _property))
+        if existing is not None:
+            self._db_connection.exec_query(Query(query_str="DROP INDEX $index_name IF EXISTS",
+                                                 parameters={"index_name": existing["name"]}))
+            del self._catalog[("NODE", _label, _property)]
+
+        constraint_query_str = '''
+            CREATE CONSTRAINT $constraint_name IF NOT EXISTS
+            FOR (n:$label)
+            REQUIRE n.$property IS UNIQUE
+        '''
+
+        constraint_name = f"{_label.lower()}_{_property}_unique"
+        created = self._create(Query(query_str=constraint_query_str,
+                                     parameters={"constraint_name": constraint_name},
+                                     template_string_parameters={"label": _label, "property": _property}),
+                               ("NODE", _label, _property), constraint_name, _unique=True)
+        if created:
+            print(f"→ Uniqueness constraint for :{_label}({_property}) created to improve performance")
+        else:
+            print(f"Could not create uniqueness constraint for :{_label}({_property}), falling back to an index")
+            self.ensure_node_index(_label, _property)
+
+    def _create(self, _query, _key, _name, _unique=False):
+        # exec_query returns None when the statement failed
+        result = self._db_connection.exec_query(_query)
+        if result is None:
+            return False
+        self._load()[_key] = {"name": _name, "unique": _unique}
+        self._pending = True
+        return True
+
+    def await_indexes(self, _timeout_seconds=300):
+        """
+        Wait until all indexes are ONLINE, only when indexes were created (or populating) since the last wait.
+        """
+        self._load()
+        if not self._pending:
+            return
+
+        await_query = Query(query_str="CALL db.awaitIndexes($timeout)",
+                            parameters={"timeout": _timeout_seconds})
+        self._db_connection.exec_query(await_query)
+        self._pending = False
+        print(f"→ Indexes are online")
+
+
+def get_index_manager(_db_connection):
+    """
+    Return the (cached) IndexManager of the connection.
+    """
+    if _db_connection not in _index_managers:
+        _index_managers[_db_connection] = IndexManager(_db_connection)
+    return _index_managers[_db_connection]
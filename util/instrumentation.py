@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import pandas as pd
+
+# Import promg
+from promg import DatabaseConnection
+
+
+def sum_db_hits(_profile):
+    if not _profile:
+        return 0
+    return _profile.get("dbHits", 0) + sum(sum_db_hits(child) for child in _profile.get("children", []))
+
+
+class InstrumentedConnection:
+    """
+    Wraps a DatabaseConnection and records the wall time and the counters of the result summary (and optionally the
+    PROFILE db hits) of every executed query. Queries are attributed to the innermost active step of the thread that
+    executes them, util functions mark their steps using instrumented_step, so the report contains one row per config
+    entry, also when steps run in parallel (run_scheduled, run_pipeline).
+    """
+
+    def __init__(self, db_connection, profile=False):
+        self._db_connection = db_connection
+        self.profile = profile
+        self.rows = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _steps(self):
+        # the active steps of the calling thread
+        if not hasattr(self._local, "steps"):
+            self._local.steps = []
+        return self._local.steps
+
+    def __getattr__(self, item):
+        # driver, db_name, batch_size, verbose, ... are taken from the wrapped connection
+        return getattr(self._db_connection, item)
+
+    @contextmanager
+    def step(self, _step, _name, _config=None, _index=None):
+        row = {"step": _step, "name": _name, "index": _index,
+               "config": json.dumps(_config, default=str) if _config is not None else None,
+               "queries": 0, "wall_time": 0.0, "nodes_created": 0, "nodes_deleted": 0,
+               "relationships_created": 0, "relationships_deleted": 0, "properties_set": 0,
+               "labels_added": 0, "db_hits": 0 if self.profile else None, "error": None}
+        self._steps.append(row)
+        start = time.perf_counter()
+        try:
+            yield row
+        except Exception as e:
+            row["error"] = str(e)
+            raise
+        finally:
+            row["step_time"] = round(time.perf_counter() - start, 3)
+            self._steps.pop()
+            with self._lock:
+                self.rows.append(row)
+            print(f"   [{_step} {_name}] {row['step_time']}s, {row['nodes_created']} nodes created, "
+                  f"{row['relationships_created']} relationships created, {row['properties_set']} properties set")
+
+    def exec_query(self, query, **kwargs):
+        query = DatabaseConnection._transform_query(query, **kwargs)
+        query_str, parameters, db_name, is_batched, is_implicit = self._db_connection._prepare_query(query)
+        row = self._steps[-1] if self._steps else None
+
+        start = time.perf_counter()
+        if is_batched:
+            # apoc.periodic queries are retried by promg, only the time is recorded for these queries
+            result = self._db_connection.exec_query(query)
+            summary = None
+        else:
+            result, summary = self._run(query_str, parameters, db_name, is_implicit)
+        wall_time = time.perf_counter() - start
+        # lets a wrapped BatchingConnection tune the batch size of the query
+        observe_query = getattr(self._db_connection, "observe_query", None)
+        if observe_query is not None and summary is not None:
+            observe_query(query_str, wall_time, summary)
+
+        if row is not None:
+            with self._lock:
+                row["queries"] += 1
+                row["wall_time"] = round(row["wall_time"] + wall_time, 3)
+                if summary is not None:
+                    counters = summary.counters
+                    for counter in ["nodes_created", "nodes_deleted", "relationships_created",
+                                    "relationships_deleted", "properties_set", "labels_added"]:
+                        row[counter] += getattr(counters, counter)
+                    if self.profile:
+                        row["db_hits"] += sum_db_hits(summary.profile)
+        return result
+
+    def _run(self, query_str, parameters, db_name, is_implicit):
+        if self.profile and not query_str.lstrip().upper().startswith(("PROFILE", "EXPLAIN")):
+            query_str = "PROFILE " + query_str
+
+        def run_query(tx):
+            _result = tx.run(query_str, parameters)
+            return _result.data(), _result.consume()
+
+        with self._db_connection.driver.get_session(database=db_name or self._db_connection.db_name) as session:
+            try:
+                if is_implicit:
+                    _result = session.run(query_str, parameters)
+                    return _result.data(), _result.consume()
+                return session.execute_write(run_query)
+            except Exception as inst:  # same behaviour as exec_query of promg
+                print("Latest transaction was rolled back")
+                print(f"This was your latest query: {query_str}")
+                print(inst)
+                if self._steps:
+                    self._steps[-1]["error"] = str(inst)
+                return None, None
+
+    def get_report(self):
+        return pd.DataFrame(self.rows)
+
+    def save_report(self, path):
+        """
+        Save the report as CSV or JSON, depending on the file extension.
+        """
+        path = Path(path)
+        report = self.get_report()
+        if path.suffix == ".json":
+            report.to_json(path, orient="records", indent=2)
+        else:
+            report.to_csv(path, index=False)
+        print(f"→ Run report with {len(report)} steps saved to {path}")
+
+
+def get_instrumented_connection(_db_connection):
+    """
+    The InstrumentedConnection that is wrapped by the connection (e.g. the StepConnection of the pipeline), or None.
+    """
+    while not isinstance(_db_connection, InstrumentedConnection):
+        # the wrappers keep the connection they wrap in _db_connection
+        _db_connection = vars(_db_connection).get("_db_connection")
+        if _db_connection is None:
+            return None
+    return _db_connection
+
+
+def instrumented_step(_db_connection, _step, _name, _config=None, _index=None):
+    """
+    Mark a pipeline step, is a no-op when the connection is not instrumented.
+    """
+    instrumented_connection = get_instrumented_connection(_db_connection)
+    if instrumented_connection is not None:
+        return instrumented_connection.step(_step, _name, _config, _index)
+    return nullcontext()
@@ -0,0 +1,227 @@
+# Import logging and surpress warnings
+import logging
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+# Import promg
+from promg import DatabaseConnection, Query
+
+
+#######################################################################
+############################## CHECKPOINTS ############################
+#######################################################################
+
+def get_checkpoints(_db_connection):
+    query_str = '''
+        MATCH (c:PipelineCheckpoint)
+        RETURN c.step as step, c.hash as hash
+    '''
+
+    result = _db_connection.exec_query(query_str) or []
+    return {record["step"]: record["hash"] for record in result}
+
+
+def save_checkpoint(_db_connection, _step, _hash, _seconds):
+    query_str = '''
+        MERGE (c:PipelineCheckpoint {step: $step})
+        SET c.hash = $hash, c.seconds = $seconds, c.finishedAt = datetime()
+    '''
+
+    _db_connection.exec_query(Query(query_str=query_str,
+                                    parameters={"step": _step, "hash": _hash, "seconds": _seconds}))
+
+
+def remove_checkpoint(_db_connection, _step):
+    query_str = '''
+        MATCH (c:PipelineCheckpoint {step: $step})
+        DELETE c
+    '''
+
+    _db_connection.exec_query(Query(query_str=query_str, parameters={"step": _step}))
+
+
+#######################################################################
+################################ DAG ##################################
+#######################################################################
+
+def get_topological_order(_steps):
+    """
+    Order the steps such that every step comes after its dependencies, raises a ValueError for unknown dependencies
+    and cycles.
+    """
+    for name, step in _steps.items():
+        for dependency in step.get("depends_on", []):
+            if dependency not in _steps:
+                raise ValueError(f"Step {name} depends on unknown step {dependency}")
+
+    order = []
+    remaining = {name: set(step.get("depends_on", [])) for name, step in _steps.items()}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError(f"The steps {sorted(remaining)} contain a cycle")
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    return order
+
+
+def get_ancestors(_steps, _targets):
+    ancestors = set()
+    to_visit = list(_targets)
+    while to_visit:
+        name = to_visit.pop()
+        if name not in ancestors:
+            ancestors.add(name)
+            to_visit.extend(_steps[name].get("depends_on", []))
+    return ancestors
+
+
+def get_step_hashes(_steps, _order):
+    """
+    Hash of the config of every step, combined with the hashes of its dependencies so that a change propagates to all
+    steps that depend on it.
+    """
+    hashes = {}
+    for name in _order:
+        step = _steps[name]
+        content = {"config": step.get("config"),
+                   "dependencies": [hashes[dependency] for dependency in step.get("depends_on", [])]}
+        hashes[name] = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+    return hashes
+
+
+class StepConnection:
+    """
+    Wraps the connection of a pipeline step and records its failed queries. exec_query of promg prints a query that was
+    rolled back and returns None instead of raising, and the util functions print the errors per config, so a step is
+    only known to have succeeded when none of its queries failed. A query that succeeds when it is executed again (e.g.
+    retried by run_scheduled) is no longer a failure.
+    """
+
+    def __init__(self, db_connection):
+        self._db_connection = db_connection
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, item):
+        # driver, db_name, batch_size, concurrent_transactions, ... are taken from the wrapped connection
+        return getattr(self._db_connection, item)
+
+    def exec_query(self, query, **kwargs):
+        query = DatabaseConnection._transform_query(query, **kwargs)
+        result = self._db_connection.exec_query(query)
+        with self._lock:
+            if result is None:
+                self._failures[query] = query.query_string.strip()
+            else:
+                self._failures.pop(query, None)
+        return result
+
+    @property
+    def failures(self):
+        return list(self._failures.values())
+
+    def record_failure(self, _message):
+        with self._lock:
+            self._failures[_message] = _message
+
+
+def run_step(_db_connection, _name, _step):
+    """
+    Run the function of the step, raises a RuntimeError when any of its queries failed.
+    """
+    start = time.perf_counter()
+    print(f"\n=== STEP {_name} ===")
+    step_connection = StepConnection(_db_connection)
+    _step["function"](step_connection)
+    if step_connection.failures:
+        raise RuntimeError(f"{len(step_connection.failures)} queries failed, the first was:\n"
+                           f"{step_connection.failures[0]}")
+    return time.perf_counter() - start
+
+
+def run_pipeline(_db_connection, _steps, max_workers=4, force=False, targets=None):
+    """
+    Run the steps of the pipeline in dependency order.
+    _steps maps the name of a step to a dict with
+        - function: called with the connection
+        - config: JSON-serializable description of the inputs of the step, used for the checkpoint hash
+        - depends_on: names of the steps that have to be finished first
+        - resources: labels the step writes to, steps that share a resource are not run concurrently
+    A step is skipped when its checkpoint has the same hash and none of its dependencies was executed in this run.
+    Steps of independent branches are run in parallel on max_workers threads.
+    When targets are given, only these steps and their dependencies are run. Force runs all steps.
+    A step fails when it raises or when one of its queries failed (see StepConnection), only steps without failures
+    get a checkpoint, so the next run executes the failed step again.
+    Returns a DataFrame with the status and duration per step.
+    """
+    order = get_topological_order(_steps)
+    if targets is not None:
+        selected = get_ancestors(_steps, targets)
+        order = [name for name in order if name in selected]
+    hashes = get_step_hashes(_steps, get_topological_order(_steps))
+    checkpoints = get_checkpoints(_db_connection)
+
+    status = {}
+    seconds = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(order) or running:
+            num_finished = len(status)
+            for name in order:
+                if name in status or name in running.values():
+                    continue
+                dependencies = _steps[name].get("depends_on", [])
+                if any(status.get(dependency) in ["failed", "blocked"] for dependency in dependencies):
+                    status[name] = "blocked"
+                    continue
+                if not all(status.get(dependency) in ["done", "skipped"] for dependency in dependencies):
+                    continue
+
+                inputs_unchanged = all(status[dependency] == "skipped" for dependency in dependencies)
+                if not force and inputs_unchanged and checkpoints.get(name) == hashes[name]:
+                    status[name] = "skipped"
+                    print(f"→ Step {name} skipped, checkpoint is up to date")
+                    continue
+
+                resources = set(_steps[name].get("resources", []))
+                if any(resources & set(_steps[other].get("resources", [])) for other in running.values()):
+                    continue
+                if len(running) < max_workers:
+                    remove_checkpoint(_db_connection, name)
+                    running[executor.submit(run_step, _db_connection, name, _steps[name])] = name
+
+            if not running:
+                if len(status) == num_finished:
+                    raise RuntimeError("No step can be started")
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    seconds[name] = round(future.result(), 2)
+                    save_checkpoint(_db_connection, name, hashes[name], seconds[name])
+                    status[name] = "done"
+                    print(f"→ Step {name} finished in {seconds[name]}s")
+                except Exception as e:
+                    status[name] = "failed"
+                    print(f"Step {name} failed: {e}")
+
+    report = pd.DataFrame([{"step": name, "status": status[name], "seconds": seconds.get(name),
+                            "hash": hashes[name][:12]} for name in order])
+    print("\n=== PIPELINE ===")
+    print(report.to_string(index=False))
+    return report
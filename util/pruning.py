@@ -0,0 +1,140 @@
+# Import logging and surpress warnings
+import logging
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import json
+import os
+from typing import List, Dict
+
+import pandas as pd
+import yaml
+
+# Import promg
+from promg import Query
+
+from util.instrumentation import instrumented_step
+
+
+#######################################################################
+########################## PRUNE THE GRAPH ############################
+#######################################################################
+
+def get_objects_with_events_before(_db_connection, _cutoff: str, _object_types: List[str]):
+    """
+    Objects of the object types that have at least one event before the cutoff (an ISO datetime string), together with
+    the element ids of all their events.
+    """
+    query_str = '''
+        MATCH (o:$object_label)
+        WHERE EXISTS {(o) - [] - (e) WHERE e.eventType IS NOT NULL AND e.timestamp < datetime($cutoff)}
+        CALL (o) {
+            MATCH (o) - [] - (e)
+            WHERE e.eventType IS NOT NULL
+            RETURN collect(DISTINCT elementId(e)) as eventIds
+        }
+        RETURN $objectType as objectType, elementId(o) as objectId, eventIds
+    '''
+
+    affected = []
+    for object_type in _object_types:
+        affected.extend(_db_connection.exec_query(Query(query_str=query_str,
+                                                        parameters={"cutoff": _cutoff, "objectType": object_type},
+                                                        template_string_parameters={"object_label": object_type}))
+                        or [])
+    return affected
+
+
+def delete_nodes(_db_connection, _element_ids: List[str]):
+    query_str = '''
+        :auto
+        UNWIND $elementIds as elementId
+        CALL (elementId) {
+            MATCH (n) WHERE elementId(n) = elementId
+            DETACH DELETE n
+        } IN TRANSACTIONS OF $batch_size ROWS
+    '''
+
+    _db_connection.exec_query(Query(query_str=query_str, parameters={"elementIds": _element_ids}))
+
+
+def prune_before(_db_connection, _cutoff: str, _object_types: List[str], _dry_run=False):
+    """
+    Remove the objects of the object types that have at least one event before the cutoff, and all their events.
+    The affected objects and events are determined once and used for both the report and the delete, which is done in
+    batches of batch_size nodes instead of one transaction.
+    Returns a DataFrame with per object type the number of deleted objects and events, with _dry_run nothing is
+    deleted.
+    """
+    with instrumented_step(_db_connection, "prune_before", _cutoff, {"object_types": _object_types}):
+        affected = get_objects_with_events_before(_db_connection, _cutoff, _object_types)
+
+        objects = {object_type: set() for object_type in _object_types}
+        events = {object_type: set() for object_type in _object_types}
+        for record in affected:
+            objects[record["objectType"]].add(record["objectId"])
+            events[record["objectType"]].update(record["eventIds"])
+
+        report = pd.DataFrame([{"objectType": object_type,
+                                "object_deleted": len(objects[object_type]),
+                                "events_deleted": len(events[object_type])} for object_type in _object_types])
+        if _dry_run:
+            return report
+
+        element_ids = set().union(*objects.values(), *events.values())
+        delete_nodes(_db_connection, list(element_ids))
+
+    print(f'→ Pruned {report["object_deleted"].sum()} objects and {report["events_deleted"].sum()} events with events '
+          f'before {_cutoff}')
+    return report
+
+
+#######################################################################
+######################## WINDOW AT LOAD TIME ##########################
+#######################################################################
+
+def create_windowed_config(_conf_path, _start: str, _end: str = None, _population_columns: Dict[str, str] = None,
+                           _output_directory=None):
+    """
+    Create a copy of the configuration and the dataset description in which the sample.between block of every file is
+    set to the window [_start, _end] (ISO dates, no upper bound when _end is None) and use_sample is enabled, so records
+    outside the window are not loaded.
+    The window is applied per record on the population column of the file (by default the one of the existing
+    sample block), e.g. the close time of a change, so objects can still have events before _start. Use prune_before
+    after building the graph to remove these.
+    Returns the path of the new configuration.
+    """
+    with open(_conf_path) as f:
+        config = yaml.safe_load(f)
+    with open(config["dataset_description_path"]) as f:
+        dataset_descriptions = json.load(f)
+
+    population_columns = _population_columns or {}
+    end = _end if _end is not None else pd.Timestamp.max.isoformat()
+    for dataset_description in dataset_descriptions:
+        file_name = dataset_description["file_name"]
+        sample = dataset_description.get("sample")
+        population_column = population_columns.get(file_name, sample["population_column"] if sample else None)
+        if population_column is None:
+            print(f"{file_name} has no sample population column and is loaded without window")
+            continue
+        dataset_description["sample"] = {
+            **(sample or {}),
+            "use_random_sample": False,
+            "population_column": population_column,
+            "between": [_start, end]
+        }
+
+    dataset_description_directory = _output_directory or os.path.dirname(config["dataset_description_path"])
+    dataset_description_path = os.path.join(dataset_description_directory, "BPIC14_DS_windowed.json")
+    with open(dataset_description_path, "w") as f:
+        json.dump(dataset_descriptions, f, indent=2)
+
+    config["dataset_description_path"] = dataset_description_path
+    config["use_sample"] = True
+    windowed_conf_path = os.path.join(_output_directory or os.path.dirname(_conf_path), "config_windowed.yaml")
+    with open(windowed_conf_path, "w") as f:
+        yaml.safe_dump(config, f)
+    print(f"→ Created {windowed_conf_path} loading records between {_start} and {end}")
+    return windowed_conf_path
@@ -0,0 +1,295 @@
+# Import logging and surpress warnings
+import json
+import logging
+import re
+from contextlib import contextmanager
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import pandas as pd
+
+# Import promg
+from promg import DatabaseConnection
+
+from util.enrichment_methods import materialize_object, extend_relationship, build_df_edges, infer_start_event, \
+    infer_end_event, infer_high_level_events_based_on_start_and_end_events, infer_start_end_and_high_level_events
+from util.transformer_functions import build_entity, build_entities_for_log, group_entity_configs_by_log, \
+    build_relationship
+
+# operators that touch every node, or combine every row of one side with every row of the other side
+FORBIDDEN_OPERATORS = ["AllNodesScan", "CartesianProduct"]
+# the estimated rows of an operator may not exceed this factor times the number of nodes in the database
+ROW_BUDGET_FACTOR = 10
+# forbidden operators that are accepted for a source, e.g. {"analysis: get the incidents": ["CartesianProduct"]}
+ALLOWED_OPERATORS = {}
+
+# catalog queries (e.g. SHOW INDEXES of the index manager) are executed instead of explained
+CATALOG_QUERY = re.compile(r"^\s*SHOW\b", re.IGNORECASE)
+# schema commands and db procedures are neither executed nor explained, so the check never changes the schema
+SCHEMA_COMMAND = re.compile(r"^\s*(CREATE\s+(\w+\s+)?(INDEX|CONSTRAINT)|DROP\s+(INDEX|CONSTRAINT)|CALL\s+db\.)\b",
+                            re.IGNORECASE)
+
+
+#######################################################################
+########################## EXPLAIN QUERIES ############################
+#######################################################################
+
+def get_operators(_plan):
+    """
+    The operators of an EXPLAIN plan as (operator, estimated rows) pairs, depth first.
+    """
+    if not _plan:
+        return []
+    operator = _plan["operatorType"].split("@")[0]
+    # the driver puts the arguments of an operator, e.g. EstimatedRows, under args
+    estimated_rows = _plan.get("args", {}).get("EstimatedRows", 0)
+    operators = [(operator, estimated_rows)]
+    for child in _plan.get("children", []):
+        operators.extend(get_operators(child))
+    return operators
+
+
+class PlanCheckConnection:
+    """
+    Wraps a DatabaseConnection and EXPLAINs every query instead of executing it, so the util functions render their
+    queries with the real configs without writing to the database. Queries are attributed to the active source.
+    Every explained query returns one row with 0 for every column, so the calling function continues with its next
+    query. Only SHOW queries are executed, schema commands (CREATE INDEX, DROP CONSTRAINT, CALL db.awaitIndexes, ...)
+    are skipped and reported with status skipped.
+    """
+
+    def __init__(self, db_connection):
+        self._db_connection = db_connection
+        self.plans = []
+        self._source = None
+
+    def __getattr__(self, item):
+        # driver, db_name, batch_size, verbose, ... are taken from the wrapped connection
+        return getattr(self._db_connection, item)
+
+    @contextmanager
+    def source(self, _name):
+        self._source = _name
+        try:
+            yield
+        finally:
+            self._source = None
+
+    def exec_query(self, query, **kwargs):
+        query = DatabaseConnection._transform_query(query, **kwargs)
+        query_str, parameters, db_name, _, _ = self._db_connection._prepare_query(query)
+        if CATALOG_QUERY.match(query_str):
+            return self._db_connection.exec_query(query)
+
+        row = {"source": self._source, "query": query_str.strip(), "plan": None, "error": None, "skipped": False}
+        self.plans.append(row)
+        if SCHEMA_COMMAND.match(query_str):
+            row["skipped"] = True
+            return []
+        # EXPLAIN does not execute the query, so CALL {...} IN TRANSACTIONS can be planned in any session
+        with self._db_connection.driver.get_session(database=db_name or self._db_connection.db_name) as session:
+            try:
+                result = session.run("EXPLAIN " + query_str, parameters)
+                keys = result.keys()
+                row["plan"] = result.consume().plan
+            except Exception as inst:
+                row["error"] = str(inst)
+                return None
+        return [dict.fromkeys(keys, 0)]
+
+
+#######################################################################
+########################### RENDER QUERIES ############################
+#######################################################################
+
+def get_analysis_queries(_path="analysis_queries.cypher"):
+    """
+    The queries of the file by their comment: a query starts with a // comment and ends at the next blank line, lines
+    outside a query are ignored.
+    """
+    queries = {}
+    name = None
+    with open(_path) as f:
+        for line in f:
+            line = line.rstrip()
+            if line.startswith("//"):
+                name = line.lstrip("/ ")
+                queries[name] = ""
+            elif not line:
+                name = None
+            elif name is not None:
+                queries[name] += line + "\n"
+    return {name: query for name, query in queries.items() if query}
+
+
+def render_queries(_plan_connection, _ekg_configs, _analysis_queries_path="analysis_queries.cypher"):
+    """
+    Run the util functions of the EKG build with the configs (the module bpic14/bpic14_configs.py of the notebooks) and
+    the queries of analysis_queries.cypher on the PlanCheckConnection, so that all their queries are explained.
+    """
+    sources = []
+    for _label, _configs in _ekg_configs.objects.items():
+        for _index, _config in enumerate(_configs):
+            sources.append((f"build_entity {_label} {_index}",
+                            lambda _label=_label, _config=_config: build_entity(_plan_connection, _label, _config,
+                                                                                _type_property="objectType")))
+    for _label, _configs in _ekg_configs.EVENTS.items():
+        for _index, _config in enumerate(_configs):
+            sources.append((f"build_entity {_label} {_index}",
+                            lambda _label=_label, _config=_config: build_entity(_plan_connection, _label, _config,
+                                                                                _type_property="eventType")))
+    for _entities, _type_property in [(_ekg_configs.objects, "objectType"), (_ekg_configs.EVENTS, "eventType")]:
+        configs_per_log, _ = group_entity_configs_by_log(_entities)
+        for _log, _label_configs in configs_per_log.items():
+            sources.append((f"build_entities_for_log {_log} ({_type_property})",
+                            lambda _log=_log, _label_configs=_label_configs, _type_property=_type_property:
+                            build_entities_for_log(_plan_connection, _log, _label_configs, _type_property)))
+    for _relationships in [_ekg_configs.o2o_relationships, _ekg_configs.e2o_relationships]:
+        for _type, _configs in _relationships.items():
+            for _index, _config in enumerate(_configs):
+                sources.append((f"build_relationship {_type} {_index}",
+                                lambda _type=_type, _config=_config: build_relationship(_plan_connection, _type,
+                                                                                        _config)))
+    for _label, _configs in _ekg_configs.objects_to_materialize.items():
+        for _index, _config in enumerate(_configs):
+            sources.append((f"materialize_object {_label} {_index}",
+                            lambda _label=_label, _config=_config: materialize_object(_plan_connection, _label,
+                                                                                      _config)))
+    for _relationships in [_ekg_configs.o2o_relationships_to_extend, _ekg_configs.e2o_relationships_to_extend,
+                           _ekg_configs.hle2o_relationships_to_extend]:
+        for _type, _configs in _relationships.items():
+            for _index, _config in enumerate(_configs):
+                sources.append((f"extend_relationship {_type} {_config['from_object']['label']} {_index}",
+                                lambda _type=_type, _config=_config: extend_relationship(_plan_connection, _type,
+                                                                                         _config)))
+    for _object_type, _event_types in _ekg_configs.df_object_types_with_event_types.items():
+        sources.append((f"build_df_edges {_object_type}",
+                        lambda _object_type=_object_type, _event_types=_event_types:
+                        build_df_edges(_plan_connection, _object_type, _event_types)))
+    for _object_type, _hle_config in _ekg_configs.hle_object_types_with_event_types.items():
+        sources.append((f"build_df_edges {_object_type} (high-level events)",
+                        lambda _object_type=_object_type, _hle_config=_hle_config:
+                        build_df_edges(_plan_connection, _object_type, _hle_config["eventTypes"],
+                                       _hle_config["timestampFields"])))
+    for _object_type, _event_types in _ekg_configs.start_end_object_types_with_event_types.items():
+        sources.append((f"infer_start_event {_object_type}",
+                        lambda _object_type=_object_type, _event_types=_event_types:
+                        infer_start_event(_plan_connection, _object_type, _event_types)))
+        sources.append((f"infer_end_event {_object_type}",
+                        lambda _object_type=_object_type, _event_types=_event_types:
+                        infer_end_event(_plan_connection, _object_type, _event_types)))
+        sources.append((f"infer_high_level_events {_object_type}",
+                        lambda _object_type=_object_type:
+                        infer_high_level_events_based_on_start_and_end_events(_plan_connection, _object_type,
+                                                                              'HighLevelEvent')))
+        sources.append((f"infer_start_end_and_high_level_events {_object_type}",
+                        lambda _object_type=_object_type, _event_types=_event_types:
+                        infer_start_end_and_high_level_events(_plan_connection, _object_type, _event_types)))
+    for _name, _query in get_analysis_queries(_analysis_queries_path).items():
+        sources.append((f"analysis: {_name}", lambda _query=_query: _plan_connection.exec_query(_query)))
+
+    for _name, _function in sources:
+        with _plan_connection.source(_name):
+            try:
+                _function()
+            except Exception as e:
+                # the queries that were explained before the exception are still checked
+                print(f"Failed to render {_name}: {e}")
+
+
+#######################################################################
+############################ CHECK PLANS ##############################
+#######################################################################
+
+def check_plan(_plan, _row_budget, _forbidden_operators):
+    """
+    The violations of the plan: forbidden operators and operators with more estimated rows than the budget.
+    """
+    violations = []
+    for operator, estimated_rows in get_operators(_plan):
+        if operator in _forbidden_operators:
+            violations.append(operator)
+        if estimated_rows > _row_budget:
+            violations.append(f"{operator} estimates {estimated_rows:.0f} rows (budget {_row_budget:.0f})")
+    return violations
+
+
+def get_status(_plan, _violations):
+    if _plan["skipped"]:
+        return "skipped"
+    if _plan["error"] is not None:
+        return "error"
+    return "violations" if _violations else "ok"
+
+
+def check_query_plans(_db_connection, _ekg_configs, _row_budget=None, _forbidden_operators=None,
+                      _allowed_operators=None, _analysis_queries_path="analysis_queries.cypher"):
+    """
+    EXPLAIN every query of the EKG build and of analysis_queries.cypher against the database, which should contain a
+    graph built on the synthetic data (e.g. by benchmark.py), and check the plans.
+    Without _row_budget, the budget is ROW_BUDGET_FACTOR times the number of nodes in the database.
+    Returns a DataFrame with per query its source, status (ok, violations, error or skipped), the operators, the
+    maximum estimated rows and the violations, a query that cannot be planned has an error instead.
+    """
+    forbidden_operators = FORBIDDEN_OPERATORS if _forbidden_operators is None else _forbidden_operators
+    allowed_operators = ALLOWED_OPERATORS if _allowed_operators is None else _allowed_operators
+    if _row_budget is None:
+        result = _db_connection.exec_query("MATCH (n) RETURN count(n) as count")
+        _row_budget = ROW_BUDGET_FACTOR * max(result[0]["count"] if result else 0, 1)
+
+    plan_connection = PlanCheckConnection(_db_connection)
+    render_queries(plan_connection, _ekg_configs, _analysis_queries_path)
+
+    rows = []
+    for plan in plan_connection.plans:
+        source_forbidden_operators = [operator for operator in forbidden_operators
+                                      if operator not in allowed_operators.get(plan["source"], [])]
+        operators = get_operators(plan["plan"])
+        violations = check_plan(plan["plan"], _row_budget, source_forbidden_operators)
+        rows.append({"source": plan["source"],
+                     "status": get_status(plan, violations),
+                     "operators": " <- ".join(operator for operator, _ in operators),
+                     "max_estimated_rows": max((estimated_rows for _, estimated_rows in operators), default=None),
+                     "violations": violations,
+                     "error": plan["error"],
+                     "query": plan["query"]})
+    report = pd.DataFrame(rows, columns=["source", "status", "operators", "max_estimated_rows", "violations", "error",
+                                         "query"])
+
+    failed = report[report["status"].isin(["violations", "error"])]
+    print(f"→ {len(report)} query plans checked, {len(failed)} failed, "
+          f"{(report['status'] == 'skipped').sum()} schema commands skipped (row budget {_row_budget:.0f})")
+    return report
+
+
+#######################################################################
+######################### PLAN FINGERPRINTS ###########################
+#######################################################################
+
+def get_plan_fingerprints(_report):
+    """
+    The operators of the plans per source, which do not depend on the estimated rows, e.g. to detect that an index is
+    no longer used.
+    """
+    fingerprints = {}
+    for _, row in _report[_report["status"].isin(["ok", "violations"])].iterrows():
+        fingerprints.setdefault(row["source"], []).append(row["operators"])
+    return fingerprints
+
+
+def save_plan_fingerprints(_report, _path):
+    with open(_path, "w") as f:
+        json.dump(get_plan_fingerprints(_report), f, indent=2, sort_keys=True)
+    print(f"→ Plan fingerprints of {len(_report)} queries saved to {_path}")
+
+
+def compare_plan_fingerprints(_report, _path):
+    """
+    The sources of which the plans differ from the stored fingerprints, with the stored and the current operators.
+    Sources that are not stored are reported as well, sources that are no longer rendered are ignored.
+    """
+    with open(_path) as f:
+        stored = json.load(f)
+    return {source: {"stored": stored.get(source), "current": operators}
+            for source, operators in get_plan_fingerprints(_report).items() if stored.get(source) != operators}
@@ -0,0 +1,119 @@
+# Import logging and surpress warnings
+import logging
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import numpy as np
+import pandas as pd
+from neo4j.time import Date, DateTime
+from pandas.api.types import union_categoricals
+
+from util.async_queries import split_query
+
+
+#######################################################################
+######################### COLUMN CONVERSION ###########################
+#######################################################################
+
+def datetime_to_epoch_nanoseconds(_value):
+    # to_native only keeps microseconds, the remaining nanoseconds are added
+    return pd.Timestamp(_value.to_native()).value + _value.nanosecond % 1000
+
+
+def convert_column(_values):
+    """
+    Convert the values of one column of a page into a typed pandas array: DateTime to datetime64[ns, UTC] (or
+    datetime64[ns] when the values have no timezone), Date to datetime64[ns] and strings to a categorical.
+    Other values are left to pandas.
+    """
+    non_null = [value for value in _values if value is not None]
+    if not non_null:
+        return pd.array(_values, dtype=object)
+
+    value_type = type(non_null[0])
+    if any(type(value) is not value_type for value in non_null):
+        return pd.array(_values, dtype=object)
+
+    if value_type is DateTime:
+        has_timezone = non_null[0].tzinfo is not None
+        nanoseconds = np.array([datetime_to_epoch_nanoseconds(value) if value is not None else np.iinfo(np.int64).min
+                                for value in _values], dtype=np.int64)
+        # the minimum int64 is NaT
+        timestamps = pd.DatetimeIndex(nanoseconds.view("datetime64[ns]"))
+        return timestamps.tz_localize("UTC").array if has_timezone else timestamps.array
+    if value_type is Date:
+        return pd.DatetimeIndex([value.to_native() if value is not None else None for value in _values]) \
+            .as_unit("ns").array
+    if value_type is str:
+        return pd.Categorical(_values)
+    return pd.array(_values) if value_type in (int, float, bool) else pd.array(_values, dtype=object)
+
+
+def page_to_dataframe(_columns, _records):
+    values_per_column = list(zip(*_records)) if _records else [()] * len(_columns)
+    return pd.DataFrame({column: convert_column(list(values))
+                         for column, values in zip(_columns, values_per_column)})
+
+
+#######################################################################
+############################# STREAMING ###############################
+#######################################################################
+
+def stream_query_pages(_db_connection, query, _page_size=None):
+    """
+    Yield the result of the query as typed DataFrames of at most _page_size (default batch_size) rows. The records are
+    pulled lazily from the database, so only one page is in memory at a time.
+    """
+    query_str, parameters = split_query(query)
+    page_size = _page_size or _db_connection.batch_size
+    with _db_connection.driver.get_session(database=_db_connection.db_name) as session:
+        result = session.run(query_str, parameters)
+        columns = result.keys()
+        while True:
+            records = [record.values() for record in result.fetch(page_size)]
+            if not records:
+                break
+            yield page_to_dataframe(columns, records)
+
+
+def concat_pages(_pages):
+    """
+    Concatenate typed pages, categoricals with different categories per page are unioned instead of becoming object
+    columns.
+    """
+    if not _pages:
+        return pd.DataFrame()
+    columns = {}
+    for column in _pages[0].columns:
+        if all(isinstance(page[column].dtype, pd.CategoricalDtype) for page in _pages):
+            columns[column] = union_categoricals([page[column] for page in _pages])
+        else:
+            columns[column] = pd.concat([page[column] for page in _pages], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def query_to_dataframe(_db_connection, query, _page_size=None):
+    """
+    Typed DataFrame of the query result, built page by page without an intermediate list of dicts.
+    """
+    return concat_pages(list(stream_query_pages(_db_connection, query, _page_size)))
+
+
+def query_to_arrow(_db_connection, query, _page_size=None):
+    """
+    Arrow table of the query result, every page becomes a record batch (strings are dictionary-encoded, temporals are
+    timestamp[ns] columns).
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Arrow results require pyarrow, install it using `pip install pyarrow`")
+
+    batches = [pa.RecordBatch.from_pandas(page, preserve_index=False)
+               for page in stream_query_pages(_db_connection, query, _page_size)]
+    if not batches:
+        return pa.table({})
+    # the dictionary index width and the type of all-null columns can differ per page
+    schema = pa.unify_schemas([batch.schema for batch in batches], promote_options="permissive")
+    return pa.Table.from_batches([batch.cast(schema) for batch in batches], schema=schema)
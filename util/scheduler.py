@@ -0,0 +1,149 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from promg import DatabaseConnection
+
+from util.instrumentation import instrumented_step
+
+
+def split_labels(_label):
+    return frozenset(_label.split("|"))
+
+
+def create_footprint(read_labels=(), write_labels=(), read_relationships=(), write_relationships=(),
+                     locked_nodes=()):
+    """
+    A footprint describes which node labels and relationships a config reads and writes.
+    Relationships are described as (type, from_labels, to_labels) tuples.
+    Writing a relationship locks both its endpoints, locked_nodes holds the endpoint labels as (label, log) tuples,
+    where log is None when the nodes of any log can be locked.
+    """
+    return {
+        "read_labels": set(read_labels),
+        "write_labels": set(write_labels),
+        "read_relationships": set(read_relationships),
+        "write_relationships": set(write_relationships),
+        "locked_nodes": set(locked_nodes)
+    }
+
+
+def get_entity_footprint(_label, _config):
+    return create_footprint(
+        read_labels=["Log", "Record"],
+        write_labels=[_label],
+        read_relationships=[("CONTAINS", frozenset(["Log"]), frozenset(["Record"]))],
+        write_relationships=[("EXTRACTED_FROM", frozenset([_label]), frozenset(["Record"]))],
+        # only the records of the log of the config are linked
+        locked_nodes=[(_label, None), ("Record", _config.get("log") or None)]
+    )
+
+
+def get_relationship_footprint(_type, _config):
+    from_labels = split_labels(_config["from_object"]["label"])
+    to_labels = split_labels(_config["to_object"]["label"])
+    read_labels = from_labels | to_labels | {"Record"}
+    read_relationships = [("EXTRACTED_FROM", from_labels, frozenset(["Record"])),
+                          ("EXTRACTED_FROM", to_labels, frozenset(["Record"]))]
+    if "log" in _config:
+        read_labels |= {"Log"}
+        read_relationships.append(("CONTAINS", frozenset(["Log"]), frozenset(["Record"])))
+
+    return create_footprint(
+        read_labels=read_labels,
+        read_relationships=read_relationships,
+        write_relationships=[(_type, from_labels, to_labels)],
+        locked_nodes=[(label, None) for label in from_labels | to_labels]
+    )
+
+
+def relationships_overlap(_relationships_a, _relationships_b):
+    for type_a, from_a, to_a in _relationships_a:
+        for type_b, from_b, to_b in _relationships_b:
+            if type_a == type_b and from_a & from_b and to_a & to_b:
+                return True
+    return False
+
+
+def nodes_overlap(_nodes_a, _nodes_b):
+    for label_a, log_a in _nodes_a:
+        for label_b, log_b in _nodes_b:
+            if label_a == label_b and (log_a is None or log_b is None or log_a == log_b):
+                return True
+    return False
+
+
+def conflicts(_footprint_a, _footprint_b):
+    """
+    Two configs conflict when one of them writes labels or relationships that the other reads or writes, or when both
+    write relationships to the same nodes, as these may be locked in a different order and deadlock.
+    """
+    if nodes_overlap(_footprint_a["locked_nodes"], _footprint_b["locked_nodes"]):
+        return True
+    for writer, other in [(_footprint_a, _footprint_b), (_footprint_b, _footprint_a)]:
+        if writer["write_labels"] & (other["read_labels"] | other["write_labels"]):
+            return True
+        if relationships_overlap(writer["write_relationships"],
+                                 other["read_relationships"] | other["write_relationships"]):
+            return True
+    return False
+
+
+def run_task(_db_connection, query, step, max_retries, backoff=0.5):
+    """
+    Execute the query of a task through exec_query of the (wrapped) connection, so it is batch-tuned and measured as
+    any other query, and attributed to its step in the thread that runs it (see util/instrumentation.py).
+    exec_query returns None when the query was rolled back, e.g. on a deadlock with a task that was not foreseen by the
+    footprints, the query is then retried with exponential backoff, hence only idempotent queries should be scheduled.
+    """
+    # the retries execute the same Query, which the pipeline then no longer counts as failed, see util/pipeline.py
+    query = DatabaseConnection._transform_query(query)
+    with instrumented_step(_db_connection, *step):
+        attempt = 0
+        while True:
+            result = _db_connection.exec_query(query)
+            if result is not None:
+                return result
+            if attempt >= max_retries:
+                raise RuntimeError(f"query was rolled back {max_retries + 1} times")
+            delay = backoff * 2 ** attempt
+            print(f"Query was rolled back, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def run_scheduled(_db_connection, tasks, max_workers=4, max_retries=5):
+    """
+    Run tasks concurrently on a thread pool, each query in its own session (see run_task).
+    A task is a (name, footprint, query, step) tuple, step holds the (step, name, config, index) arguments of
+    instrumented_step. A task is only started when it does not conflict with any running task nor with any earlier
+    task that is still waiting, so conflicting tasks keep their original order.
+    Rolled back queries are retried with exponential backoff.
+    """
+    pending = list(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            waiting = []
+            for task in pending:
+                name, footprint, query, step = task
+                blocked = any(conflicts(footprint, other[1]) for other in list(running.values()) + waiting)
+                if blocked or len(running) >= max_workers:
+                    waiting.append(task)
+                    continue
+                future = executor.submit(run_task, _db_connection, query, step, max_retries)
+                running[future] = task
+            pending = waiting
+
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _, _, _ = running.pop(future)
+                try:
+                    future.result()
+                    print(f"→ {name} done.")
+                except Exception as e:
+                    print(f"Failed for {name}: {e}")
+                    # lets the pipeline mark the step as failed, see util/pipeline.py
+                    record_failure = getattr(_db_connection, "record_failure", None)
+                    if record_failure is not None:
+                        record_failure(f"{name}: {e}")
@@ -0,0 +1,110 @@
+# Import logging and surpress warnings
+import logging
+from typing import List
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import pandas as pd
+
+# Import promg
+from promg import Query
+
+from util.enrichment_methods import get_sequence_name
+
+# the :SEQ edges are found by an index seek on (id, sequence, position) or (id, sequence, timestamp), so the lookups
+# take time proportional to the number of returned events instead of to the number of events of the object
+sequence_columns = ["position", "eventId", "eventType", "activity", "timestamp"]
+
+
+def get_sequence_events(_db_connection, _query_str, _parameters):
+    query_str = f'''
+        {_query_str}
+        RETURN seq.position as position, e.sysId as eventId, e.eventType as eventType, e.activity as activity,
+            seq.timestamp as timestamp
+        ORDER BY position
+    '''
+
+    return pd.DataFrame(_db_connection.exec_query(Query(query_str=query_str, parameters=_parameters)),
+                        columns=sequence_columns)
+
+
+def get_next_events(_db_connection, _object_type: str, _object_id: str, _event_id: str, _k: int = 1,
+                    _timestamp_fields: List[str] = None):
+    """
+    The _k events that follow event _event_id (sysId) in the sequence of object _object_id (sysId).
+    The sequence is the one built by build_sequence_index (or build_df_edges(..., _sequence_index=True)) for
+    _object_type and _timestamp_fields.
+    """
+    query_str = '''
+        MATCH (:Event|HighLevelEvent {sysId: $eventId}) - [current:SEQ] -> ()
+        WHERE current.id = $objectId AND current.sequence = $sequence
+        WITH max(current.position) as position
+        MATCH (e) - [seq:SEQ] -> ()
+        WHERE seq.id = $objectId AND seq.sequence = $sequence AND position < seq.position <= position + $k
+    '''
+
+    return get_sequence_events(_db_connection, query_str,
+                               {"objectId": _object_id, "eventId": _event_id, "k": _k,
+                                "sequence": get_sequence_name(_object_type, _timestamp_fields)})
+
+
+def get_previous_events(_db_connection, _object_type: str, _object_id: str, _event_id: str, _k: int = 1,
+                        _timestamp_fields: List[str] = None):
+    """
+    The _k events that precede event _event_id (sysId) in the sequence of object _object_id (sysId).
+    """
+    query_str = '''
+        MATCH (:Event|HighLevelEvent {sysId: $eventId}) - [current:SEQ] -> ()
+        WHERE current.id = $objectId AND current.sequence = $sequence
+        WITH min(current.position) as position
+        MATCH (e) - [seq:SEQ] -> ()
+        WHERE seq.id = $objectId AND seq.sequence = $sequence AND position - $k <= seq.position < position
+    '''
+
+    return get_sequence_events(_db_connection, query_str,
+                               {"objectId": _object_id, "eventId": _event_id, "k": _k,
+                                "sequence": get_sequence_name(_object_type, _timestamp_fields)})
+
+
+def get_events_between(_db_connection, _object_type: str, _object_id: str, _start: str, _end: str,
+                       _timestamp_fields: List[str] = None):
+    """
+    The events of object _object_id (sysId) with _start <= timestamp < _end, as ISO datetime strings with offset
+    (e.g. "2013-08-19T09:59:53+01:00").
+    """
+    query_str = '''
+        MATCH (e) - [seq:SEQ] -> ()
+        WHERE seq.id = $objectId AND seq.sequence = $sequence
+            AND datetime($start) <= seq.timestamp < datetime($end)
+    '''
+
+    return get_sequence_events(_db_connection, query_str,
+                               {"objectId": _object_id, "start": _start, "end": _end,
+                                "sequence": get_sequence_name(_object_type, _timestamp_fields)})
+
+
+def get_succeeding_events(_db_connection, _object_type: str, _event_type: str, _activity: str,
+                          _timestamp_fields: List[str] = None):
+    """
+    The event that follows every event of type _event_type with _activity in the sequence of its object of type
+    _object_type, e.g. the first event after the Open event of every incident. Events that are the last of their
+    sequence are left out.
+    """
+    query_str = '''
+        MATCH (e1:Event {eventType: $eventType, activity: $activity}) - [current:SEQ {sequence: $sequence}] -> ()
+        MATCH (e2) - [next:SEQ] -> ()
+        WHERE next.id = current.id AND next.sequence = $sequence AND next.position = current.position + 1
+        RETURN current.id as objectId, e1.sysId as eventId, e2.sysId as nextEventId, e2.eventType as nextEventType,
+            e2.activity as nextActivity, next.timestamp as nextTimestamp
+    '''
+
+    return pd.DataFrame(_db_connection.exec_query(Query(query_str=query_str,
+                                                        parameters={
+                                                            "eventType": _event_type,
+                                                            "activity": _activity,
+                                                            "sequence": get_sequence_name(_object_type,
+                                                                                          _timestamp_fields)
+                                                        })),
+                        columns=["objectId", "eventId", "nextEventId", "nextEventType", "nextActivity",
+                                 "nextTimestamp"])
@@ -4,9 +4,17 @@ import logging
 logging.getLogger("neo4j").setLevel(logging.ERROR)
 logging.getLogger("pd").setLevel(logging.ERROR)
 
+from string import Template
+
+import pandas as pd
+
 # Import promg
 from promg import Query
 
+from util.index_manager import get_index_manager
+from util.instrumentation import instrumented_step
+from util.scheduler import get_entity_footprint, get_relationship_footprint, run_scheduled
+
 
 def index_exists(_db_connection, index_name):
     query = '''
@@ -21,59 +29,23 @@ def index_exists(_db_connection, index_name):
 
 
 def create_event_timestamp_index(_db_connection, _label='Event', _timestamp_field='timestamp'):
-    index_name = f'{_label.lower()}_{_timestamp_field.lower()}_index'
-    if not index_exists(_db_connection, index_name):
-        index_query_str = """
-                          CREATE INDEX $index_name IF NOT EXISTS
-                              FOR (e:$label)
-                              ON (e.$timestamp_field) \
-                          """
-
-        index_query = Query(query_str=index_query_str,
-                            template_string_parameters={
-                                "label": _label,
-                                "timestamp_field": _timestamp_field
-                            },
-                            parameters={"index_name": index_name})
-
-        _db_connection.exec_query(index_query)
-        print(f"→ Index for :{_label} ({_timestamp_field}) created to improve performance")
-
-
-def create_index(_db_connection, _label):
-    index_name = f"{_label.lower()}_sysId_index"
-
-    if not index_exists(_db_connection, index_name):
-        index_query_str = f"""
-            CREATE INDEX $index_name IF NOT EXISTS
-            FOR (n:$label)
-            ON (n.sysId)
-        """
-
-        index_query = Query(query_str=index_query_str,
-                            parameters={
-                                "index_name": index_name
-                            },
-                            template_string_parameters={
-                                "label": _label
-                            })
-
-        _db_connection.exec_query(index_query)
-        print(f"→ Index for :{_label}(sysId) created to improve performance")
-
-
-def build_entity(_db_connection, _label, _config):
-    iterate_query = """
-        :auto
-        MATCH (l:Log)-[:CONTAINS]->(r:Record)
-        WHERE r.$sysId_field IS NOT NULL $log_name_condition $time_field_condition
-        WITH r.$sysId_field $id_addition AS sysId, r
-        CALL (sysId, r) {
-             MERGE (n:$label {sysId: sysId})
-             MERGE (n)-[:EXTRACTED_FROM]->(r)
-             $attr_updates
-             $constants_updates
-        } IN TRANSACTIONS
+    get_index_manager(_db_connection).ensure_node_index(_label, _timestamp_field)
+
+
+def create_index(_db_connection, _label, _unique=False):
+    """
+    Ensure an index on :_label(sysId), when _unique is set a uniqueness constraint is declared instead.
+    """
+    index_manager = get_index_manager(_db_connection)
+    if _unique:
+        index_manager.ensure_unique_constraint(_label, "sysId")
+    else:
+        index_manager.ensure_node_index(_label, "sysId")
+
+
+def get_entity_updates(_config):
+    """
+    The SET clauses for the attributes and constants of an entity config and the condition that the timestamp is set.
     """
     attr_updates = ""
     time_field_condition = ""
@@ -92,6 +64,36 @@ def build_entity(_db_connection, _label, _config):
         constants_updates += ", ".join(
             [f"n.{key} = COALESCE(n.{key}, {attr})" for key, attr in _config["constants"].items()])
 
+    return attr_updates, constants_updates, time_field_condition
+
+
+def get_id_addition(_config):
+    return f"+ '{_config['id_addition']}'" if 'id_addition' in _config else ""
+
+
+def get_type_update(_label, _type_property=None):
+    """
+    SET clause that stamps the type (e.g. n.eventType = 'IncidentEvent') when the entity is created.
+    """
+    return f"SET n.{_type_property} = '{_label}'" if _type_property else ""
+
+
+def get_build_entity_query(_label, _config, _record_label="Record", _type_property=None):
+    iterate_query = """
+        :auto
+        MATCH (l:Log)-[:CONTAINS]->(r:$record_label)
+        WHERE r.$sysId_field IS NOT NULL $log_name_condition $time_field_condition
+        WITH r.$sysId_field $id_addition AS sysId, r
+        CALL (sysId, r) {
+             MERGE (n:$label {sysId: sysId})
+             MERGE (n)-[:EXTRACTED_FROM]->(r)
+             $attr_updates
+             $constants_updates
+             $type_update
+        } IN TRANSACTIONS OF $batch_size ROWS
+    """
+    attr_updates, constants_updates, time_field_condition = get_entity_updates(_config)
+
     query = Query(
         query_str=iterate_query,
         parameters={
@@ -99,77 +101,289 @@ def build_entity(_db_connection, _label, _config):
         },
         template_string_parameters={
             "label": _label,
+            "record_label": _record_label,
             "sysId_field": _config["sysId"],
             "log_name_condition": "AND l.name = $log_name" if _config["log"] else "",
             "time_field_condition": time_field_condition,
             "attr_updates": attr_updates,
             "constants_updates": constants_updates,
-            "id_addition": f"+ '{_config['id_addition']}'" if 'id_addition' in _config else ""
+            "id_addition": get_id_addition(_config),
+            "type_update": get_type_update(_label, _type_property)
+        }
+    )
+    return query
+
+
+def get_build_entities_for_log_query(_log, _label_configs, _record_label="Record", _type_property=None):
+    """
+    Build all entities of the (label, config) pairs of one log in a single pass over its records.
+    Per record, the configs are applied in the given order, each with the same semantics as get_build_entity_query.
+    """
+    iterate_query = """
+        :auto
+        MATCH (l:Log {name: $log_name})-[:CONTAINS]->(r:$record_label)
+        CALL (r) {
+            $entity_subqueries
+        } IN TRANSACTIONS OF $batch_size ROWS
+    """
+
+    entity_subquery = """
+            CALL (r) {
+                WITH r
+                WHERE r.$sysId_field IS NOT NULL $time_field_condition
+                MERGE (n:$label {sysId: r.$sysId_field $id_addition})
+                MERGE (n)-[:EXTRACTED_FROM]->(r)
+                $attr_updates
+                $constants_updates
+                $type_update
+            }"""
+
+    entity_subqueries = []
+    for _label, _config in _label_configs:
+        attr_updates, constants_updates, time_field_condition = get_entity_updates(_config)
+        entity_subqueries.append(Template(entity_subquery).substitute(
+            label=_label,
+            sysId_field=_config["sysId"],
+            time_field_condition=time_field_condition,
+            attr_updates=attr_updates,
+            constants_updates=constants_updates,
+            id_addition=get_id_addition(_config),
+            type_update=get_type_update(_label, _type_property)))
+
+    query = Query(
+        query_str=iterate_query,
+        parameters={
+            "log_name": _log,
+        },
+        template_string_parameters={
+            "record_label": _record_label,
+            "entity_subqueries": "\n".join(entity_subqueries)
         }
     )
+    return query
+
+
+def group_entity_configs_by_log(entities):
+    """
+    Group the (label, config) pairs per log, the logs are ordered by their first config in entities.
+    Configs without log are returned separately, as they read the records of all logs.
+    """
+    configs_per_log = {}
+    configs_without_log = []
+    for _label, _configs in entities.items():
+        for _config in _configs:
+            if _config["log"]:
+                configs_per_log.setdefault(_config["log"], []).append((_label, _config))
+            else:
+                configs_without_log.append((_label, _config))
+    return configs_per_log, configs_without_log
+
+
+def build_entities_for_log(_db_connection, _log, _label_configs, _type_property=None):
+    query = get_build_entities_for_log_query(_log=_log, _label_configs=_label_configs, _type_property=_type_property)
+    _db_connection.exec_query(query)
+    print(f"→ {', '.join(dict.fromkeys(_label for _label, _ in _label_configs))} nodes created from {_log}.")
+
+
+def build_entity(_db_connection, _label, _config, _type_property=None):
+    query = get_build_entity_query(_label=_label, _config=_config, _type_property=_type_property)
     _db_connection.exec_query(query)
     print(f"→ {_label} nodes created.")
 
 
-def build_entities(_db_connection, entities):
+def get_entity_records(_db_connection, _config):
+    """
+    Retrieve the columns of the (:Record) nodes that are needed for an entity config as a DataFrame.
+    The records are streamed from the database and collected in chunks of batch_size rows.
+    """
+    records_query_str = """
+        MATCH (l:Log)-[:CONTAINS]->(r:Record)
+        WHERE r.$sysId_field IS NOT NULL $log_name_condition $time_field_condition
+        RETURN elementId(r) AS recordId, r.$sysId_field $id_addition AS sysId $attr_columns
+    """
+
+    attributes = _config.get("attributes", {})
+    time_field_condition = ""
+    if "timestamp" in attributes:
+        time_field_condition = f"AND r.{attributes['timestamp']} IS NOT NULL"
+
+    query = Query(
+        query_str=records_query_str,
+        parameters={
+            "log_name": _config["log"],
+        },
+        template_string_parameters={
+            "sysId_field": _config["sysId"],
+            "log_name_condition": "AND l.name = $log_name" if _config["log"] else "",
+            "time_field_condition": time_field_condition,
+            "attr_columns": "".join([f", r.{attr} AS {key}" for key, attr in attributes.items()]),
+            "id_addition": get_id_addition(_config)
+        }
+    )
+
+    columns = ["recordId", "sysId"] + list(attributes.keys())
+    batch_size = _db_connection.batch_size
+    chunks = []
+    batch = []
+    with _db_connection.driver.get_session(database=_db_connection.db_name) as session:
+        for record in session.run(query.query_string, **query.kwargs):
+            batch.append(record.values())
+            if len(batch) == batch_size:
+                chunks.append(pd.DataFrame(batch, columns=columns, dtype=object))
+                batch = []
+    chunks.append(pd.DataFrame(batch, columns=columns, dtype=object))
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def aggregate_entity_records(_records, _attribute_keys):
+    """
+    Deduplicate the records by sysId. Per entity, the first non-null value of each attribute is kept, which is the
+    same result as applying n.key = COALESCE(n.key, r.attr) record by record. The ids of all records are kept to
+    create the EXTRACTED_FROM relationships.
+    """
+    grouped = _records.groupby("sysId", sort=False)
+    entities = grouped[_attribute_keys].first() if _attribute_keys else pd.DataFrame(index=grouped.size().index)
+    entities["recordIds"] = grouped["recordId"].agg(list)
+    entities = entities.reset_index()
+
+    # all-null attributes are returned as NaN, these should not be written
+    return entities.astype(object).where(entities.notna(), None)
+
+
+def build_entity_bulk(_db_connection, _label, _config, _type_property=None):
+    """
+    Create the same entities and EXTRACTED_FROM relationships as build_entity, but writes each distinct entity once
+    using UNWIND batches of batch_size rows instead of merging the entity for every record.
+    """
+    write_query_str = """
+        UNWIND $rows AS row
+        MERGE (n:$label {sysId: row.sysId})
+        $attr_updates
+        $constants_updates
+        $type_update
+        WITH n, row
+        UNWIND row.recordIds AS recordId
+        MATCH (r:Record) WHERE elementId(r) = recordId
+        MERGE (n)-[:EXTRACTED_FROM]->(r)
+    """
+
+    attributes = _config.get("attributes", {})
+    attr_updates = ""
+    if attributes:
+        attr_updates += "SET "
+        attr_updates += ", ".join(
+            [f"n.{key} = COALESCE(n.{key}, row.{key})" for key in attributes.keys()])
+
+    constants_updates = ""
+    if "constants" in _config:
+        constants_updates += "SET "
+        constants_updates += ", ".join(
+            [f"n.{key} = COALESCE(n.{key}, {attr})" for key, attr in _config["constants"].items()])
+
+    records = get_entity_records(_db_connection=_db_connection, _config=_config)
+    entities = aggregate_entity_records(_records=records, _attribute_keys=list(attributes.keys()))
+
+    batch_size = _db_connection.batch_size
+    for start in range(0, len(entities), batch_size):
+        query = Query(
+            query_str=write_query_str,
+            parameters={
+                "rows": entities.iloc[start:start + batch_size].to_dict("records")
+            },
+            template_string_parameters={
+                "label": _label,
+                "attr_updates": attr_updates,
+                "constants_updates": constants_updates,
+                "type_update": get_type_update(_label, _type_property)
+            }
+        )
+        _db_connection.exec_query(query)
+
+    print(f"→ {len(entities)} {_label} nodes created from {len(records)} records.")
+
+
+def build_entities(_db_connection, entities, bulk=False, parallel=False, max_workers=4, single_pass=False,
+                   type_property=None):
     """
     Create entities. Includes indexing.
+    By default, every config is built with its own query in the order of the configs, so COALESCE keeps the attribute
+    of the earliest config that sets it.
+    When single_pass is set, the records of each log are read once and all configs of that log are applied per record.
+    Within a log, an attribute of an entity that is set by more than one config then gets the value of the first
+    record that sets it instead of the value of the earliest config.
+    When bulk is set, the entities are aggregated client-side and written using build_entity_bulk.
+    When parallel is set, configs that do not conflict are run concurrently (bulk configs always run serially).
+    When type_property is set ("objectType" or "eventType"), the label is stamped as that property in the same batch
+    that creates the entity, so no IS_OF_TYPE relationships are needed to filter on the type.
     """
     print("\n=== INDEXES ===")
     for _label in entities.keys():
         try:
             create_index(_db_connection=_db_connection,
-                         _label=_label)
+                         _label=_label,
+                         _unique=True)
         except Exception as e:
             print(f"Failed to create index for {_label}: {e}")
+    get_index_manager(_db_connection).await_indexes()
 
     print(f"\n=== Building ENTITY NODES ===")
 
+    if parallel and not bulk:
+        tasks = [(_label, get_entity_footprint(_label, _config),
+                  get_build_entity_query(_label, _config, _type_property=type_property),
+                  ("build_entity", _label, _config, _index))
+                 for _label, _configs in entities.items() for _index, _config in enumerate(_configs)]
+        run_scheduled(_db_connection=_db_connection, tasks=tasks, max_workers=max_workers)
+        return
+
+    if single_pass and not bulk:
+        configs_per_log, configs_without_log = group_entity_configs_by_log(entities)
+        for _log, _label_configs in configs_per_log.items():
+            try:
+                with instrumented_step(_db_connection, "build_entities_for_log", _log,
+                                       [_label for _label, _ in _label_configs]):
+                    build_entities_for_log(_db_connection=_db_connection,
+                                           _log=_log,
+                                           _label_configs=_label_configs,
+                                           _type_property=type_property)
+            except Exception as e:
+                print(f"Failed for {_log}: {e}")
+        # configs without log read all logs and are built separately
+        entities = {}
+        for _label, _config in configs_without_log:
+            entities.setdefault(_label, []).append(_config)
+
     for _label, _configs in entities.items():
-        for _config in _configs:
+        for _index, _config in enumerate(_configs):
             try:
-                build_entity(_db_connection=_db_connection,
-                             _label=_label,
-                             _config=_config)
+                _build_entity = build_entity_bulk if bulk else build_entity
+                with instrumented_step(_db_connection, "build_entity", _label, _config, _index):
+                    _build_entity(_db_connection=_db_connection,
+                                  _label=_label,
+                                  _config=_config,
+                                  _type_property=type_property)
             except Exception as e:
                 print(f"Failed for {_label}: {e}")
 
 
 def build_foreign_key_index(_db_connection, _config):
-    foreign_key_query_str = '''
-                            CREATE INDEX $index_name IF NOT EXISTS
-                                FOR (n:Record) ON (n.$foreign_key) \
-                            '''
-
     for _type in ["from_object", "to_object"]:
         if "foreign_key" in _config[_type]:
-            foreign_key = _config[_type]["foreign_key"]
-
-            foreign_key_index_query = Query(
-                query_str=foreign_key_query_str,
-                parameters={
-                    "index_name": f"record_{foreign_key}_index"
-                },
-                template_string_parameters={
-                    "foreign_key": foreign_key
-                }
-            )
-
-            _db_connection.exec_query(foreign_key_index_query)
-            print(f"Index ensured for :Record({foreign_key})")
+            get_index_manager(_db_connection).ensure_node_index("Record", _config[_type]["foreign_key"])
 
 
-def build_relationship(_db_connection, _type, _config):
+def get_build_relationship_query(_type, _config, _record_label="Record"):
     o2o_query_str = '''
         :auto
-         MATCH (from:$from_object) - [:EXTRACTED_FROM] -> (r:Record) <- [:EXTRACTED_FROM] - (to:$to_object)
+         MATCH (from:$from_object) - [:EXTRACTED_FROM] -> (r:$record_label) <- [:EXTRACTED_FROM] - (to:$to_object)
          $log_condition
          WHERE $condition
          CALL (from, to, r) {
             MERGE (from) - [rel:$type] -> (to)
             $attr_updates
             $constants_updates
-        } IN TRANSACTIONS
+        } IN TRANSACTIONS OF $batch_size ROWS
     '''
 
     attr_updates = ""
@@ -215,26 +429,44 @@ def build_relationship(_db_connection, _type, _config):
             "from_object": from_object["label"],
             "to_object": to_object["label"],
             "type": _type,
+            "record_label": _record_label,
             "attr_updates": attr_updates,
             "constants_updates": constants_updates,
             "log_condition": log_condition
         }
     )
+    return o2o_query
+
 
+def build_relationship(_db_connection, _type, _config):
+    o2o_query = get_build_relationship_query(_type=_type, _config=_config)
     _db_connection.exec_query(o2o_query)
     print(f"→ (:{_config['from_object']}) - [:{_type}] -> (:{_config['to_object']}) Relationship built")
 
 
-def build_relationships(_db_connection, _relationships):
+def build_relationships(_db_connection, _relationships, parallel=False, max_workers=4):
+    """
+    Create relationships. Includes indexing.
+    When parallel is set, configs that do not conflict are run concurrently.
+    """
     print("\n=== INDEXES ===")
     for _type, _configs in _relationships.items():
         for _config in _configs:
             build_foreign_key_index(_db_connection=_db_connection,
                                     _config=_config)
+    get_index_manager(_db_connection).await_indexes()
 
     print("\n=== O2O RELATIONSHIPS ===")
+    if parallel:
+        tasks = [(_type, get_relationship_footprint(_type, _config), get_build_relationship_query(_type, _config),
+                  ("build_relationship", _type, _config, _index))
+                 for _type, _configs in _relationships.items() for _index, _config in enumerate(_configs)]
+        run_scheduled(_db_connection=_db_connection, tasks=tasks, max_workers=max_workers)
+        return
+
     for _type, _configs in _relationships.items():
-        for _config in _configs:
-            build_relationship(_db_connection=_db_connection,
-                               _type=_type,
-                               _config=_config)
+        for _index, _config in enumerate(_configs):
+            with instrumented_step(_db_connection, "build_relationship", _type, _config, _index):
+                build_relationship(_db_connection=_db_connection,
+                                   _type=_type,
+                                   _config=_config)
@@ -0,0 +1,157 @@
+# Import logging and surpress warnings
+import logging
+from typing import List
+from weakref import WeakKeyDictionary
+
+logging.getLogger("neo4j").setLevel(logging.ERROR)
+logging.getLogger("pd").setLevel(logging.ERROR)
+
+import numpy as np
+import pandas as pd
+
+# Import promg
+from promg import Query
+
+from util.db_helper_functions import get_count_store_statistics
+
+# per connection: object type -> (graph version, event log)
+_event_logs = WeakKeyDictionary()
+
+
+#######################################################################
+########################## EVENT LOG CACHE ############################
+#######################################################################
+
+def get_graph_version(_db_connection):
+    """
+    Marker that changes when nodes or relationships are added or removed, taken from the count store.
+    Changes to properties only (e.g. the activity of an event) are not detected, use clear_event_log_cache for these.
+    """
+    return tuple(sorted(get_count_store_statistics(_db_connection)))
+
+
+def clear_event_log_cache(_db_connection):
+    _event_logs.pop(_db_connection, None)
+
+
+def load_event_log(_db_connection, _object_type: str):
+    """
+    Pull all (object, event) pairs of objects of type :_object_type in one traversal, for all event types, into a
+    compact columnar frame: objects, event types and activities are integer-encoded (categorical) and the timestamps
+    are kept as epoch seconds and nanoseconds.
+    Column paths is the number of relationships between the object and the event.
+    """
+    q_event_log_str = '''
+        MATCH (o:$object_label) - [r] - (e:Event|HighLevelEvent)
+        WHERE e.eventType IS NOT NULL AND NOT r:SEQ
+        WITH o, e, count(*) as paths
+        WITH o, e, paths, coalesce(e.timestamp, e.startTime) as timestamp
+        RETURN o.sysId as objectId, elementId(e) as eventId, e.eventType as eventType, e.activity as activity,
+            timestamp.epochSeconds as seconds, timestamp.nanosecond as nanoseconds, paths
+    '''
+
+    q_event_log = Query(query_str=q_event_log_str,
+                        template_string_parameters={'object_label': _object_type})
+
+    event_log = pd.DataFrame(_db_connection.exec_query(q_event_log),
+                             columns=['objectId', 'eventId', 'eventType', 'activity', 'seconds', 'nanoseconds',
+                                      'paths'])
+
+    # events without timestamp are ordered last
+    max_int = np.iinfo(np.int64).max
+    return pd.DataFrame({
+        'object': pd.factorize(event_log['objectId'])[0].astype(np.int32),
+        'objectId': event_log['objectId'].astype('category'),
+        'event': pd.factorize(event_log['eventId'], sort=True)[0].astype(np.int32),
+        'eventType': event_log['eventType'].astype('category'),
+        # sorted categories, so that the codes follow the ordering of the activity names
+        'activity': pd.Categorical(event_log['activity'],
+                                   categories=sorted(event_log['activity'].dropna().unique())),
+        'seconds': event_log['seconds'].fillna(max_int).to_numpy(dtype=np.int64),
+        'nanoseconds': event_log['nanoseconds'].fillna(0).to_numpy(dtype=np.int64),
+        'paths': event_log['paths'].to_numpy(dtype=np.int32)
+    })
+
+
+def get_event_log(_db_connection, _object_type: str, _event_types: List[str] = None):
+    """
+    Return the (cached) event log of :_object_type, restricted to _event_types.
+    The event log is loaded again when the graph version changed since it was cached.
+    """
+    version = get_graph_version(_db_connection)
+    cache = _event_logs.setdefault(_db_connection, {})
+    if _object_type not in cache or cache[_object_type][0] != version:
+        cache[_object_type] = (version, load_event_log(_db_connection, _object_type))
+
+    event_log = cache[_object_type][1]
+    if _event_types is None:
+        return event_log
+    return event_log[event_log['eventType'].isin(_event_types)]
+
+
+#######################################################################
+############################## VARIANTS ###############################
+#######################################################################
+
+def _variant_string(_activities, _activity_codes):
+    return " - ".join(f"({_activities[code]})" for code in _activity_codes)
+
+
+def _count_variants(_variants: pd.Series, _name: str):
+    """
+    Count the objects per variant, _variants contains a tuple of activity codes per object.
+    """
+    counts = _variants.value_counts(sort=True).rename_axis(_name).reset_index(name='count_objects')
+    counts[f'%_{_name}'] = round(counts['count_objects'] / counts['count_objects'].sum() * 100, 2)
+    return counts
+
+
+def compute_length_statistics(_event_log: pd.DataFrame):
+    lengths = _event_log.groupby('object', sort=False)['paths'].sum()
+    return pd.DataFrame([{
+        'min_length': lengths.min(),
+        'max_length': lengths.max(),
+        'avg_length': lengths.mean(),
+        'stDev_length': lengths.std()
+    }]) if len(lengths) > 0 else pd.DataFrame(columns=['min_length', 'max_length', 'avg_length', 'stDev_length'])
+
+
+def compute_set_variants(_event_log: pd.DataFrame):
+    activities = _event_log['activity'].cat.categories
+    pairs = pd.DataFrame({'object': _event_log['object'].to_numpy(),
+                          'activity': _event_log['activity'].cat.codes.to_numpy()})
+    objects = pairs['object'].unique()
+    pairs = pairs[pairs['activity'] >= 0].drop_duplicates().sort_values(['object', 'activity'])
+    variants = pairs.groupby('object', sort=False)['activity'].agg(tuple).reindex(objects, fill_value=())
+    result = _count_variants(variants, 'set_variant')
+    result['set_variant'] = [_variant_string(activities, variant) for variant in result['set_variant']]
+    return result
+
+
+def compute_sequence_variants(_event_log: pd.DataFrame):
+    activities = _event_log['activity'].cat.categories
+    activity_codes = _event_log['activity'].cat.codes.to_numpy()
+    objects = _event_log['object'].to_numpy()
+    order = np.lexsort((_event_log['event'].to_numpy(), _event_log['nanoseconds'].to_numpy(),
+                        _event_log['seconds'].to_numpy(), objects))
+    ordered = pd.DataFrame({'object': objects[order], 'activity': activity_codes[order]})
+    variants = ordered[ordered['activity'] >= 0].groupby('object', sort=False)['activity'].agg(tuple) \
+        .reindex(pd.unique(objects), fill_value=())
+    result = _count_variants(variants, 'sequence_variant')
+    result['length'] = [len(variant) for variant in result['sequence_variant']]
+    result['sequence_variant'] = [_variant_string(activities, variant) for variant in result['sequence_variant']]
+    return result
+
+
+def compute_bag_variants(_event_log: pd.DataFrame):
+    activities = _event_log['activity'].cat.categories
+    bags = pd.DataFrame({'object': _event_log['object'].to_numpy(),
+                         'activity': _event_log['activity'].cat.codes.to_numpy()})
+    objects = bags['object'].unique()
+    bags = bags[bags['activity'] >= 0].groupby(['object', 'activity'], sort=True).size().reset_index(name='count')
+    variants = bags.groupby('object', sort=False)[['activity', 'count']].apply(
+        lambda bag: tuple(zip(bag['activity'], bag['count']))).reindex(objects, fill_value=())
+    result = _count_variants(variants, 'bag_variant')
+    result['bag_variant'] = [" - ".join(f"({activities[code]})x{count}" for code, count in variant)
+                             for variant in result['bag_variant']]
+    return result